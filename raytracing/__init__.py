@@ -30,6 +30,9 @@ from .ray import *
 from .rays import *
 from .compact import *
 from .imagingpath import *
+from .executor import *
+from .histograms import *
+from .raystatistics import *
 
 """ ABCD matrices for gaussian beams """
 from .gaussianbeam import *
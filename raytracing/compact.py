@@ -16,6 +16,11 @@ This module solves the problem with a **view pattern**:
 This way, Python code can keep using familiar ``ray.y`` syntax while the
 underlying memory layout is ready to be sent to the GPU in a single transfer.
 
+``ColumnarRays`` keeps the same data as one array per property (a struct of
+arrays) instead, for the analysis of many rays on the CPU: the heights or the
+angles of all rays are contiguous numpy arrays, and ``ColumnarRay`` is the view
+of one ray.
+
 ``CompactRaytrace`` and ``CompactRaytraces`` add a second level of
 organisation on top of the output buffer, slicing it into per-ray traces
 (one trace = one input ray propagated through all optical elements).
@@ -28,7 +33,7 @@ raytracing.rays : The base ``Rays`` collection.
 
 import numpy as np
 from .ray import Ray
-from .rays import Rays, RayTrace, RayTraces
+from .rays import Rays, RayTrace, RayTraces, RandomRays, RandomUniformRays
 
 class CompactRay(Ray):
     """A view into a shared buffer that behaves like a ``Ray``.
@@ -41,7 +46,10 @@ class CompactRay(Ray):
 
     The memory layout of a single ray is defined by ``CompactRay.Struct``,
     a numpy structured dtype with fields: *y*, *theta*, *z*, *isBlocked*,
-    *apertureDiameter*, and *wavelength* (all 32-bit).
+    *apertureDiameter*, and *wavelength* (all 32-bit). ``CompactRay.Struct64``
+    is the same layout in double precision (the floats are 64-bit, padded
+    like the equivalent C struct), for when accuracy matters more than
+    memory and throughput. The view uses the layout of its buffer.
 
     Parameters
     ----------
@@ -64,6 +72,53 @@ class CompactRay(Ray):
                       ("wavelength", np.float32)
                       ])
 
+    Struct64 = np.dtype([("y", np.float64),
+                        ("theta", np.float64),
+                        ("z", np.float64),
+                        ("isBlocked", np.int32),
+                        ("apertureDiameter", np.float64),
+                        ("wavelength", np.float64)
+                        ], align=True)
+
+    @staticmethod
+    def structFor(precision=None):
+        """The structured dtype of a ray for the requested floating-point precision.
+
+        Parameters
+        ----------
+        precision : str or numpy dtype, optional
+            ``"float32"`` (or ``np.float32``) for ``CompactRay.Struct``, ``"float64"``
+            (or ``np.float64``) for ``CompactRay.Struct64``. (Default=None, float32)
+
+        Returns
+        -------
+        struct : numpy.dtype
+            The structured dtype of a single ray.
+
+        Raises
+        ------
+        ValueError
+            If the precision is not float32 or float64.
+
+        Examples
+        --------
+        >>> CompactRay.structFor("float64").itemsize
+        48
+        """
+        if precision is None:
+            return CompactRay.Struct
+
+        try:
+            precision = np.dtype(precision)
+        except TypeError:
+            raise ValueError("The precision must be float32 or float64, not {0}".format(precision))
+
+        if precision == np.float32:
+            return CompactRay.Struct
+        elif precision == np.float64:
+            return CompactRay.Struct64
+        raise ValueError("The precision must be float32 or float64, not {0}".format(precision))
+
     def __init__(self, raysSource, index):
         """Create a view for one ray inside the shared buffer.
 
@@ -77,12 +132,14 @@ class CompactRay(Ray):
         super().__init__()
         self.rays = raysSource
         self.index = index
-        self.array = np.frombuffer(self.rays.buffer, dtype=CompactRay.Struct, count=1, offset=CompactRay.Struct.itemsize * self.index)
+        struct = self.rays._rays.dtype
+        self.array = np.frombuffer(self.rays.buffer, dtype=struct, count=1, offset=struct.itemsize * self.index)
 
     @property
     def elementAsStruct(self):
         if self.array is None:
-            self.array = np.frombuffer(self.rays.buffer, dtype=CompactRay.Struct, count=1, offset=CompactRay.Struct.itemsize * self.index)
+            struct = self.rays._rays.dtype
+            self.array = np.frombuffer(self.rays.buffer, dtype=struct, count=1, offset=struct.itemsize * self.index)
         return self.array[0]
 
     def assign(self, ray):
@@ -166,53 +223,100 @@ class CompactRays(Rays):
        copies each ray into it, converting from Python objects to the compact
        layout.
 
+    The buffer holds 32-bit floats by default (``CompactRay.Struct``), which
+    halves the memory and the transfers to the GPU. With ``precision="float64"``
+    it holds ``CompactRay.Struct64`` instead. The tracing engines keep the
+    precision of their input rays.
+
     Parameters
     ----------
     compactRaysStructuredBuffer : buffer, optional
-        A pre-existing contiguous buffer of ``CompactRay.Struct`` data.
+        A pre-existing contiguous buffer of ``CompactRay.Struct`` data
+        (or ``CompactRay.Struct64`` data with ``precision="float64"``). A numpy
+        structured array keeps its own layout if no precision is given.
     maxCount : int, optional
         Number of ray slots to allocate (zero-filled).
     rays : list of Ray, optional
-        Regular ``Ray`` objects to convert into the compact layout.
+        Regular ``Ray`` objects to convert into the compact layout. A
+        ``CompactRays`` or a ``ColumnarRays`` keeps its precision if no
+        precision is given. The
+        missing rays of a ``RandomRays`` are drawn directly in the buffer, see
+        ``fillWithRandomRays()``.
+    precision : str or numpy dtype, optional
+        ``"float32"`` or ``"float64"``, see ``CompactRay.structFor()``.
+        (Default=None, float32 unless the source has its own layout)
 
     Raises
     ------
     ValueError
-        If none of the three construction arguments is provided.
+        If none of the three construction arguments is provided, or if the
+        precision is not float32 or float64.
+
+    Examples
+    --------
+    >>> rays = CompactRays(maxCount=10, precision="float64")
+    >>> rays.precision
+    'float64'
 
     See Also
     --------
     CompactRay : A view into one slot of this buffer.
     """
 
-    def __init__(self, compactRaysStructuredBuffer=None, maxCount=None, rays=None):
+    def __init__(self, compactRaysStructuredBuffer=None, maxCount=None, rays=None, precision=None):
         super().__init__()
+        struct = CompactRay.structFor(precision)
 
         if compactRaysStructuredBuffer is not None:
+            if precision is None and isinstance(compactRaysStructuredBuffer, np.ndarray) and compactRaysStructuredBuffer.dtype.names is not None:
+                struct = compactRaysStructuredBuffer.dtype
             self.buffer = compactRaysStructuredBuffer
-            self._rays = np.frombuffer(self.buffer, dtype=CompactRay.Struct)
+            self._rays = np.frombuffer(self.buffer, dtype=struct)
             self.maxCount = len(self._rays)
         elif maxCount is not None:
-            self._rays = np.zeros((maxCount,), dtype=CompactRay.Struct)
+            self._rays = np.zeros((maxCount,), dtype=struct)
             self.buffer = self._rays.data
             self.maxCount = maxCount
         elif rays is not None:
-            self._rays = np.zeros((len(rays),), dtype=CompactRay.Struct)
+            if isinstance(rays, CompactRays):
+                if precision is None:
+                    struct = rays._rays.dtype
+                self._rays = rays._rays.astype(struct)
+            elif isinstance(rays, Rays) and rays._uncreatedRayArrays() is not None:
+                # A grid of rays, without its Ray objects
+                y, theta = rays._uncreatedRayArrays()
+                self._rays = np.zeros((len(y),), dtype=struct)
+                self._rays['y'] = y
+                self._rays['theta'] = theta
+                self._rays['apertureDiameter'] = float("+Inf")
+                self._rays['wavelength'] = np.nan
+            elif isinstance(rays, RandomRays) and rays.hasRandomRayArrays():
+                self._rays = np.zeros((len(rays),), dtype=struct)
+                self.fillWithRandomRays(rays)
+            elif isinstance(rays, ColumnarRays):
+                if precision is None:
+                    struct = CompactRay.structFor(rays.precision)
+                self._rays = np.zeros((len(rays),), dtype=struct)
+                for field in ColumnarRays.fields:
+                    self._rays[field] = rays._fieldValues(field)
+            else:
+                # One tuple per ray, in the order of the fields of the struct
+                self._rays = np.array([(ray.y, ray.theta, ray.z, ray.isBlocked,
+                                        ray.apertureDiameter, ray.wavelength) for ray in rays],
+                                      dtype=struct).reshape((-1,))
             self.buffer = self._rays.data
-            self.maxCount = len(rays)
-
-            for i, ray in enumerate(rays):
-                CompactRay(self, i).assign(ray)
+            self.maxCount = len(self._rays)
 
         else:
             raise ValueError('You must provide a buffer or a maxCount')
 
-    def fillWithRandomUniform(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None):
+    def fillWithRandomUniform(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, seed=None):
         """Fill the buffer with rays at random heights and angles.
 
         Each ray receives a uniformly distributed height in [yMin, yMax]
         and angle in [thetaMin, thetaMax]. If the minimum values are not
-        given, symmetric ranges around zero are used.
+        given, symmetric ranges around zero are used. With a seed, the rays
+        are the same as those of ``RandomUniformRays`` with the same seed.
 
         Parameters
         ----------
@@ -224,6 +328,9 @@ class CompactRays(Rays):
             Maximum angle in radians. (Default=pi/2)
         thetaMin : float, optional
             Minimum angle in radians. Defaults to ``-thetaMax``.
+        seed : None, int, numpy.random.SeedSequence or numpy.random.Generator
+            The seed of the random rays, see ``RandomRays``. (Default=None, the
+            global numpy.random functions are used)
         """
         if yMin is None:
             yMin = -yMax
@@ -231,8 +338,70 @@ class CompactRays(Rays):
             thetaMin = -thetaMax
 
         n = len(self._rays)
-        self._rays['y'] = np.random.uniform(yMin, yMax, n).astype(np.float32)
-        self._rays['theta'] = np.random.uniform(thetaMin, thetaMax, n).astype(np.float32)
+        if seed is None:
+            self._rays['y'] = np.random.uniform(yMin, yMax, n)
+            self._rays['theta'] = np.random.uniform(thetaMin, thetaMax, n)
+            return
+
+        randomRays = RandomUniformRays(yMax=yMax, yMin=yMin, thetaMax=thetaMax, thetaMin=thetaMin, maxCount=n, seed=seed)
+        start = 0
+        for y, theta in randomRays.randomRayBlocks(0, n):
+            self._rays['y'][start:start + len(y)] = y
+            self._rays['theta'][start:start + len(y)] = theta
+            start += len(y)
+
+    def fillWithRandomRays(self, randomRays):
+        """Fill the buffer with the rays of a random source, without creating
+        ``Ray`` objects: the rays the source already generated are copied, and
+        the others are drawn in blocks with ``randomRays.randomRayBlocks()``.
+        With a seed, the rays are the same as those obtained by iterating over
+        the source.
+
+        Parameters
+        ----------
+        randomRays : RandomRays
+            The source, e.g. ``RandomLambertianRays``. Its first ``len(self)``
+            rays are used.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> source = RandomLambertianRays(yMax=1, maxCount=100000, seed=1)
+        >>> rays = CompactRays(maxCount=len(source))
+        >>> rays.fillWithRandomRays(source)
+        """
+        n = min(len(self._rays), len(randomRays))
+        generated = min(len(randomRays._rays), n)
+        for i, ray in enumerate(randomRays._rays[:generated]):
+            self._rays[i] = (ray.y, ray.theta, ray.z, ray.isBlocked, ray.apertureDiameter, ray.wavelength)
+
+        self._rays['z'][generated:n] = 0
+        self._rays['isBlocked'][generated:n] = False
+        self._rays['apertureDiameter'][generated:n] = float("+Inf")
+        self._rays['wavelength'][generated:n] = np.nan
+
+        start = generated
+        for y, theta in randomRays.randomRayBlocks(generated, n):
+            self._rays['y'][start:start + len(y)] = y
+            self._rays['theta'][start:start + len(y)] = theta
+            start += len(y)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['buffer']  # A memoryview cannot be pickled: it is recreated from the array
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.buffer = self._rays.data
+
+    @property
+    def precision(self):
+        """ The floating-point precision of the buffer, "float32" or "float64" """
+        return self._rays.dtype['y'].name
+
+    def _fieldValues(self, field):
+        return self._rays[field]
 
     def __getitem__(self, index):
         return CompactRay(self, index)
@@ -240,10 +409,6 @@ class CompactRays(Rays):
     def __setitem__(self, index, value):
         CompactRay(self, index).assign(value)
 
-    def __iter__(self):
-        self.iteration = 0
-        return self
-
     def __next__(self) -> CompactRay:
 
         if self.iteration < len(self):
@@ -268,6 +433,347 @@ class CompactRays(Rays):
     def append(self, tuple):
         raise RuntimeError('You can only replace elements from a pre-allocated CompactRays')
 
+    def extend(self, rays, copy=False):
+        raise RuntimeError('You can only replace elements from a pre-allocated CompactRays: use ColumnarRays to add rays')
+
+class ColumnarRay(Ray):
+    """A view into one position of a ``ColumnarRays`` that behaves like a ``Ray``.
+
+    Like ``CompactRay``, every read and write goes directly into the arrays
+    of the owning ``ColumnarRays``. A wavelength that is not defined is stored
+    as NaN and read as None, as with a ``Ray``.
+
+    Parameters
+    ----------
+    raysSource : ColumnarRays
+        The rays that hold the actual data.
+    index : int
+        Position of this ray in the arrays (0-based).
+
+    See Also
+    --------
+    ColumnarRays : The arrays that own the data.
+    """
+
+    def __init__(self, raysSource, index):
+        super().__init__()
+        self.rays = raysSource
+        self.index = index
+
+    def assign(self, ray):
+        """Copy all fields from a regular ``Ray`` into this position.
+
+        Parameters
+        ----------
+        ray : Ray
+            The source ray whose fields will be copied.
+        """
+        self.y = ray.y
+        self.theta = ray.theta
+        self.z = ray.z
+        self.wavelength = ray.wavelength
+        self.isBlocked = ray.isBlocked
+        self.apertureDiameter = ray.apertureDiameter
+
+    @property
+    def y(self):
+        return self.rays._columns['y'][self.index]
+    @y.setter
+    def y(self, value):
+        self.rays._columns['y'][self.index] = value
+
+    @property
+    def theta(self):
+        return self.rays._columns['theta'][self.index]
+    @theta.setter
+    def theta(self, value):
+        self.rays._columns['theta'][self.index] = value
+
+    @property
+    def z(self):
+        return self.rays._columns['z'][self.index]
+    @z.setter
+    def z(self, value):
+        self.rays._columns['z'][self.index] = value
+
+    @property
+    def isBlocked(self):
+        return bool(self.rays._columns['isBlocked'][self.index])
+    @isBlocked.setter
+    def isBlocked(self, value):
+        self.rays._columns['isBlocked'][self.index] = bool(value)
+
+    @property
+    def apertureDiameter(self):
+        return self.rays._columns['apertureDiameter'][self.index]
+    @apertureDiameter.setter
+    def apertureDiameter(self, value):
+        self.rays._columns['apertureDiameter'][self.index] = value
+
+    @property
+    def wavelength(self):
+        wavelength = self.rays._columns['wavelength'][self.index]
+        if np.isnan(wavelength):
+            return None
+        return wavelength
+    @wavelength.setter
+    def wavelength(self, value):
+        self.rays._columns['wavelength'][self.index] = np.nan if value is None else value
+
+
+class ColumnarRays(Rays):
+    """Rays stored as one numpy array per property (a struct of arrays).
+
+    ``Rays`` keeps a list of ``Ray`` objects (a few hundred bytes each) and
+    ``CompactRays`` one structured array (an array of structs for the GPU).
+    ``ColumnarRays`` keeps the heights, the angles, the positions, etc. in
+    separate contiguous arrays: ``yValues``, ``thetaValues``, ``zValues``,
+    ``isBlockedValues``, ``apertureDiameterValues`` and ``wavelengthValues`` are
+    views of these arrays, without copies, and the histograms are computed
+    directly on them. A ray takes 21 bytes in float32 and 41 bytes in float64.
+
+    It has the interface of ``Rays``: indexing and iteration give
+    ``ColumnarRay`` views, and ``count``, ``rayCountHistogram()`` or
+    ``display()`` work the same. ``append()`` and ``extend()`` grow the arrays
+    by doubling their capacity, and ``reserve()`` preallocates them.
+
+    Parameters
+    ----------
+    rays : list of Ray, Rays or CompactRays, optional
+        The rays to copy. Random rays and grids of rays (e.g.
+        ``RandomLambertianRays`` or ``UniformRays``) are copied from their
+        arrays, without ``Ray`` objects.
+    y, theta : array_like, optional
+        The heights and angles of the rays, instead of rays.
+    z, isBlocked, apertureDiameter, wavelength : array_like, optional
+        The other properties of the rays given with y and theta. (Default=None,
+        at z=0, not blocked, without aperture and wavelength)
+    precision : str or numpy dtype, optional
+        ``"float32"`` or ``"float64"``, see ``CompactRay.structFor()``.
+        (Default=None, float32 unless rays is a ``CompactRays`` or ``ColumnarRays``
+        with its own precision)
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> rays = ColumnarRays(rays=RandomLambertianRays(maxCount=100000, seed=1))
+    >>> rays.yValues.shape
+    (100000,)
+    >>> outputRays = ColumnarRays(rays=ImagingPath([Space(d=10), Aperture(diameter=1)]).traceManyThroughNumpy(rays))
+
+    See Also
+    --------
+    CompactRays : The same rays as an array of structs.
+    ColumnarRay : A view into one position of the arrays.
+    """
+
+    fields = ("y", "theta", "z", "isBlocked", "apertureDiameter", "wavelength")
+
+    def __init__(self, rays=None, y=None, theta=None, z=None, isBlocked=None, apertureDiameter=None,
+                 wavelength=None, precision=None):
+        super().__init__()
+        self._rays = None  # The rays are in the columns
+
+        if rays is not None:
+            if precision is None and isinstance(rays, (CompactRays, ColumnarRays)):
+                precision = rays.precision
+            if not isinstance(rays, (CompactRays, ColumnarRays)):
+                rays = CompactRays(rays=rays, precision=precision)
+            columns = {field: rays._fieldValues(field) for field in self.fields}
+        elif y is not None and theta is not None:
+            columns = {"y": y, "theta": theta, "z": z, "isBlocked": isBlocked,
+                       "apertureDiameter": apertureDiameter, "wavelength": wavelength}
+        elif y is None and theta is None:
+            columns = {}
+        else:
+            raise ValueError("The heights y and the angles theta must be given together.")
+
+        floatType = CompactRay.structFor(precision)['y']
+        count = len(np.atleast_1d(columns.get("y", [])))
+        defaults = {"y": 0, "theta": 0, "z": 0, "isBlocked": False, "apertureDiameter": float("+Inf"), "wavelength": np.nan}
+
+        self._columns = {}
+        for field in self.fields:
+            dtype = bool if field == "isBlocked" else floatType
+            column = np.empty((count,), dtype=dtype)
+            values = columns.get(field)
+            column[:] = defaults[field] if values is None else np.asarray(values).reshape((-1,))
+            self._columns[field] = column
+        self._count = count
+
+    def _fieldValues(self, field):
+        return self._columns[field][:self._count]
+
+    @property
+    def precision(self):
+        """ The floating-point precision of the arrays, "float32" or "float64" """
+        return self._columns['y'].dtype.name
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ColumnarRays(**{field: self._fieldValues(field)[index] for field in self.fields},
+                                precision=self.precision)
+
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
+            raise IndexError(f"Index {index} out of bound, min = 0, max {self._count}.")
+        return ColumnarRay(self, index)
+
+    def __setitem__(self, index, value):
+        self[index].assign(value)
+        self._invalidateCachedValues()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_columns'] = {field: self._fieldValues(field).copy() for field in self.fields}
+        return state
+
+    def __next__(self) -> ColumnarRay:
+        if self.iteration < len(self):
+            ray = self[self.iteration]
+            self.iteration += 1
+            return ray
+
+        raise StopIteration
+
+    @property
+    def rays(self):
+        """ A list of ``Ray`` objects with a copy of the values. """
+        rays = []
+        for y, theta, z, isBlocked, apertureDiameter, wavelength in zip(*[self._fieldValues(field).tolist()
+                                                                          for field in self.fields]):
+            ray = Ray(y, theta, z, isBlocked, None if np.isnan(wavelength) else wavelength)
+            ray.apertureDiameter = apertureDiameter
+            rays.append(ray)
+        return rays
+
+    @property
+    def yValues(self):
+        """ The heights of the rays (a view of the array, not a copy). """
+        return self._fieldValues('y')
+
+    @property
+    def thetaValues(self):
+        """ The angles of the rays (a view of the array, not a copy). """
+        return self._fieldValues('theta')
+
+    @property
+    def zValues(self):
+        """ The positions of the rays (a view of the array, not a copy). """
+        return self._fieldValues('z')
+
+    @property
+    def isBlockedValues(self):
+        """ True for the blocked rays (a view of the array, not a copy). """
+        return self._fieldValues('isBlocked')
+
+    @property
+    def apertureDiameterValues(self):
+        """ The diameter of the last aperture of each ray (a view of the array, not a copy). """
+        return self._fieldValues('apertureDiameter')
+
+    @property
+    def wavelengthValues(self):
+        """ The wavelengths of the rays, NaN if not defined (a view of the array, not a copy). """
+        return self._fieldValues('wavelength')
+
+    def append(self, ray, copy=False):
+        """ Appends a copy of the ray at the end of the arrays, which double
+        their capacity when they are full.
+
+        Parameters
+        ----------
+        ray : Ray
+            The ray to append. Its values are always copied.
+        """
+        if not isinstance(ray, Ray):
+            raise TypeError("'ray' must be a 'Ray' object.")
+
+        if self._count == self.capacity:
+            self.reserve(max(2 * self._count, 16))
+
+        self._count += 1
+        self[self._count - 1].assign(ray)
+        self._invalidateCachedValues()
+
+    def extend(self, rays, copy=False):
+        """ Appends many rays at once: the arrays grow once (to at least double
+        their capacity) and the values are copied column by column, without a
+        ``Ray`` object from a ``CompactRays`` or ``ColumnarRays``.
+
+        Parameters
+        ----------
+        rays : iterable of Ray, CompactRays or ColumnarRays
+            The rays to append. Their values are always copied.
+
+        Raises
+        ------
+        TypeError
+            If one of the elements is not a Ray.
+        """
+        if isinstance(rays, (CompactRays, ColumnarRays)):
+            columns = {field: rays._fieldValues(field) for field in self.fields}
+            count = len(rays)
+        else:
+            rays = list(rays)
+            if not all(isinstance(ray, Ray) for ray in rays):
+                raise TypeError("'rays' elements must be of type Ray.")
+            columns = {field: [getattr(ray, field) for ray in rays] for field in self.fields}
+            columns['wavelength'] = [np.nan if wavelength is None else wavelength for wavelength in columns['wavelength']]
+            count = len(rays)
+
+        if self._count + count > self.capacity:
+            self.reserve(max(2 * self.capacity, self._count + count))
+
+        for field in self.fields:
+            self._columns[field][self._count:self._count + count] = columns[field]
+        self._count += count
+        self._invalidateCachedValues()
+
+    @property
+    def capacity(self):
+        """ The number of rays the arrays can hold before they must grow. """
+        return len(self._columns['y'])
+
+    def reserve(self, capacity):
+        """ Grows the arrays to hold at least capacity rays, so that appending
+        up to that number of rays does not copy the arrays again.
+
+        Parameters
+        ----------
+        capacity : int
+            The number of rays.
+        """
+        if capacity <= self.capacity:
+            return
+
+        for field in self.fields:
+            column = np.empty((capacity,), dtype=self._columns[field].dtype)
+            column[:self._count] = self._columns[field][:self._count]
+            self._columns[field] = column
+
+    def load(self, filePath, append=False):
+        """ Loads rays saved with save(), in any of its formats.
+
+        Parameters
+        ----------
+        filePath : str or PathLike or file-like object
+            A path, or a Python file-like object, or possibly some backend-dependent object.
+        append : bool
+            If True, the loaded rays will be appended to the current rays.
+        """
+        loadedRays = Rays()
+        loadedRays.load(filePath)
+        if not append:
+            self._count = 0
+            self._invalidateCachedValues()
+        self.extend(loadedRays)
+
+
 class CompactRaytrace(RayTrace):
     """A view into a slice of a ``CompactRays`` buffer representing one ray trace.
 
@@ -276,7 +782,7 @@ class CompactRaytrace(RayTrace):
     entries in the output buffer form one *trace*. ``CompactRaytrace`` gives
     convenient access to that slice without copying any data.
 
-    Inherits ``__str__``, ``__repr__``, ``__iter__``, and ``__next__`` from
+    Inherits ``__str__``, ``__repr__`` and ``__iter__`` from
     ``RayTrace``. Overrides ``__len__`` and ``__getitem__`` for buffer access.
 
     Parameters
@@ -312,7 +818,7 @@ class CompactRaytraces(RayTraces):
     input ray, so that ``traces[i]`` gives the full journey of the *i*-th ray
     through the optical system.
 
-    Inherits ``__str__``, ``__repr__``, ``__iter__``, and ``__next__`` from
+    Inherits ``__str__``, ``__repr__`` and ``__iter__`` from
     ``RayTraces``. Overrides ``__len__`` and ``__getitem__`` for buffer access.
 
     Parameters
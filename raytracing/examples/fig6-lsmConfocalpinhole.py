@@ -122,47 +122,40 @@ def optimalPinholeSize():
     return pinholeIdeal
 
 
-def rayEfficiency(pinholeFactor=None, focalSpotPosition2=None):
+def rayEfficiency(pinholeFactor=None, focalSpotPositions=None):
     """
-    Determines the amount of rays emitted from the object that are detected at the pinhole plane. 
+    Determines the amount of rays emitted from the object that are detected at the pinhole plane,
+    for every position of the focal spot. All positions are traced at once with sweep().
 
     Parameter
     ---------
         pinholeFactor : Float
             Factor changing the pinhole size according to the ideal pinhole size. 
 
-        focalSpotPosition : float
-            Position of the focal spot according to the objective (first lens)
+        focalSpotPositions : list of float
+            Positions of the focal spot according to the objective (first lens)
 
     Returns
     -------
-        illumination : object of ImagingPath class.
-            Returns the illumination path
+        efficiencies : array
+            Returns the transmission efficiency for each position of the focal spot
     """
 
-    illumination2 = path(focalSpotPosition2)
+    illumination2 = path()
 
     pinholeSize = optimalPinholeSize() * pinholeFactor
     illumination2.append(Aperture(diameter=pinholeSize))
 
-    # Counts how many rays make it through the pinhole
-    outputRays2 = illumination2.traceManyThroughInParallel(inputRays, progress=False)
-
-    return outputRays2.count / inputRays.count
+    # Counts how many rays make it through the pinhole, for all positions of the focal spot
+    return illumination2.sweep(0, "d", focalSpotPositions, inputRays)
 
 
 def exampleCode(comments=None):
     # Pinhole sectioning
+    newPositions = [5 + (z * 0.000001) for z in positions]
     for pinhole in pinholeModifier:
         print("\nComputing transmission for pinhole size {0:0.1f}".format(pinhole))
-
-        efficiencyValues = []
-        for z in positions:
-            print(".",end='')
-            newPosition = 5 + (z * 0.000001)
-            efficiency = rayEfficiency(pinholeFactor=pinhole, focalSpotPosition2=newPosition)
-            efficiencyValues.append(efficiency)
-        pinholeModifier[pinhole] = efficiencyValues
+        pinholeModifier[pinhole] = list(rayEfficiency(pinholeFactor=pinhole, focalSpotPositions=newPositions))
 
 
     plt.plot(positions, pinholeModifier[1 / 3], 'k:', label='Small pinhole', linestyle='dashed')
@@ -177,10 +170,11 @@ def exampleCode(comments=None):
     # Position of ray versus scan angle
     path1 = illuminationPath1()
     outputRays1 = path1.traceManyThrough(scanRays)
+    progressLog = scanRays.progressLog
     for i in range(len(outputRays1)):
         thetas.append(scanRays[i].theta*180/np.pi)
         positions1.append(outputRays1[i].y*1000)
-        scanRays.displayProgress()
+        progressLog = scanRays.displayProgress(iteration=i + 1, progressLog=progressLog)
 
     plt.plot(thetas,positions1)
     plt.xlabel('Scan angle (degrees)', fontsize=20)
@@ -68,11 +68,12 @@ def illuminationPath():
 
 path = illuminationPath()
 outputRays = path.traceManyThrough(scanRays)
+progressLog = scanRays.progressLog
 for i in range(len(outputRays)):
     thetas.append(scanRays[i].theta*180/np.pi)
     positions.append(outputRays[i].y*1000)
 
-    scanRays.displayProgress()
+    progressLog = scanRays.displayProgress(iteration=i + 1, progressLog=progressLog)
 
 plt.plot(thetas,positions)
 plt.xlabel('Scan angle (degrees)')
@@ -0,0 +1,264 @@
+"""A pool of warm processes to trace rays through many optical paths.
+
+``Matrix.traceManyThroughInParallel()`` creates a pool of processes, sends the
+optical path and the rays, and closes the pool at every call. When a path is
+traced many times (e.g., a sweep over the position of a pinhole, or the same
+path with many sets of rays), starting the processes and sending the path again
+take longer than tracing.
+
+A ``TracingExecutor`` keeps its processes between calls, until it is shut
+down (at the end of a ``with`` block). Each optical path is sent once: it is
+identified by a hash of its content and placed in shared memory, and each
+process keeps the paths it has already loaded. Rays are traced with
+``traceManyThroughNumpy()`` and sent as ``CompactRays`` (i.e., numpy arrays),
+not as ``Ray`` objects.
+
+See Also
+--------
+raytracing.Matrix.traceManyThroughInParallel
+raytracing.Matrix.traceManyThroughNumpy
+"""
+
+import concurrent.futures
+import hashlib
+import math
+import multiprocessing
+import pickle
+from multiprocessing import shared_memory
+import numpy as np
+from .compact import CompactRays
+from .matrix import Matrix
+from .matrixgroup import MatrixGroup
+from .raystatistics import RayStatistics
+
+_workerPaths = {}  # In each process, the paths already loaded, by key
+
+
+def _workerPath(pathKey, pathBlockName, pathSize):
+    """ The path, in a process of the executor. It is loaded from its shared
+    memory block the first time only. """
+    path = _workerPaths.get(pathKey)
+    if path is None:
+        block = shared_memory.SharedMemory(name=pathBlockName)
+        try:
+            path = pickle.loads(bytes(block.buf[:pathSize]))
+        finally:
+            block.close()
+        _workerPaths[pathKey] = path
+
+    return path
+
+
+def _traceInWorker(pathKey, pathBlockName, pathSize, inputRays):
+    """ Traces the CompactRays through the path, in a process of the executor. """
+    return _workerPath(pathKey, pathBlockName, pathSize).traceManyThroughNumpy(inputRays)
+
+
+def _statisticsInWorker(pathKey, pathBlockName, pathSize, inputRays):
+    """ Traces the CompactRays through the path, in a process of the executor,
+    and returns the statistics of the output rays instead of the rays. """
+    outputRays = _workerPath(pathKey, pathBlockName, pathSize).traceManyThroughNumpy(inputRays)
+    return RayStatistics().fill(outputRays, inputCount=len(inputRays))
+
+
+class TracingExecutor:
+    """A pool of processes that stay ready to trace rays until the executor is
+    shut down. Jobs are submitted like with the executors of
+    ``concurrent.futures``: ``submit()`` returns a ``Future`` and ``map()`` returns
+    the results in order.
+
+    Parameters
+    ----------
+    processes : int, optional
+        The number of processes. (Default=None, the number of CPUs)
+    chunkSize : int, optional
+        The default number of rays in each job of ``traceManyThrough()``. (Default=None,
+        enough chunks to give about four jobs to each process)
+
+    Examples
+    --------
+    The same rays traced through several positions of an aperture, by the same
+    processes:
+
+    >>> from raytracing import *
+    >>> rays = CompactRays(rays=UniformRays(yMax=1, thetaMax=0.1, M=10, N=10))
+    >>> paths = [ImagingPath([Space(d=d), Aperture(diameter=1)]) for d in [1, 2, 3]]
+    >>> with TracingExecutor(processes=2) as executor:
+    ...     counts = [len(outputRays) for outputRays in executor.map(paths, [rays]*3)]
+
+    See Also
+    --------
+    raytracing.Matrix.traceManyThroughInParallel
+    """
+
+    def __init__(self, processes=None, chunkSize=None):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if processes <= 0:
+            raise ValueError("The number of processes must be positive.")
+        if chunkSize is not None and chunkSize <= 0:
+            raise ValueError("The chunk size must be positive.")
+
+        self.processes = processes
+        self.chunkSize = chunkSize
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+        self._pathBlocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+    def shutdown(self, wait=True):
+        """ Stops the processes and releases the paths in shared memory. The
+        executor cannot be used afterwards. """
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+
+        for block, size in self._pathBlocks.values():
+            block.close()
+            block.unlink()
+        self._pathBlocks = {}
+
+    @staticmethod
+    def pathKey(path):
+        """ The hash of the content of a path: equal paths have the same key,
+        even if they are different objects. For a group, it is the hash of its
+        class and of its elements (see MatrixGroup.contentHash()): a MatrixGroup
+        and an ImagingPath with the same elements have different keys. Otherwise,
+        it is the hash of the pickle. """
+        if isinstance(path, MatrixGroup):
+            try:
+                pathClass = "{0}.{1}".format(type(path).__module__, type(path).__qualname__)
+                return hashlib.sha256("{0}:{1}".format(pathClass, path.contentHash()).encode()).hexdigest()
+            except TypeError:
+                pass  # An element with attributes that cannot be saved in JSON
+        return hashlib.sha256(pickle.dumps(path, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+    def submit(self, path, inputRays):
+        """ Schedules the tracing of inputRays through path, like
+        path.traceManyThroughNumpy(inputRays).
+
+        Parameters
+        ----------
+        path : Matrix or MatrixGroup
+            The element or group to trace through.
+        inputRays : list of Ray, Rays or CompactRays
+            The rays to trace.
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            Its result() is a CompactRays with the rays that are not blocked.
+        """
+        return self._submitRays(self._sharePath(path), Matrix._asCompactRays(inputRays))
+
+    def map(self, paths, manyInputRays):
+        """ Traces each set of rays of manyInputRays through the path of paths with
+        the same index, and yields the output rays in order. All jobs are
+        submitted at once, so they are traced in parallel.
+
+        Parameters
+        ----------
+        paths : iterable of Matrix or MatrixGroup
+            The paths to trace through.
+        manyInputRays : iterable of list of Ray, Rays or CompactRays
+            The rays to trace through each path.
+
+        Returns
+        -------
+        outputRays : iterator of CompactRays
+            The rays that are not blocked, for each path.
+        """
+        futures = [self.submit(path, inputRays) for path, inputRays in zip(paths, manyInputRays)]
+        return (future.result() for future in futures)
+
+    def traceManyThrough(self, path, inputRays, chunkSize=None):
+        """ The same as path.traceManyThroughNumpy(inputRays), with the rays split
+        in chunks that are traced by the processes. There are more chunks than
+        processes: a process that receives rays that are quickly blocked takes
+        the next chunk instead of waiting for the others.
+
+        Parameters
+        ----------
+        path : Matrix or MatrixGroup
+            The element or group to trace through.
+        inputRays : list of Ray, Rays or CompactRays
+            The rays to trace.
+        chunkSize : int, optional
+            The number of rays in each chunk. (Default=None, the chunkSize of the
+            executor)
+
+        Returns
+        -------
+        outputRays : CompactRays
+            The rays that are not blocked, in the order of the input rays.
+        """
+        inputRays = Matrix._asCompactRays(inputRays)
+        futures = self._submitChunks(path, inputRays, chunkSize, _traceInWorker)
+        outputRays = np.concatenate([inputRays._rays[:0]] + [future.result()._rays for future in futures])
+        return CompactRays(compactRaysStructuredBuffer=outputRays)
+
+    def traceManyStatistics(self, path, inputRays, chunkSize=None):
+        """ The same as path.traceManyStatistics(inputRays), with the chunks traced
+        by the processes. Each process returns the statistics of its chunk, which
+        are merged: the output rays are not sent back.
+
+        Parameters
+        ----------
+        path : Matrix or MatrixGroup
+            The element or group to trace through.
+        inputRays : list of Ray, Rays or CompactRays
+            The rays to trace.
+        chunkSize : int, optional
+            The number of rays in each chunk, as in traceManyThrough().
+
+        Returns
+        -------
+        statistics : RayStatistics
+            The statistics of the rays that are not blocked.
+        """
+        futures = self._submitChunks(path, Matrix._asCompactRays(inputRays), chunkSize, _statisticsInWorker)
+        statistics = RayStatistics()
+        for future in futures:
+            statistics.merge(future.result())
+        return statistics
+
+    def _submitChunks(self, path, inputRays, chunkSize, function):
+        """ Submits function for each chunk of the CompactRays inputRays, and
+        returns the futures in order. """
+        if chunkSize is None:
+            chunkSize = self.chunkSize
+        if chunkSize is None:
+            chunkSize = max(math.ceil(len(inputRays) / (4 * self.processes)), 1)
+        if chunkSize <= 0:
+            raise ValueError("The chunk size must be positive.")
+
+        pathKey, blockName, size = self._sharePath(path)
+        rays = inputRays._rays
+        return [self._pool.submit(function, pathKey, blockName, size,
+                                  CompactRays(compactRaysStructuredBuffer=rays[start:start + chunkSize]))
+                for start in range(0, len(rays), chunkSize)]
+
+    def _sharePath(self, path):
+        """ The key, the name of the shared memory block and the size of the
+        pickled path. The path is placed in shared memory the first time. """
+        if self._pool is None:
+            raise RuntimeError("The executor was shut down.")
+
+        pathKey = self.pathKey(path)
+        if pathKey not in self._pathBlocks:
+            pickledPath = pickle.dumps(path, protocol=pickle.HIGHEST_PROTOCOL)
+            block = shared_memory.SharedMemory(create=True, size=len(pickledPath))
+            block.buf[:len(pickledPath)] = pickledPath
+            self._pathBlocks[pathKey] = (block, len(pickledPath))
+
+        block, size = self._pathBlocks[pathKey]
+        return pathKey, block.name, size
+
+    def _submitRays(self, sharedPath, inputRays):
+        pathKey, blockName, size = sharedPath
+        return self._pool.submit(_traceInWorker, pathKey, blockName, size, inputRays)
@@ -0,0 +1,297 @@
+"""Histograms of rays with a fixed binning, filled one group of rays at a time.
+
+``Rays.rayCountHistogram()`` and ``Rays.rayAnglesHistogram()`` need all the rays
+in memory, and the range of the bins depends on the rays (by default, the
+smallest and largest values). Two sets of rays (e.g., traced in chunks or in
+several processes) therefore do not give histograms that can be added.
+
+A ``RayHistogram`` (heights or angles) or a ``PhaseSpaceHistogram`` (heights
+and angles) has bins that are fixed when it is created. It is filled with
+``fill()`` as the rays are traced, keeps only the counts (its memory does not
+depend on the number of rays), and two histograms with the same bins are
+combined with ``merge()``. The blocked rays are not counted, and the rays
+outside the range are counted separately.
+
+See Also
+--------
+raytracing.Rays.rayCountHistogram
+raytracing.Rays.displayHistograms
+"""
+
+import numpy as np
+from .rays import Rays, _rayValues
+
+
+def _unblockedValues(rays, attributes):
+    """ The values of the attributes (e.g. "y" and "theta") of the rays that are
+    not blocked, as numpy arrays. rays can be a Rays, a CompactRays, a
+    ColumnarRays or any sequence of Ray. """
+    isBlocked, *values = _rayValues(rays, ["isBlocked"] + list(attributes))
+    isBlocked = isBlocked.astype(bool)
+
+    if isBlocked.any():
+        values = [value[~isBlocked] for value in values]
+    return values
+
+
+class RayHistogram:
+    """The histogram of the height (or the angle) of rays, with fixed bins.
+
+    Parameters
+    ----------
+    minValue : float
+        The lower edge of the first bin.
+    maxValue : float
+        The upper edge of the last bin.
+    binCount : int
+        The number of bins (default=40).
+    attribute : str
+        "y" for the height of the rays or "theta" for their angle (default="y").
+
+    Attributes
+    ----------
+    counts : array of int
+        The number of rays in each bin.
+    underflowCount : int
+        The number of rays below minValue.
+    overflowCount : int
+        The number of rays above maxValue.
+
+    Examples
+    --------
+    The rays are traced in chunks and only the histogram of the output is kept:
+
+    >>> from raytracing import *
+    >>> path = MatrixGroup([Space(d=10), Lens(f=10), Space(d=10)])
+    >>> histogram = RayHistogram(minValue=-20, maxValue=20, binCount=40)
+    >>> for seed in range(4):
+    ...     rays = CompactRays(rays=RandomUniformRays(yMax=10, thetaMax=0.1, maxCount=10000, seed=seed))
+    ...     _ = histogram.fill(path.traceManyThroughNumpy(rays))
+    >>> histogram.rayCount
+    40000
+
+    Histograms of rays traced in other processes are added with merge().
+    """
+
+    attributes = ("y", "theta")
+
+    def __init__(self, minValue, maxValue, binCount=40, attribute="y"):
+        if attribute not in self.attributes:
+            raise ValueError(f"attribute must be one of {self.attributes}, not '{attribute}'")
+        if not minValue < maxValue:
+            raise ValueError(f"minValue ({minValue}) must be smaller than maxValue ({maxValue})")
+        if binCount < 1:
+            raise ValueError("There must be at least one bin")
+
+        self.minValue = minValue
+        self.maxValue = maxValue
+        self.binCount = int(binCount)
+        self.attribute = attribute
+
+        self.counts = np.zeros(self.binCount, dtype=np.int64)
+        self.underflowCount = 0
+        self.overflowCount = 0
+
+    @property
+    def binEdges(self):
+        """ The binCount+1 edges of the bins """
+        return np.linspace(self.minValue, self.maxValue, self.binCount + 1)
+
+    @property
+    def binCenters(self):
+        """ The center of each bin """
+        binEdges = self.binEdges
+        return (binEdges[:-1] + binEdges[1:]) / 2
+
+    @property
+    def rayCount(self):
+        """ The number of rays counted, including those outside the range """
+        return int(self.counts.sum()) + self.underflowCount + self.overflowCount
+
+    def fill(self, rays):
+        """ Counts the rays that are not blocked.
+
+        Parameters
+        ----------
+        rays : Rays, CompactRays, ColumnarRays or list of Ray
+            The rays to count, e.g. the output of traceManyThrough() or of
+            traceManyThroughNumpy().
+
+        Returns
+        -------
+        histogram : RayHistogram
+            This histogram.
+        """
+        (values,) = _unblockedValues(rays, [self.attribute])
+        self.fillValues(values)
+        return self
+
+    def fillValues(self, values):
+        """ Counts values of the attribute (e.g., the heights of the rays)
+        directly, without the rays. """
+        values = np.asarray(values)
+        counts, _ = np.histogram(values, bins=self.binCount, range=(self.minValue, self.maxValue))
+        self.counts += counts
+        self.underflowCount += int(np.count_nonzero(values < self.minValue))
+        self.overflowCount += int(np.count_nonzero(values > self.maxValue))
+
+    def hasSameBins(self, other) -> bool:
+        """ True if other is a RayHistogram with the same bins, i.e. that can be merged. """
+        if not isinstance(other, RayHistogram):
+            return False
+        return (self.attribute, self.minValue, self.maxValue, self.binCount) == \
+            (other.attribute, other.minValue, other.maxValue, other.binCount)
+
+    def merge(self, other):
+        """ Adds the counts of other, a histogram with the same bins (e.g., filled
+        in another process).
+
+        Returns
+        -------
+        histogram : RayHistogram
+            This histogram.
+
+        Raises
+        ------
+        ValueError
+            If the bins are not the same.
+        """
+        if not self.hasSameBins(other):
+            raise ValueError("Only histograms with the same bins can be merged")
+
+        self.counts += other.counts
+        self.underflowCount += other.underflowCount
+        self.overflowCount += other.overflowCount
+        return self
+
+    def histogram(self):
+        """ The center of the bins and the counts, as lists, like
+        Rays.rayCountHistogram(). """
+        return list(self.binCenters), list(self.counts)
+
+    def display(self, title="Intensity profile"):  # pragma: no cover
+        """ Plots the histogram like Rays.display() """
+        if self.attribute == "y":
+            Rays.displayHistograms(self.histogram(), title=title)
+        else:
+            Rays.displayHistograms(None, self.histogram(), title=title)
+
+
+class PhaseSpaceHistogram:
+    """The joint histogram of the height and the angle of rays (their phase
+    space), with fixed bins. The histograms of the heights and of the angles
+    of the same rays are kept in yHistogram and thetaHistogram.
+
+    Parameters
+    ----------
+    yMin, yMax : float
+        The range of the heights.
+    thetaMin, thetaMax : float
+        The range of the angles.
+    yBinCount, thetaBinCount : int
+        The number of bins for the heights and for the angles (default=40).
+
+    Attributes
+    ----------
+    counts : array of int
+        The number of rays in each bin, indexed by [yBin, thetaBin].
+    outOfRangeCount : int
+        The number of rays outside the range of the heights or of the angles.
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> histogram = PhaseSpaceHistogram(yMin=-10, yMax=10, thetaMin=-0.5, thetaMax=0.5, yBinCount=20, thetaBinCount=10)
+    >>> _ = histogram.fill(RandomLambertianRays(yMax=5, maxCount=1000, seed=1))
+    >>> histogram.counts.shape
+    (20, 10)
+    >>> histogram.rayCount
+    1000
+    """
+
+    def __init__(self, yMin, yMax, thetaMin, thetaMax, yBinCount=40, thetaBinCount=40):
+        self.yHistogram = RayHistogram(yMin, yMax, yBinCount, attribute="y")
+        self.thetaHistogram = RayHistogram(thetaMin, thetaMax, thetaBinCount, attribute="theta")
+        self.counts = np.zeros((self.yHistogram.binCount, self.thetaHistogram.binCount), dtype=np.int64)
+        self.outOfRangeCount = 0
+
+    @property
+    def rayCount(self):
+        """ The number of rays counted, including those outside the range """
+        return int(self.counts.sum()) + self.outOfRangeCount
+
+    def fill(self, rays):
+        """ Counts the rays that are not blocked.
+
+        Parameters
+        ----------
+        rays : Rays, CompactRays, ColumnarRays or list of Ray
+            The rays to count.
+
+        Returns
+        -------
+        histogram : PhaseSpaceHistogram
+            This histogram.
+        """
+        yValues, thetaValues = _unblockedValues(rays, ["y", "theta"])
+        self.fillValues(yValues, thetaValues)
+        return self
+
+    def fillValues(self, yValues, thetaValues):
+        """ Counts the heights and angles of rays directly, without the rays. """
+        yValues = np.asarray(yValues)
+        thetaValues = np.asarray(thetaValues)
+        counts, _, _ = np.histogram2d(yValues, thetaValues, bins=self.counts.shape,
+                                      range=((self.yHistogram.minValue, self.yHistogram.maxValue),
+                                             (self.thetaHistogram.minValue, self.thetaHistogram.maxValue)))
+        self.counts += counts.astype(np.int64)
+        self.outOfRangeCount += len(yValues) - int(counts.sum())
+
+        self.yHistogram.fillValues(yValues)
+        self.thetaHistogram.fillValues(thetaValues)
+
+    def hasSameBins(self, other) -> bool:
+        """ True if other is a PhaseSpaceHistogram with the same bins, i.e. that can be merged. """
+        if not isinstance(other, PhaseSpaceHistogram):
+            return False
+        return self.yHistogram.hasSameBins(other.yHistogram) and \
+            self.thetaHistogram.hasSameBins(other.thetaHistogram)
+
+    def merge(self, other):
+        """ Adds the counts of other, a histogram with the same bins.
+
+        Returns
+        -------
+        histogram : PhaseSpaceHistogram
+            This histogram.
+
+        Raises
+        ------
+        ValueError
+            If the bins are not the same.
+        """
+        if not self.hasSameBins(other):
+            raise ValueError("Only histograms with the same bins can be merged")
+
+        self.counts += other.counts
+        self.outOfRangeCount += other.outOfRangeCount
+        self.yHistogram.merge(other.yHistogram)
+        self.thetaHistogram.merge(other.thetaHistogram)
+        return self
+
+    def display(self, title="Intensity profile", showTheta=True):  # pragma: no cover
+        """ Plots the histograms of the heights and of the angles like Rays.display() """
+        Rays.displayHistograms(self.yHistogram.histogram(),
+                               self.thetaHistogram.histogram() if showTheta else None, title=title)
+
+    def displayPhaseSpace(self, title="Phase space"):  # pragma: no cover
+        """ Plots the number of rays as a function of their height and angle """
+        import matplotlib.pyplot as plt
+
+        fig, axis = plt.subplots(1, figsize=(10, 7))
+        fig.suptitle(title)
+        mesh = axis.pcolormesh(self.yHistogram.binEdges, self.thetaHistogram.binEdges, self.counts.T)
+        fig.colorbar(mesh, ax=axis, label="Ray count")
+        axis.set_xlabel("Height of ray")
+        axis.set_ylabel("Angle of ray [rad]")
+        plt.show()
@@ -2,7 +2,9 @@ from typing import Any, Union, List
 from .figure import Figure
 from .matrixgroup import *
 from .ray import *
+from .rays import _rayValues
 import numpy as np
+import itertools
 
 """ We start with general, useful namedtuples to simplify management of values """
 from typing import NamedTuple
@@ -15,6 +17,24 @@ class Stop(NamedTuple):
     z: float = 0
     diameter: float = None
 
+class ConfidenceInterval(NamedTuple):
+    value: float = None
+    lower: float = None
+    upper: float = None
+
+class InvariantCoefficients(NamedTuple):
+    A: 'np.ndarray' = None
+    B: 'np.ndarray' = None
+
+class CollectionEfficiency(NamedTuple):
+    efficiency: ConfidenceInterval = None
+    vignettingLoss: ConfidenceInterval = None
+    rayCount: int = 0
+    transmittedCount: int = 0
+    vignettedCount: int = 0
+    confidence: float = None
+    isConverged: bool = False
+
 
 class ImagingPath(MatrixGroup):
     """ImagingPath: the main class of the module, allowing
@@ -83,6 +103,8 @@ class ImagingPath(MatrixGroup):
                     :align: center
     """
 
+    unsavedAttributes = ("figure", "design")
+
     def __init__(self, elements: list = None, label=""):
 
         self._objectHeight = 10.0  # object height (full).
@@ -106,6 +128,13 @@ class ImagingPath(MatrixGroup):
         self.showPointsOfInterestLabels = True
         super(ImagingPath, self).__init__(elements=elements, label=label)
 
+    def __setstate__(self, state):
+        super(ImagingPath, self).__setstate__(state)
+        if 'figure' not in self.__dict__:
+            # Saved without its display state (see unsavedAttributes)
+            self.figure = Figure(opticalPath=self)
+            self.design = self.figure.design
+
     @property
     def objectHeight(self):
         """Get or set the object height, at the starting edge of the ImagingPath.
@@ -820,6 +849,213 @@ class ImagingPath(MatrixGroup):
 
         return self.opticalInvariant(ray1, ray2)
 
+    def collectionEfficiency(self, source=None, tolerance=0.005, confidence=0.95, batchSize=1000):
+        """
+        The collection efficiency of the system for the rays of a source, with a
+        confidence interval, obtained by tracing just enough random rays.
+
+        The rays are traced in batches of growing size (batchSize, then twice as
+        many rays every time) until the Wilson confidence intervals of the
+        efficiency and of the loss to vignetting are both narrower than
+        ±tolerance, or until the source has no more rays. If none of the rays
+        is expected to be transmitted, the loss to vignetting is not defined and
+        only the efficiency is considered. As in reportEfficiency(),
+        a ray is expected to be transmitted if its coefficients on the principal
+        and axial rays are both at most 1, and the loss to vignetting is the
+        fraction of these rays that are blocked.
+
+        Parameters
+        ----------
+        source : Rays, optional
+            The rays emitted by the source, e.g. RandomLambertianRays. At most
+            len(source) rays are traced. (Default=None, up to 10⁶ random rays
+            uniformly distributed over the field of view and ±π/2)
+        tolerance : float
+            The largest acceptable half-width of the confidence intervals
+            (default=0.005, i.e. ±0.5%).
+        confidence : float
+            The confidence level of the intervals (default=0.95).
+        batchSize : int
+            The number of rays in the first batch (default=1000).
+
+        Returns
+        -------
+        efficiency : CollectionEfficiency
+            The fraction of the rays that are transmitted (efficiency) and the
+            loss to vignetting (vignettingLoss, None if there is no field stop or
+            if none of the rays is expected to be transmitted),
+            each as a ConfidenceInterval (value, lower, upper), the number of
+            rays that were traced, transmitted and vignetted, and whether the
+            tolerance was reached (isConverged).
+
+        Raises
+        ------
+        ValueError
+            If there is no source and no field stop, or if a parameter is invalid.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=50), Lens(f=50, diameter=25), Space(d=50), Lens(f=50, diameter=25),
+        ...                     Space(d=50), Aperture(diameter=10)])
+        >>> source = RandomUniformRays(yMax=5, yMin=-5, thetaMax=0.5, thetaMin=-0.5, maxCount=10**6, seed=1)
+        >>> result = path.collectionEfficiency(source, tolerance=0.01)
+        >>> print(result.isConverged, result.rayCount)
+        True 15000
+        >>> print("{0:.3f} [{1:.3f}, {2:.3f}]".format(*result.efficiency))
+        0.451 [0.443, 0.459]
+
+        See Also
+        --------
+        raytracing.ImagingPath.reportEfficiency
+        raytracing.utils.wilsonInterval
+        """
+        if tolerance <= 0:
+            raise ValueError("The tolerance must be positive, not {0}".format(tolerance))
+        if not 0 < confidence < 1:
+            raise ValueError("The confidence must be between 0 and 1, not {0}".format(confidence))
+        if batchSize <= 0:
+            raise ValueError("The batch size must be positive, not {0}".format(batchSize))
+
+        principal = self.principalRay()
+        axial = self.axialRay()
+        if source is None:
+            if principal is None:
+                raise ValueError("There is no field stop in this system: give the rays of the source.")
+            source = RandomUniformRays(yMax=principal.y, yMin=-principal.y,
+                                       thetaMax=np.pi/2, thetaMin=-np.pi/2, maxCount=1000000)
+
+        rayCount = 0
+        transmittedCount = 0
+        expectedCount = 0
+        vignettedCount = 0
+        isConverged = False
+        for y, theta in self._sourceBatches(source, batchSize):
+            inputRays = CompactRays(rays=ColumnarRays(y=y, theta=theta, precision="float64"))
+            isBlocked = self.traceManyBlockingNumpy(inputRays).elementIndex >= 0
+
+            rayCount += len(y)
+            transmittedCount += int(np.count_nonzero(~isBlocked))
+            if principal is not None:
+                coefficients = self._invariantCoefficients(y, theta, principal, axial)
+                isExpected = (np.abs(coefficients.A) <= 1) & (np.abs(coefficients.B) <= 1)
+                expectedCount += int(np.count_nonzero(isExpected))
+                vignettedCount += int(np.count_nonzero(isExpected & isBlocked))
+
+            efficiency = self._wilsonConfidenceInterval(transmittedCount, rayCount, confidence)
+            vignettingLoss = None
+            isConverged = efficiency.upper - efficiency.lower <= 2 * tolerance
+            if expectedCount != 0:
+                vignettingLoss = self._wilsonConfidenceInterval(vignettedCount, expectedCount, confidence)
+                isConverged = isConverged and vignettingLoss.upper - vignettingLoss.lower <= 2 * tolerance
+            if isConverged:
+                break
+
+        if rayCount == 0:
+            raise ValueError("The source has no rays.")
+
+        return CollectionEfficiency(efficiency=efficiency, vignettingLoss=vignettingLoss, rayCount=rayCount,
+                                    transmittedCount=transmittedCount, vignettedCount=vignettedCount,
+                                    confidence=confidence, isConverged=isConverged)
+
+    @staticmethod
+    def _wilsonConfidenceInterval(successes, count, confidence):
+        lower, upper = wilsonInterval(successes, count, confidence)
+        value = successes / count if count != 0 else float("nan")
+        return ConfidenceInterval(value=value, lower=lower, upper=upper)
+
+    @staticmethod
+    def _sourceBatches(source, batchSize):
+        """ The heights and angles of the rays of source, in batches that start
+        with batchSize rays and double every time. The random sources draw
+        the rays as arrays, without keeping them. """
+        isRandom = isinstance(source, RandomRays) and source.hasRandomRayArrays()
+        iterator = None if isRandom else iter(source)
+        start = 0
+        while True:
+            if isRandom:
+                stop = min(start + batchSize, len(source))
+                blocks = list(source.randomRayBlocks(start, stop))
+                if not blocks:
+                    return
+                y = np.concatenate([blockY for blockY, blockTheta in blocks])
+                theta = np.concatenate([blockTheta for blockY, blockTheta in blocks])
+            else:
+                rays = list(itertools.islice(iterator, batchSize))
+                if not rays:
+                    return
+                y = np.array([ray.y for ray in rays], dtype=float)
+                theta = np.array([ray.theta for ray in rays], dtype=float)
+
+            yield y, theta
+            start += len(y)
+            batchSize *= 2
+
+    def invariantCoefficients(self, rays):
+        """
+        The coefficients of rays on the principal and axial rays, for many rays
+        at once. Any ray is a linear combination A ✕ principal + B ✕ axial,
+        with A = I(axial, ray)/I and B = I(ray, principal)/I, where I is the
+        Lagrange invariant and I(ray1, ray2) the optical invariant. A ray with
+        |A| > 1 or |B| > 1 is blocked; with both at most 1, it reaches the image
+        unless there is vignetting (see reportEfficiency()).
+
+        The transfer matrix and the principal and axial rays are calculated
+        once, then the coefficients of all the rays are obtained with arrays.
+
+        Parameters
+        ----------
+        rays : Rays, CompactRays, ColumnarRays or list of Ray
+            The rays, at the front of the path.
+
+        Returns
+        -------
+        coefficients : InvariantCoefficients
+            The arrays A and B, with one value per ray.
+
+        Raises
+        ------
+        ValueError
+            If there is no field stop (and therefore no principal ray).
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=50), Lens(f=50, diameter=25), Space(d=50), Lens(f=50, diameter=25),
+        ...                     Space(d=50), Aperture(diameter=10)])
+        >>> coefficients = path.invariantCoefficients([path.principalRay(), path.axialRay(), Ray(y=0, theta=0.5)])
+        >>> print(coefficients.A, coefficients.B)
+        [1. 0. 0.] [0. 1. 2.]
+
+        See Also
+        --------
+        raytracing.Matrix.opticalInvariant
+        raytracing.ImagingPath.lagrangeInvariant
+        """
+        principal = self.principalRay()
+        axial = self.axialRay()
+        if principal is None or axial is None:
+            raise ValueError("There is no field stop in this system: the rays cannot be decomposed on the "
+                             "principal and axial rays.")
+
+        y, theta = _rayValues(rays, ["y", "theta"])
+        return self._invariantCoefficients(y.astype(float), theta.astype(float), principal, axial)
+
+    def _invariantCoefficients(self, y, theta, principal, axial):
+        """ The coefficients A and B of the rays with heights y and angles theta
+        on the principal and axial rays (see invariantCoefficients()). """
+        matrix = self.transferMatrix(upTo=0)
+        yOut = matrix.A * y + matrix.B * theta
+        thetaOut = matrix.C * y + matrix.D * theta
+        principalOut = matrix.traceThrough(principal)
+        axialOut = matrix.traceThrough(axial)
+
+        n = matrix.backIndex
+        Iap = abs(n * (axialOut.theta * principalOut.y - axialOut.y * principalOut.theta))
+        Irp = n * (thetaOut * principalOut.y - yOut * principalOut.theta)
+        Iar = n * (axialOut.theta * yOut - axialOut.y * thetaOut)
+        return InvariantCoefficients(A=Iar / Iap, B=Irp / Iap)
+
     def reportEfficiency(self, objectDiameter=None, emissionHalfAngle=None, nRays=10000): #pragma: no cover
         """
         The collection efficiency of the optical system is computed and a report is printed.
@@ -861,26 +1097,21 @@ class ImagingPath(MatrixGroup):
                                  thetaMax=maxAngle,
                                  thetaMin=-maxAngle,
                                  maxCount=nRays)
+        sourceRays = CompactRays(rays=sourceRays, precision="float64")
         Is = maxHeight * maxAngle
 
-        expectedBlocked = []
-        notBlocked = []
-        vignettedBlocked = []
-        vignettePositions = []
-        for ray in sourceRays:
-            Irp = self.opticalInvariant(ray, principal)
-            Iar = self.opticalInvariant(axial, ray)
-            outputRay = self.traceThrough(ray)
-
-            if abs(Irp) > Iap or abs(Iar) > Iap:
-                expectedBlocked.append((Irp/Iap, Iar/Iap))
-                continue
-
-            if outputRay.isBlocked:
-                vignettedBlocked.append((Irp/Iap, Iar/Iap))
-                vignettePositions.append(outputRay.z)
-            else:
-                notBlocked.append((Irp/Iap, Iar/Iap))
+        # All rays are traced at once, and we know which element blocked each one
+        blockedRays = self.traceManyBlockingNumpy(sourceRays)
+        isBlocked = blockedRays.elementIndex >= 0
+
+        # Each ray is A ✕ principal + B ✕ axial: blocked if |A| > 1 or |B| > 1
+        (A, B) = self._invariantCoefficients(sourceRays._rays['y'], sourceRays._rays['theta'], principal, axial)
+        isExpected = (np.abs(A) <= 1) & (np.abs(B) <= 1)
+        isVignetted = isExpected & isBlocked
+
+        expectedBlocked = list(zip(B[~isExpected], A[~isExpected]))
+        notBlocked = list(zip(B[isExpected & ~isBlocked], A[isExpected & ~isBlocked]))
+        vignettedBlocked = list(zip(B[isVignetted], A[isVignetted]))
 
         print("Optical System Properties for {0}".format(self.label))
         print("---------------------------------------------------")
@@ -902,7 +1133,13 @@ class ImagingPath(MatrixGroup):
         print("Relative efficiency: {0:.1f}% of maximum for this system".format(100*len(notBlocked)/(len(vignettedBlocked)+len(notBlocked))))
         if len(vignettedBlocked) >= 2:
             print("  Loss to vignetting: {0:.1f}%".format(100*len(vignettedBlocked)/(len(vignettedBlocked)+len(notBlocked))))
-            print("  Vignetting is due to blockers at positions: {0}".format(set(vignettePositions)))
+            vignettingLosses = self.apertureLosses(BlockedRays(elementIndex=blockedRays.elementIndex[isVignetted],
+                                                               z=blockedRays.z[isVignetted]))
+            print("  Vignetting is due to blockers:")
+            for loss in vignettingLosses:
+                if loss.count > 0:
+                    print("    {0} at z={1:.1f}: {2:.1f}% of vignetted rays".format(loss.label, loss.z,
+                                                                              100*loss.count/len(vignettedBlocked)))
         else:
             print("  No losses to vignetting")
 
@@ -2,11 +2,17 @@ from .ray import *
 from .gaussianbeam import *
 from .rays import *
 from .compact import *
+from .raystatistics import RayStatistics
 from .interface import *
 from .utils import *
+from .traceplan import *
+from .opencl import *
 
 from typing import List
 import multiprocessing
+import concurrent.futures
+from multiprocessing import shared_memory
+import itertools
 import sys
 import math
 import warnings
@@ -35,6 +41,31 @@ class Conjugate(NamedTuple):
     d: float = None
     transferMatrix:'Matrix' = None
 
+class BlockedRays(NamedTuple):
+    elementIndex: 'np.ndarray' = None
+    z: 'np.ndarray' = None
+
+class ApertureLoss(NamedTuple):
+    elementIndex: int = None
+    label: str = None
+    z: float = None
+    count: int = None
+
+def _traceSharedMemoryRange(matrix, name, dtype, count, start, stop):
+    """ Traces the rays start:stop of the rays in the shared memory block name,
+    in a process of traceManyThroughInParallel(). The rays that are not blocked
+    are written at the start of the range and their number is returned. """
+    sharedMemory = shared_memory.SharedMemory(name=name)
+    try:
+        rays = np.ndarray((count,), dtype=dtype, buffer=sharedMemory.buf)
+        outputRays = matrix.traceManyThroughNumpy(CompactRays(compactRaysStructuredBuffer=rays[start:stop]))
+        survivorCount = len(outputRays)
+        rays[start:start + survivorCount] = outputRays._rays
+        del rays, outputRays
+    finally:
+        sharedMemory.close()
+    return survivorCount
+
 # todo: fix docstrings since draw-related methods were removed
 
 
@@ -131,6 +162,20 @@ class Matrix(object):
                       ("isFlipped", np.int32)
                       ])
 
+    Struct64 = np.dtype([("A", np.float64),
+                        ("B", np.float64),
+                        ("C", np.float64),
+                        ("D", np.float64),
+                        ("L", np.float64),
+                        ("frontVertex", np.float64),
+                        ("backVertex", np.float64),
+                        ("frontIndex", np.float64),
+                        ("backIndex", np.float64),
+                        ("apertureDiameter", np.float64),
+                        ("apertureNA", np.float64),
+                        ("isFlipped", np.int32)
+                        ], align=True)
+
     def __init__(
             self,
             A: float = 1,
@@ -178,29 +223,56 @@ class Matrix(object):
             raise ValueError("The matrix has inconsistent values: \
                 determinant is incorrect considering front and back indices.")
 
-    def toStruct(self):
+    @staticmethod
+    def structFor(precision=None):
+        """ The structured dtype of a matrix for the requested floating-point
+        precision: Matrix.Struct for "float32" (the default) or Matrix.Struct64
+        for "float64". Numpy dtypes are also accepted.
+
+        Raises
+        ------
+        ValueError
+            If the precision is not float32 or float64.
+
+        See Also
+        --------
+        raytracing.CompactRay.structFor
+        """
+        # The precision is the same as for the rays, and is checked there
+        if CompactRay.structFor(precision) is CompactRay.Struct64:
+            return Matrix.Struct64
+        return Matrix.Struct
+
+    def toStruct(self, precision=None):
+        """ The properties of this matrix as a structured numpy array, to be sent
+        to OpenCL. With precision="float64", the values are kept in double precision
+        (Matrix.Struct64) instead of being rounded to float32 (Matrix.Struct).
+        A vertex that is None is stored as nan.
+        """
         theStruct = np.array( (self.A, self.B, self.C, self.D, self.L,
                                self.frontVertex, self.backVertex, self.frontIndex, self.backIndex,
-                               self.apertureDiameter, self.apertureNA, self.isFlipped), dtype=Matrix.Struct)
+                               self.apertureDiameter, self.apertureNA, self.isFlipped), dtype=Matrix.structFor(precision))
         return theStruct
 
     def fromStruct(self, theStruct):
-        self.A = theStruct["A"]
-        self.B = theStruct["B"]
-        self.C = theStruct["C"]
-        self.D = theStruct["D"]
-        self.L = theStruct["L"]
-        self.frontVertex = theStruct["frontVertex"]
+        """ Sets the properties of this matrix from a structured array made by
+        toStruct(), in either precision. """
+        self.A = float(theStruct["A"])
+        self.B = float(theStruct["B"])
+        self.C = float(theStruct["C"])
+        self.D = float(theStruct["D"])
+        self.L = float(theStruct["L"])
+        self.frontVertex = float(theStruct["frontVertex"])
         if np.isnan(self.frontVertex):
             self.frontVertex = None
-        self.backVertex = theStruct["backVertex"]
+        self.backVertex = float(theStruct["backVertex"])
         if np.isnan(self.backVertex):
             self.backVertex = None
-        self.frontIndex = theStruct["frontIndex"]
-        self.backIndex = theStruct["backIndex"]
-        self.apertureDiameter = theStruct["apertureDiameter"]
-        self.apertureNA = theStruct["apertureNA"]
-        self.isFlipped = theStruct["isFlipped"]
+        self.frontIndex = float(theStruct["frontIndex"])
+        self.backIndex = float(theStruct["backIndex"])
+        self.apertureDiameter = float(theStruct["apertureDiameter"])
+        self.apertureNA = float(theStruct["apertureNA"])
+        self.isFlipped = bool(theStruct["isFlipped"])
 
     @property
     def isIdentity(self):
@@ -583,6 +655,30 @@ class Matrix(object):
 
         return [self]
 
+    def compile(self):
+        """ The TracePlan to trace rays through this element when only the
+        output rays are needed. For a Matrix(), it is simply the element itself.
+        A MatrixGroup() combines the elements that cannot block rays.
+
+        Returns
+        -------
+        plan : TracePlan
+            The steps to trace through.
+
+        See Also
+        --------
+        raytracing.MatrixGroup.compile
+        """
+        return TracePlan([self], elementIndices=[0], isCheckpoint=[not self._isFusable()])
+
+    def _isFusable(self):
+        """ True if tracing a ray through this element is only a multiplication by
+        its ABCD matrix: it has no aperture that can block rays and does not
+        change how rays are multiplied (see Axicon). Such elements can be
+        multiplied with their neighbours before tracing."""
+        return self.apertureDiameter == float("+Inf") and self.apertureNA == float("+Inf") \
+            and type(self).mul_ray is Matrix.mul_ray
+
     def opticalInvariant(self, ray1, ray2, z=0):
         """ The optical invariant is a quantity that is conserved for any two
         rays in the system. It is very general and any two rays can be used. At a
@@ -746,7 +842,7 @@ class Matrix(object):
         rayTrace = self.trace(inputRay)
         return rayTrace[-1]
 
-    def traceMany(self, inputRays, useOpenCL=True):
+    def traceMany(self, inputRays, useOpenCL=True, engine=None, recordAt=None, executor=None, workers=None):
         r"""This function trace each ray from a group of rays from front edge of element to
         the back edge. It can be either a list of Ray(), or a Rays() object:
         the Rays() object is an iterator and can be used like a list.
@@ -756,6 +852,28 @@ class Matrix(object):
         inputRays : list of object of Ray class
             A List of rays, each object includes two ray. The fisr is the properties
             of the input ray and the second is the properties of the output ray.
+        useOpenCL : bool
+            If True and the rays are CompactRays, OpenCL is tried first (default=True).
+            Ignored if an engine is provided.
+        engine : str
+            The tracing engine: "native", "opencl" or "numpy" (default=None).
+            If None, the engine is selected with useOpenCL.
+        recordAt : list of int or float
+            If provided, only the rays at these planes are kept in each trace, in
+            the same order: an int is the index of an element in transferMatrices()
+            (the ray at its back edge), a float is a position z (the ray at the back
+            edge of the last element that ends at or before z, or the input ray).
+            Memory then scales with the number of planes instead of the number
+            of elements. The OpenCL kernel always records complete traces, so
+            the numpy engine is used instead (default=None, all planes).
+        executor : str
+            If "threads", the rays are split in chunks that are traced at the same
+            time by a pool of threads with the numpy engine: NumPy releases the GIL
+            during array operations, so the threads run on several cores without
+            starting processes (default=None, a single thread).
+        workers : int
+            The number of threads with executor="threads" (default=None, the
+            number of CPUs).
 
         Returns
         -------
@@ -789,35 +907,381 @@ class Matrix(object):
         theta =  0.153
         z = 2.000
 
+        Only the rays at the input, at the aperture (element 1) and at z=20 can be kept:
+
+        >>> path = ImagingPath([Space(d=10), Aperture(diameter=10), Space(d=10), Lens(f=10)])
+        >>> traces = path.traceMany([Ray(y=1, theta=0.1)], engine="numpy", recordAt=[0.0, 1, 20.0])
+        >>> print([float(ray.z) for ray in traces[0]])
+        [0.0, 10.0, 20.0]
+
         See Also
         --------
         raytracing.Matrix.trace
         raytracing.Matrix.traceThrough
         raytracing.Matrix.traceManyThrough
+        raytracing.Matrix.traceManyNumpy
         """
 
-        if useOpenCL and isinstance(inputRays, CompactRays):
-            try:
-                return self.traceManyOpenCL(inputRays=inputRays)
-            except Exception:
-                pass
-
-        return self.traceManyNative(inputRays=inputRays)
-
-    def traceManyNative(self, inputRays):
+        if executor == "threads":
+            if engine not in (None, "numpy"):
+                raise ValueError("The 'threads' executor uses the 'numpy' engine, not '{0}'.".format(engine))
+            engine = "numpy"
+        elif executor is not None:
+            raise ValueError("Unknown executor '{0}': use 'threads' or None.".format(executor))
+
+        if engine is None:
+            engine = "opencl" if useOpenCL else "native"
+
+        if recordAt is not None:
+            if engine == "opencl" and isinstance(inputRays, CompactRays):
+                engine = "numpy"
+            elif engine == "opencl":
+                engine = "native"
+
+        if engine == "numpy":
+            return self.traceManyNumpy(inputRays=inputRays, recordAt=recordAt, workers=workers if executor else 1)
+        elif engine == "opencl":
+            if isinstance(inputRays, CompactRays):
+                try:
+                    return self.traceManyOpenCL(inputRays=inputRays)
+                except Exception:
+                    pass
+        elif engine != "native":
+            raise ValueError("Unknown tracing engine '{0}': use 'native', 'opencl' or 'numpy'.".format(engine))
+
+        return self.traceManyNative(inputRays=inputRays, recordAt=recordAt)
+
+    def traceManyNative(self, inputRays, recordAt=None):
         r"""This function trace each ray from a group of rays from front edge of element to
          the back edge. It can be either a list of Ray(), or a Rays() object:
          the Rays() object is an iterator and can be used like a list.
 
-         It uses a safe, simple, native Python algorithm
+         It uses a safe, simple, native Python algorithm. With recordAt (see traceMany()),
+         each ray is traced element by element and only the requested rays are kept.
          """
         manyRayTraces = []
-        for inputRay in inputRays:
-            rayTrace = RayTrace(self.trace(inputRay))
-            manyRayTraces.append(rayTrace)
+        if recordAt is None:
+            for inputRay in inputRays:
+                rayTrace = RayTrace(self.trace(inputRay))
+                manyRayTraces.append(rayTrace)
+        else:
+            matrices = self.transferMatrices()
+            traceIndices = self._recordedTraceIndices(recordAt, matrices)
+            for inputRay in inputRays:
+                rays = [inputRay]
+                for matrix in matrices:
+                    rays.append(matrix.traceThrough(rays[-1]))
+                manyRayTraces.append(RayTrace([rays[i] for i in traceIndices]))
 
         return RayTraces(manyRayTraces)
 
+    @staticmethod
+    def _recordedTraceIndices(recordAt, matrices):
+        """ The indices in a complete trace (input ray, then one ray after each
+        matrix) of the planes requested with recordAt (see traceMany()). """
+        if len(recordAt) == 0:
+            raise ValueError("'recordAt' must contain at least one plane.")
+        positions = np.cumsum([matrix.L for matrix in matrices])
+
+        traceIndices = []
+        for plane in recordAt:
+            if isinstance(plane, (int, np.integer)):
+                if not -len(matrices) <= plane < len(matrices):
+                    raise ValueError("Element index {0} is out of range for {1} elements.".format(plane, len(matrices)))
+                traceIndices.append(plane % len(matrices) + 1)
+            else:
+                traceIndices.append(int(np.searchsorted(positions, plane, side='right')))
+        return traceIndices
+
+    def traceManyNumpy(self, inputRays, recordAt=None, workers=1):
+        r"""This function trace each ray from a group of rays from front edge of element to
+        the back edge. It can be either a list of Ray(), a Rays() object or CompactRays().
+
+        It uses NumPy: all rays are propagated at once through each element
+        with array operations on a CompactRays buffer, with the same aperture
+        and NA blocking logic as trace(). It requires no extra dependencies
+        and is much faster than traceManyNative() for large numbers of rays.
+        The output has the same layout as traceManyOpenCL(): one trace of
+        len(transferMatrices())+1 rays for each input ray, or one ray for each
+        plane of recordAt.
+
+        Parameters
+        ----------
+        inputRays : list of Ray, Rays or CompactRays
+            The rays to trace.
+        recordAt : list of int or float
+            The planes to keep in each trace, see traceMany() (default=None, all planes).
+        workers : int
+            The number of threads tracing chunks of rays at the same time, each
+            writing its own traces in the output buffer (default=1, None for the
+            number of CPUs).
+
+        Returns
+        -------
+        rayTraces : CompactRaytraces
+            The ray traces, one for each input ray.
+
+        See Also
+        --------
+        raytracing.Matrix.traceMany
+        raytracing.Matrix.traceManyOpenCL
+        """
+        inputRays = self._asCompactRays(inputRays)
+
+        matrices = self.transferMatrices()
+        N = len(inputRays)
+        M = len(matrices)
+        if recordAt is None:
+            traceIndices = list(range(M + 1))
+        else:
+            traceIndices = self._recordedTraceIndices(recordAt, matrices)
+        P = len(traceIndices)
+
+        outputRays = CompactRays(maxCount=N * P, precision=inputRays.precision)
+        traces = outputRays._rays.reshape((N, P))
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        bounds = np.linspace(0, N, max(min(workers, N), 1) + 1).astype(int)
+        if len(bounds) <= 2:
+            Matrix._traceChunkNumpy(matrices, traceIndices, inputRays._rays, traces)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(bounds) - 1) as pool:
+                futures = [pool.submit(Matrix._traceChunkNumpy, matrices, traceIndices,
+                                       inputRays._rays[start:stop], traces[start:stop])
+                           for start, stop in zip(bounds[:-1], bounds[1:])]
+                for future in futures:
+                    future.result()
+
+        return CompactRaytraces(outputRays, traceLength=P)
+
+    @staticmethod
+    def _traceChunkNumpy(matrices, traceIndices, inputRays, traces):
+        """ Traces the array of rays inputRays through the matrices and writes the
+        rays at the planes traceIndices in the columns of traces, one row per ray.
+        The matrices are only read, so several threads can trace chunks at once. """
+        rays = inputRays.copy()
+        for j in range(max(traceIndices, default=0) + 1):
+            if j > 0:
+                matrices[j - 1]._traceStructInPlace(rays)
+            for column, traceIndex in enumerate(traceIndices):
+                if traceIndex == j:
+                    traces[:, column] = rays
+
+    def traceManyThroughNumpy(self, inputRays, returnSurvivorCounts=False):
+        r"""Same as traceManyThrough(), but all rays are propagated at once with NumPy.
+        Only the output rays are kept, the intermediate rays are never stored.
+
+        The rays are traced through the steps of compile(). After each checkpoint
+        (i.e. each element that can block rays), the blocked rays are removed from
+        the arrays so that the following elements only propagate the rays that
+        are still alive. This is much faster for lossy systems, where most rays
+        are blocked by the first apertures.
+
+        Parameters
+        ----------
+        inputRays : list of Ray, Rays or CompactRays
+            The rays to trace.
+        returnSurvivorCounts : bool
+            If True, also return the number of rays that are not blocked after
+            each checkpoint (default=False).
+
+        Returns
+        -------
+        outputRays : CompactRays
+            The rays that were not blocked, at the back edge of the element.
+        survivorCounts : list of int
+            Only if returnSurvivorCounts is True: the number of rays not blocked
+            after each checkpoint, in the order of compile().checkpoints.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Aperture(diameter=2), Space(d=10), Aperture(diameter=1)])
+        >>> rays = UniformRays(yMax=2, thetaMax=0, M=9, N=1)
+        >>> outputRays, survivorCounts = path.traceManyThroughNumpy(rays, returnSurvivorCounts=True)
+        >>> print(survivorCounts)
+        [5, 3]
+
+        See Also
+        --------
+        raytracing.Matrix.traceManyThrough
+        raytracing.Matrix.traceManyNumpy
+        raytracing.MatrixGroup.compile
+        """
+        inputRays = self._asCompactRays(inputRays)
+
+        plan = self.compile()
+        rays = inputRays._rays[inputRays._rays['isBlocked'] == 0]  # A copy with only the live rays
+        survivorCounts = []
+        for step, isCheckpoint in zip(plan.steps, plan.isCheckpoint):
+            step._traceStructInPlace(rays)
+            if isCheckpoint:
+                rays = rays[rays['isBlocked'] == 0]
+                survivorCounts.append(len(rays))
+
+        outputRays = CompactRays(compactRaysStructuredBuffer=rays)
+        if returnSurvivorCounts:
+            return outputRays, survivorCounts
+        return outputRays
+
+    def traceManyBlockingNumpy(self, inputRays):
+        r"""Traces all rays at once with NumPy, like traceManyThroughNumpy(), and
+        records for each ray where it was blocked: the index of the blocking
+        element in transferMatrices() and the z position of the blocked ray
+        (i.e. the z of the last ray of trace() for that ray).
+
+        Parameters
+        ----------
+        inputRays : list of Ray, Rays or CompactRays
+            The rays to trace.
+
+        Returns
+        -------
+        blockedRays : BlockedRays
+            Two arrays with one value per input ray: elementIndex is the index
+            of the blocking element (-1 if the ray is not blocked by this element
+            or group, or if it was already blocked at the input) and z is the
+            position where it was blocked (nan if it was not).
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Aperture(diameter=2), Space(d=10), Aperture(diameter=1)])
+        >>> rays = [Ray(y=0), Ray(y=0.8), Ray(y=1.5)]
+        >>> blockedRays = path.traceManyBlockingNumpy(rays)
+        >>> print(blockedRays.elementIndex)
+        [-1  3  1]
+        >>> print(blockedRays.z)
+        [nan 20. 10.]
+
+        See Also
+        --------
+        raytracing.Matrix.apertureLosses
+        raytracing.Matrix.traceManyThroughNumpy
+        """
+        inputRays = self._asCompactRays(inputRays)
+
+        elementIndex = np.full(len(inputRays), -1, dtype=np.int32)
+        z = np.full(len(inputRays), np.nan, dtype=inputRays._rays.dtype["z"])
+
+        plan = self.compile()
+        liveIndices = np.flatnonzero(inputRays._rays['isBlocked'] == 0)
+        rays = inputRays._rays[liveIndices]
+        for step, stepIndex, isCheckpoint in zip(plan.steps, plan.elementIndices, plan.isCheckpoint):
+            step._traceStructInPlace(rays)
+            if isCheckpoint:
+                isBlocked = rays['isBlocked'] != 0
+                elementIndex[liveIndices[isBlocked]] = stepIndex
+                z[liveIndices[isBlocked]] = rays['z'][isBlocked]
+                liveIndices = liveIndices[~isBlocked]
+                rays = rays[~isBlocked]
+
+        return BlockedRays(elementIndex=elementIndex, z=z)
+
+    def apertureLosses(self, blockedRays):
+        r"""The number of rays blocked by each element that can block rays
+        (i.e. each checkpoint of compile()), from the result of traceManyBlockingNumpy().
+        This answers the question "which aperture is blocking my rays?".
+
+        Parameters
+        ----------
+        blockedRays : BlockedRays
+            The blocking elements obtained with traceManyBlockingNumpy().
+
+        Returns
+        -------
+        losses : list of ApertureLoss
+            For each checkpoint, in order: its index in transferMatrices(), its
+            label (or class name if it has no label), the z position of its back
+            edge and the number of rays it blocked.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Aperture(diameter=2), Space(d=10), Aperture(diameter=1, label="Pinhole")])
+        >>> rays = UniformRays(yMax=2, thetaMax=0, M=9, N=1)
+        >>> for loss in path.apertureLosses(path.traceManyBlockingNumpy(rays)):
+        ...     print(loss.label, loss.z, loss.count)
+        Aperture 10.0 4
+        Pinhole 20.0 2
+
+        See Also
+        --------
+        raytracing.Matrix.traceManyBlockingNumpy
+        """
+        plan = self.compile()
+        counts = np.bincount(blockedRays.elementIndex[blockedRays.elementIndex >= 0],
+                             minlength=len(self.transferMatrices()))
+        positions = np.cumsum([step.L for step in plan.steps])
+
+        losses = []
+        for step, stepIndex, isCheckpoint, z in zip(plan.steps, plan.elementIndices, plan.isCheckpoint, positions):
+            if isCheckpoint:
+                label = step.label if step.label else type(step).__name__
+                losses.append(ApertureLoss(elementIndex=stepIndex, label=label, z=float(z), count=int(counts[stepIndex])))
+        return losses
+
+    @staticmethod
+    def _asCompactRays(inputRays):
+        if isinstance(inputRays, CompactRays):
+            return inputRays
+
+        try:
+            iter(inputRays)
+        except TypeError:
+            raise TypeError("'inputRays' argument is not iterable.")
+
+        return CompactRays(rays=list(inputRays))
+
+    def _traceStructInPlace(self, rays):
+        """ Propagates an array of CompactRay.Struct through this single element, in place.
+        This is the vectorized equivalent of trace(). An element that changes how
+        rays are multiplied (i.e. that overrides mul_ray(), see Axicon) cannot be
+        described by its ABCD matrix: its rays are traced one at a time with trace(). """
+        if type(self).mul_ray is not Matrix.mul_ray:
+            self._traceStructNative(rays)
+            return
+
+        (rays['y'], rays['theta'], rays['z'], rays['isBlocked'], rays['apertureDiameter']) = \
+            Matrix._propagateArrays(rays['y'], rays['theta'], rays['z'], rays['isBlocked'] != 0,
+                                    rays['apertureDiameter'], self.A, self.B, self.C, self.D, self.L,
+                                    self.apertureDiameter, self.apertureNA)
+
+    def _traceStructNative(self, rays):
+        """ Propagates an array of CompactRay.Struct through this single element, in place,
+        with trace() for each ray. """
+        for i in range(len(rays)):
+            ray = Ray(y=float(rays['y'][i]), theta=float(rays['theta'][i]), z=float(rays['z'][i]),
+                      isBlocked=bool(rays['isBlocked'][i]))
+            ray.apertureDiameter = float(rays['apertureDiameter'][i])
+            outputRay = self.trace(ray)[-1]
+            rays['y'][i] = outputRay.y
+            rays['theta'][i] = outputRay.theta
+            rays['z'][i] = outputRay.z
+            rays['isBlocked'][i] = outputRay.isBlocked
+            rays['apertureDiameter'][i] = outputRay.apertureDiameter
+
+    @staticmethod
+    def _propagateArrays(y, theta, z, isBlocked, apertureDiameter, A, B, C, D, L, diameter, NA):
+        """ The ray arrays after propagation through an element with the given properties.
+        The properties can be scalars or arrays that broadcast with the rays (e.g., one
+        value per variant of an element). The blocking logic is the same as trace():
+        a ray that is already blocked is left untouched, a ray beyond the aperture at the
+        entrance of an element of finite length is blocked there without propagating,
+        and a ray that propagates is blocked if it was outside the aperture diameter or NA.
+        """
+        isOutsideDiameter = np.abs(y) > diameter / 2
+        isPropagated = ~isBlocked & ~(isOutsideDiameter & (L > 0))
+
+        outputY = np.where(isPropagated, A * y + B * theta, y)
+        outputTheta = np.where(isPropagated, C * y + D * theta, theta)
+        outputZ = np.where(isPropagated, z + L, z)
+        outputDiameter = np.where(isPropagated, diameter, apertureDiameter)
+        outputIsBlocked = isBlocked | isOutsideDiameter | (np.abs(theta) > NA)
+
+        return outputY, outputTheta, outputZ, outputIsBlocked, outputDiameter
+
     def traceManyOpenCL(self, inputRays):
         r"""This function trace each ray from a group of rays from front edge of element to
         the back edge. It can be either a list of Ray(), or a Rays() object:
@@ -826,103 +1290,32 @@ class Matrix(object):
         It uses OpenCL, which will calculate everything on the GPU or even make use
         of CPU properties to run as many calculations as possible in parallel.
 
+        The kernel is compiled for the precision of the input rays: float with
+        CompactRays in float32 (the default), double with CompactRays(precision="float64"),
+        if the device supports it. The matrices are sent at the same precision.
+
+        The OpenCL context, the compiled kernels and the device buffers are kept
+        by a shared runtime and reused by the following calls. The device (GPU
+        or CPU) is selected with setOpenCLDevice().
+
+        See Also
+        --------
+        raytracing.openCLRuntime
+        raytracing.setOpenCLDevice
         """
         if not isinstance(inputRays, CompactRays):
             raise ValueError("Only CompactRays can be used with OpenCL.  Convert your rays to CompactRays.")
 
-        try:
-            import pyopencl as pycl
-        except ImportError:
-            raise RuntimeError(
-                "pyopencl is required for GPU-accelerated tracing but is not installed.\n"
-                "Install it with: pip install pyopencl\n"
-                "Or use traceManyNative() instead."
-            )
-
-        platforms = pycl.get_platforms()
-        if not platforms:
-            raise RuntimeError(
-                "No OpenCL platforms found on this system.\n"
-                "Use traceManyNative() instead."
-            )
-
-        devices = platforms[0].get_devices(device_type=pycl.device_type.GPU)
-        if not devices:
-            raise RuntimeError(
-                "No OpenCL GPU devices found on this system.\n"
-                "Use traceManyNative() instead."
-            )
-
-        context = pycl.Context(devices=devices)
-        queue = pycl.CommandQueue(context)
-
-        CompactRay.Struct, RayStruct_OpenCL = pycl.tools.match_dtype_to_c_struct(devices[0], "RayStruct", CompactRay.Struct)
-        Matrix.Struct, MatrixStruct_OpenCL = pycl.tools.match_dtype_to_c_struct(devices[0], "MatrixStruct", Matrix.Struct)
+        runtime = openCLRuntime()
 
         matrices = self.transferMatrices()
-        matricesAsStructArray = np.array([ m.toStruct() for m in matrices], dtype=Matrix.Struct )
-        outputRays = CompactRays(maxCount= len(inputRays) * (len(matrices)+1) )
+        precision = inputRays.precision
+        matricesAsStructArray = np.array([m.toStruct(precision) for m in matrices], dtype=Matrix.structFor(precision))
+        outputRays = runtime.traceAllPlanes(matricesAsStructArray, inputRays)
 
-        mf = pycl.mem_flags
-        matriceBuffer = pycl.Buffer(context, flags=mf.HOST_READ_ONLY| mf.COPY_HOST_PTR, hostbuf=matricesAsStructArray)
-        inputRayBuffer = pycl.Buffer(context, flags=mf.HOST_READ_ONLY| mf.COPY_HOST_PTR, hostbuf=inputRays.buffer)
-        outputRayBuffer = pycl.Buffer(context, flags=mf.READ_WRITE | mf.COPY_HOST_PTR, hostbuf=outputRays.buffer)
+        return CompactRaytraces(outputRays, traceLength=len(matrices) + 1)
 
-        N = len(inputRays)
-        M = len(matrices)
-        program_source_floats = RayStruct_OpenCL + MatrixStruct_OpenCL + """
-        kernel void product(global MatrixStruct *mat, global RayStruct *vec, global RayStruct* res, int M)
-                      {
-                      int i    = get_global_id(0); // the vector index
-                      int j;                       // the matrix index
-                      int N    = get_global_size(0);
-                      RayStruct v = vec[i];
-                      res[i*(M+1)] = v;
-                      for (j = 0; j < M; j++) {
-                          MatrixStruct m = mat[j];
-                          
-                          if (!v.isBlocked) {
-                              float old_y = v.y;
-                              v.y     = m.A * old_y + m.B * v.theta;
-                              v.theta = m.C * old_y + m.D * v.theta;
-                              
-                              v.z += m.L;
-                              v.apertureDiameter = m.apertureDiameter;
-
-                              if ( (v.y > m.apertureDiameter/2) || (v.y < -m.apertureDiameter/2) || (v.theta > m.apertureNA) || (v.theta < -m.apertureNA) )  {
-                                 v.isBlocked = 1;
-                              }                          
-                          }
-
-                          //res[i+N*(j+1)] = v;
-                          // res[i*(M+1)+(j+1)] = v;
-                          res[i*(M+1)+(j+1)] = v;
-                      }
-                    }
-        """
-        import time
-        start = time.time()
-        program = pycl.Program(context, program_source_floats).build()
-
-        knl = program.product
-        knl(queue, (N,), None, matriceBuffer, inputRayBuffer, outputRayBuffer, np.int32(M))
-
-        pycl.enqueue_copy(queue, outputRays.buffer, outputRayBuffer)
-
-        raytraces = CompactRaytraces(outputRays, traceLength = M + 1)
-        # # #
-        # # #
-        # # # print(time.time()-start)
-        # raytraces = []
-        # for i in range(N):
-        #     raytrace = []
-        #     for j in range(M+1):
-        #         raytrace.append(outputRays[i*(M+1)+j])
-        #     raytraces.append(raytrace)
-
-        return raytraces
-
-    def traceManyThrough(self, inputRays, progress=True, useOpenCL=True):
+    def traceManyThrough(self, inputRays, progress=True, useOpenCL=True, engine=None):
         """This function trace each ray from a list or a Rays() distribution from
         front edge of element to the back edge.
         Input can be either a list of Ray(), or a Rays() object:
@@ -935,6 +1328,9 @@ class Matrix(object):
             A group of rays
         progress : bool
             if True, the progress of the raceTrough is shown (default=Trye)
+        engine : str
+            If "numpy", all rays are traced at once with traceManyThroughNumpy() and
+            no progress is shown (default=None, i.e. one ray at a time)
 
 
         Returns
@@ -968,6 +1364,9 @@ class Matrix(object):
         -----
         We assume that if the user will be happy to receive
         Rays() as an output even if they passed a list of rays as inputs.
+
+        The rays are traced through compile(): for a MatrixGroup(), consecutive
+        elements that cannot block rays are multiplied once into a single matrix.
         """
 
         try:
@@ -975,22 +1374,30 @@ class Matrix(object):
         except TypeError:
             raise TypeError("'inputRays' argument is not iterable.")
 
+        if engine == "numpy":
+            return self.traceManyThroughNumpy(inputRays)
+        elif engine not in (None, "native"):
+            raise ValueError("Unknown tracing engine '{0}': use 'native' or 'numpy'.".format(engine))
+
         if not isinstance(inputRays, Rays):
             inputRays = Rays(inputRays)
 
-        outputRays = Rays()
-
-        for ray in inputRays:
-            lastRay = self.traceThrough(ray)
+        plan = self.compile()
+        progressLog = 10000
+        survivingRays = []
+        for iteration, ray in enumerate(inputRays):
+            lastRay = plan.traceThrough(ray)
             if lastRay.isNotBlocked:
-                outputRays.append(lastRay)
+                survivingRays.append(lastRay)
 
             if progress:
-                inputRays.displayProgress()
+                progressLog = inputRays.displayProgress(iteration=iteration + 1, progressLog=progressLog)
 
+        outputRays = Rays()
+        outputRays.extend(survivingRays)
         return outputRays
 
-    def traceManyThroughInParallel(self, inputRays, progress=True, processes=None):
+    def traceManyThroughInParallel(self, inputRays, progress=True, processes=None, backend=None):
         """ This is an advanced technique to gain from parallel computation:
         it is the same as traceManyThrough(), but splits this call in
         several other parallel processes using the `multiprocessing` module,
@@ -1009,11 +1416,20 @@ class Matrix(object):
             A group of rays
         progress : bool
             If True, the progress in percentage of the traceTrough is shown (default=True)
+        processes : int
+            The number of processes (default=None, the number of CPUs)
+        backend : str
+            "pickle" to send the rays to the processes and back as Ray objects,
+            or "sharedMemory" to place the rays in shared memory, where each
+            process traces its own range of rays in place with traceManyThroughNumpy()
+            (default=None, "sharedMemory" for CompactRays and "pickle" otherwise).
 
         Returns
         -------
         outputRays : object of Ray class
             List of Ray() (i,e. a raytrace), one for each input ray.
+            The rays are in the same order as the input rays. With the
+            "sharedMemory" backend, it is a CompactRays.
 
         See Also
         --------
@@ -1025,15 +1441,27 @@ class Matrix(object):
         One important technical issue: Pool accesses the array in multiple processes
         and cannot be dynamically generated (because it is not thread-safe).
         We explicitly generate the list before the computation, then we split
-        the array in #processes different lists.
+        the array in #processes consecutive lists.
+
+        With the "sharedMemory" backend, nothing but the optical path and the
+        number of rays that are not blocked is pickled: for many rays, serializing
+        the Ray objects takes much longer than tracing them.
         """
+        if backend is None:
+            backend = "sharedMemory" if isinstance(inputRays, CompactRays) else "pickle"
+        if backend not in ("pickle", "sharedMemory"):
+            raise ValueError("Unknown backend '{0}': use 'pickle' or 'sharedMemory'.".format(backend))
 
         try:
             if processes is None:
                 processes = multiprocessing.cpu_count()
 
+            if backend == "sharedMemory":
+                return self._traceManyThroughSharedMemory(inputRays, processes=processes)
+
             theExplicitList = list(inputRays)
-            manyInputArguments = [(theExplicitList[i::processes], progress) for i in range(processes)]
+            chunkSize = max(math.ceil(len(theExplicitList) / processes), 1)
+            manyInputArguments = [(theExplicitList[i:i + chunkSize], progress) for i in range(0, len(theExplicitList), chunkSize)]
 
             with multiprocessing.Pool(processes=processes) as pool:
                 outputRays = pool.starmap(self.traceManyThrough, manyInputArguments)
@@ -1047,12 +1475,192 @@ class Matrix(object):
             warnings.warn("Multiprocessing failed with: '{0}'. Falling back to slower code.".format(err), ExpertNote)
             return self.traceManyThrough(inputRays=inputRays, progress=progress)
 
+    def _traceManyThroughSharedMemory(self, inputRays, processes):
+        """ The "sharedMemory" backend of traceManyThroughInParallel(): the rays are
+        copied once into shared memory, each process traces a consecutive range
+        of rays in place and moves the rays that are not blocked to the start of
+        its range. The parent gathers them in order. """
+        inputRays = self._asCompactRays(inputRays)
+        count = len(inputRays)
+        dtype = inputRays._rays.dtype
+
+        sharedMemory = shared_memory.SharedMemory(create=True, size=max(count * dtype.itemsize, 1))
+        try:
+            sharedRays = np.ndarray((count,), dtype=dtype, buffer=sharedMemory.buf)
+            sharedRays[:] = inputRays._rays
+
+            bounds = np.linspace(0, count, processes + 1).astype(int)
+            ranges = [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            with multiprocessing.Pool(processes=processes) as pool:
+                survivorCounts = pool.starmap(_traceSharedMemoryRange,
+                                              [(self, sharedMemory.name, dtype, count, start, stop) for start, stop in ranges])
+
+            survivors = np.concatenate([sharedRays[:0]] + [sharedRays[start:start + survivorCount]
+                                                           for (start, stop), survivorCount in zip(ranges, survivorCounts)])
+        finally:
+            sharedRays = None  # The block cannot be closed while an array uses it
+            sharedMemory.close()
+            sharedMemory.unlink()
+
+        return CompactRays(compactRaysStructuredBuffer=survivors)
+
+    def traceManyStream(self, inputRays, chunkSize=100000, engine="numpy", reduce=None, precision=None):
+        """A generator that traces the rays chunk by chunk, like traceManyThrough(),
+        and yields the output rays of each chunk as soon as they are traced.
+        The rays are pulled from inputRays only when a chunk is needed, so that
+        the memory used is bounded by the size of a chunk, even for more
+        rays than can fit in memory.
+
+        Parameters
+        ----------
+        inputRays : iterable of Ray, Rays or CompactRays
+            The rays to trace. It can be a generator: it is only read
+            chunkSize rays at a time.
+        chunkSize : int
+            The number of rays traced at once (default=100000).
+        engine : str
+            "numpy" to trace each chunk with traceManyThroughNumpy() or
+            "native" for traceManyThrough() (default="numpy").
+        reduce : callable, optional
+            A function applied to the output rays of each chunk, to yield
+            its result (e.g., the number of rays, or a histogram) instead of the
+            output rays. The output rays of the chunk can then be released.
+        precision : str, optional
+            The precision of the CompactRays of each chunk with the numpy engine,
+            "float32" or "float64" (default=None, float32 or the precision of the
+            CompactRays given as input).
+
+        Yields
+        ------
+        outputRays : CompactRays or Rays
+            The rays of the chunk that were not blocked, or reduce(outputRays).
+
+        Raises
+        ------
+        ValueError
+            If chunkSize is not a positive integer or if the engine is unknown.
+
+        Examples
+        --------
+        The number of rays transmitted by an aperture, for many rays that are
+        generated as needed:
+
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Aperture(diameter=1)])
+        >>> rays = (Ray(y=(i % 10)/10, theta=0) for i in range(100000))
+        >>> print(sum(path.traceManyStream(rays, chunkSize=10000, reduce=len)))
+        60000
+
+        See Also
+        --------
+        raytracing.Matrix.traceManyThrough
+        raytracing.Matrix.traceManyThroughNumpy
+
+        Notes
+        -----
+        The RandomRays classes keep all the rays they have generated: to keep the
+        memory bounded, give rays from a generator instead.
+        """
+        for chunk, outputRays in self._tracedChunks(inputRays, chunkSize, engine, precision):
+            if reduce is not None:
+                yield reduce(outputRays)
+            else:
+                yield outputRays
+
+    def traceManyStatistics(self, inputRays, chunkSize=100000, engine="numpy", precision=None, statistics=None):
+        """Traces the rays chunk by chunk, like traceManyStream(), and returns
+        the statistics of the output rays (transmitted fraction, mean, RMS and
+        percentiles of the height and of the angle) instead of the output rays,
+        which are released after each chunk.
+
+        Parameters
+        ----------
+        inputRays : iterable of Ray, Rays or CompactRays
+            The rays to trace. It can be a generator: it is only read
+            chunkSize rays at a time.
+        chunkSize : int
+            The number of rays traced at once (default=100000).
+        engine : str
+            "numpy" or "native", as in traceManyStream() (default="numpy").
+        precision : str, optional
+            The precision of the CompactRays of each chunk with the numpy engine,
+            as in traceManyStream().
+        statistics : RayStatistics, optional
+            Statistics to update, e.g. from previous calls. (Default=None, new
+            statistics)
+
+        Returns
+        -------
+        statistics : RayStatistics
+            The statistics of the rays that were not blocked.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Aperture(diameter=1)])
+        >>> rays = (Ray(y=(i % 10)/10, theta=0) for i in range(100000))
+        >>> statistics = path.traceManyStatistics(rays, chunkSize=10000)
+        >>> print(statistics.transmittedFraction)
+        0.6
+
+        See Also
+        --------
+        raytracing.RayStatistics
+        raytracing.Matrix.traceManyStream
+        """
+        if statistics is None:
+            statistics = RayStatistics()
+
+        for chunk, outputRays in self._tracedChunks(inputRays, chunkSize, engine, precision):
+            statistics.fill(outputRays, inputCount=len(chunk))
+
+        return statistics
+
+    def _tracedChunks(self, inputRays, chunkSize, engine, precision):
+        """ The chunks of inputRays (see _rayChunks()) and their output rays, traced
+        with the engine, for traceManyStream() and traceManyStatistics(). """
+        if not isinstance(chunkSize, (int, np.integer)) or chunkSize <= 0:
+            raise ValueError("The chunk size must be a positive integer, not {0}.".format(chunkSize))
+        if engine not in ("numpy", "native"):
+            raise ValueError("Unknown tracing engine '{0}': use 'native' or 'numpy'.".format(engine))
+
+        try:
+            iter(inputRays)
+        except TypeError:
+            raise TypeError("'inputRays' argument is not iterable.")
+
+        for chunk in self._rayChunks(inputRays, chunkSize, precision if engine == "numpy" else None):
+            if engine == "numpy":
+                yield chunk, self.traceManyThroughNumpy(chunk)
+            else:
+                yield chunk, self.traceManyThrough(chunk, progress=False)
+
+    @staticmethod
+    def _rayChunks(inputRays, chunkSize, precision=None):
+        """ The rays of inputRays in consecutive chunks of at most chunkSize rays:
+        views into the buffer for CompactRays, lists of rays otherwise (or CompactRays
+        if a precision is given). """
+        if isinstance(inputRays, CompactRays):
+            for start in range(0, len(inputRays), chunkSize):
+                chunk = CompactRays(compactRaysStructuredBuffer=inputRays._rays[start:start + chunkSize])
+                if precision is not None:
+                    chunk = CompactRays(rays=chunk, precision=precision)
+                yield chunk
+            return
+
+        iterator = iter(inputRays)
+        while True:
+            chunk = list(itertools.islice(iterator, chunkSize))
+            if not chunk:
+                return
+            if precision is not None:
+                chunk = CompactRays(rays=chunk, precision=precision)
+            yield chunk
+
     def profileFromRayTraces(self, rayTraces, z=float("+inf")):
         outputRays = Rays()
-        for rayTrace in rayTraces:
-            ray = Ray.along(rayTrace, z=z)
-            if ray.isNotBlocked:
-                outputRays.append(ray)
+        rays = (Ray.along(rayTrace, z=z) for rayTrace in rayTraces)
+        outputRays.extend(ray for ray in rays if ray.isNotBlocked)
 
         return outputRays
 
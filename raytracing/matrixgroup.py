@@ -1,6 +1,23 @@
 from .matrix import *
 
 import collections.abc as collections
+import bisect
+import copy
+import hashlib
+import importlib
+import json
+import math
+import operator
+import threading
+import weakref
+
+# In each thread, the last ray traced by MatrixGroup.trace() and its ray trace,
+# for the last few groups: one group can be traced from several threads at once.
+_threadTraces = threading.local()
+_threadTracesMaxCount = 16
+
+# The properties of a matrix that are used by a TracePlan
+_planProperties = operator.attrgetter("A", "B", "C", "D", "L", "apertureDiameter", "apertureNA")
 
 
 class MatrixGroup(Matrix):
@@ -21,6 +38,8 @@ class MatrixGroup(Matrix):
         super(MatrixGroup, self).__init__(1, 0, 0, 1, label=label)
 
         self.elements = []
+        self._resetTransferMatrixCache()
+        self._resetCompiledPlan()
 
         if elements is not None:
             if not isinstance(elements, collections.Iterable):
@@ -31,9 +50,9 @@ class MatrixGroup(Matrix):
 
         # Solely for performance reason: it is common to raytrace
         # groups of rays that are similar (to mimick intensities)
-        # We keep the last ray and the last ray trace for optimization
-        self._lastRayToBeTraced = None
-        self._lastRayTrace = None
+        # We keep the last ray and the last ray trace for optimization,
+        # in each thread (see _lastRayToBeTraced and _lastRayTrace), keyed by
+        # the id of the group
 
     def append(self, matrix):
         r"""This function adds an element at the end of the path.
@@ -63,23 +82,37 @@ class MatrixGroup(Matrix):
          f=10.000
 
          """
-        lastElement = None
         if not isinstance(matrix, Matrix):
             raise TypeError("'matrix' must be a Matrix instance.")
 
         if len(self.elements) != 0:
-            lastElement = self.elements[-1]
-            if lastElement.backIndex != matrix.frontIndex:
-                if isinstance(matrix, Space):  
-                    # For Space(), we fix it
-                    matrix.frontIndex = lastElement.backIndex
-                    matrix.backIndex = matrix.frontIndex
-                else:
-                    msg = "Mismatch of indices between last element and appended element"
-                    raise ValueError(msg)
+            self._matchIndices(self.elements[-1], matrix)
 
         self.elements.append(matrix)
-        transferMatrix = self.transferMatrix()
+        self._updateABCD()
+
+    @staticmethod
+    def _matchIndices(lastElement, matrix):
+        """ Checks that the front index of matrix is the back index of lastElement.
+        A Space() adopts the index of the previous element, anything else raises.
+        Returns True if matrix was modified. """
+        if lastElement.backIndex == matrix.frontIndex:
+            return False
+
+        if isinstance(matrix, Space):
+            # For Space(), we fix it
+            matrix.frontIndex = lastElement.backIndex
+            matrix.backIndex = matrix.frontIndex
+            return True
+
+        msg = "Mismatch of indices between last element and appended element"
+        raise ValueError(msg)
+
+    def _updateABCD(self):
+        """ Sets the ABCD matrix and properties of the group from the
+        cached transfer matrix of all elements. """
+        self._updateTransferMatrixCache(checkCount=0)
+        transferMatrix = self._prefixTransferMatrix(len(self.elements))
         self.A = transferMatrix.A
         self.B = transferMatrix.B
         self.C = transferMatrix.C
@@ -90,6 +123,121 @@ class MatrixGroup(Matrix):
         self.frontIndex = transferMatrix.frontIndex
         self.backIndex = transferMatrix.backIndex
 
+    def _resetTransferMatrixCache(self, fromIndex=0):
+        """ Discards the cached transfer matrices of the elements at fromIndex and after.
+
+        The group keeps, for each element i, the product of the transfer matrices
+        of elements 0 to i (`_prefixTransferMatrices`) and the z position at the
+        back of element i (`_cumulativeLengths`), along with the elements that were
+        used to compute them (`_cachedElements`) and their properties at that time
+        (`_cachedProperties`). Appending an element only extends the cache.
+        """
+        if fromIndex == 0:
+            self._cachedElements = []
+            self._cachedProperties = []
+            self._prefixTransferMatrices = []
+            self._cumulativeLengths = []
+        else:
+            del self._cachedElements[fromIndex:]
+            del self._cachedProperties[fromIndex:]
+            del self._prefixTransferMatrices[fromIndex:]
+            del self._cumulativeLengths[fromIndex:]
+
+    @staticmethod
+    def _transferProperties(element):
+        """ The properties of element that are used in the cached transfer matrices.
+        For a group, they are those of its own transfer matrix, updated when its
+        elements are modified with append(), insert(), etc. """
+        return (element.A, element.B, element.C, element.D, element.L, element.frontVertex,
+                element.backVertex, element.frontIndex, element.backIndex)
+
+    def _updateTransferMatrixCache(self, checkCount=None):
+        """ Brings the cached transfer matrices up to date with self.elements.
+
+        The elements are normally modified with append(), insert(), pop() or with
+        a key, but the list can also be modified directly, and the elements can be
+        modified in place (e.g. the B and L of a Space). Elements appended to the
+        end of the list only extend the cache, otherwise we find the first element
+        that is not the same object or that has different properties, and recompute
+        from there. Only the first checkCount elements are checked for changes in
+        place (default=None, all of them). With checkCount=0, only the last cached
+        element is checked, which is all append() needs.
+        """
+        elements = self.elements
+        cachedElements = self._cachedElements
+        cachedProperties = self._cachedProperties
+        cachedCount = len(cachedElements)
+
+        if checkCount is None or cachedCount > len(elements) or \
+                (cachedCount != 0 and cachedElements[-1] is not elements[cachedCount - 1]):
+            checkCount = cachedCount  # The list itself was modified: check everything
+        checkCount = min(checkCount, cachedCount, len(elements))
+
+        firstChange = 0
+        while firstChange < checkCount and \
+                cachedElements[firstChange] is elements[firstChange] and \
+                cachedProperties[firstChange] == self._transferProperties(elements[firstChange]):
+            firstChange += 1
+        if firstChange < checkCount:
+            self._resetTransferMatrixCache(fromIndex=firstChange)
+            cachedCount = firstChange
+        elif cachedCount > len(elements):
+            self._resetTransferMatrixCache(fromIndex=len(elements))
+            cachedCount = len(elements)
+        cachedElements = self._cachedElements  # New lists after a reset from index 0
+        cachedProperties = self._cachedProperties
+
+        for i in range(cachedCount, len(elements)):
+            element = elements[i]
+            if i == 0:
+                self._prefixTransferMatrices.append(element * Matrix(A=1, B=0, C=0, D=1))
+                self._cumulativeLengths.append(element.L)
+            else:
+                self._prefixTransferMatrices.append(element * self._prefixTransferMatrices[-1])
+                self._cumulativeLengths.append(self._cumulativeLengths[-1] + element.L)
+            cachedElements.append(element)
+            cachedProperties.append(self._transferProperties(element))
+
+    def _prefixTransferMatrix(self, count):
+        """ The cached transfer matrix of the first count elements (not a copy). """
+        if count == 0:
+            return Matrix(A=1, B=0, C=0, D=1)
+
+        return self._prefixTransferMatrices[count - 1]
+
+    def _repairFrom(self, firstChange, lastChange):
+        """ Checks the indices of refraction after elements firstChange to lastChange
+        were inserted or removed, and recomputes the cached transfer matrices from firstChange.
+        A Space() that adopts a new index can change the index of the next element,
+        so we keep checking until an element is left untouched. """
+        self._resetTransferMatrixCache(fromIndex=firstChange)
+
+        i = max(firstChange, 1)
+        while i < len(self.elements):
+            isModified = self._matchIndices(self.elements[i - 1], self.elements[i])
+            if i > lastChange and not isModified:
+                break
+            i += 1
+
+        self._updateABCD()
+
+    def __getstate__(self):
+        """ The cached transfer matrices are not saved, they are
+        recomputed when the group is loaded (see __setstate__). """
+        state = self.__dict__.copy()
+        for key in ['_cachedElements', '_cachedProperties', '_prefixTransferMatrices', '_cumulativeLengths',
+                    '_compiledMatrices', '_compiledProperties', '_compiledPlan']:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        for key in ['_lastRayToBeTraced', '_lastRayTrace']:
+            state.pop(key, None)  # Kept by older versions
+        self.__dict__.update(state)
+        self._resetCompiledPlan()
+        self._resetTransferMatrixCache()
+        self._updateTransferMatrixCache()
+
 
     def __len__(self):
         """
@@ -170,10 +318,9 @@ class MatrixGroup(Matrix):
         Has finite diameter? False
         """
         poppedElement = self.elements.pop(index)  # We pop the matrix in the list
-        tempElements = self.elements[:]  # We "copy" the list
-        self.elements.clear()  # We clear the attribute
-        for element in tempElements:
-            self.append(element)  # We rebuild the attribute (check indices, compute ABCD, etc)
+        if index < 0:
+            index += len(self.elements) + 1
+        self._repairFrom(index, index)  # We check indices and compute ABCD from there
         return poppedElement
 
     def insert(self, index: int, element: Matrix):
@@ -217,11 +364,9 @@ class MatrixGroup(Matrix):
             element = MatrixGroup([element])
         else:
             element = MatrixGroup(element)
+        index = len(range(len(self.elements))[:index])  # Actual position, as with list slicing
         self.elements = self.elements[:index] + element.elements + self.elements[index:]
-        tempElements = self.elements[:]
-        self.elements.clear()
-        for matrix in tempElements:
-            self.append(matrix)
+        self._repairFrom(index, index + len(element.elements))
 
     def __setitem__(self, key, element: Matrix):
         """ This function is used to substitute a single matrix 
@@ -310,16 +455,26 @@ class MatrixGroup(Matrix):
         that have been blocked is lost: apertures are not part of the 
         ray formalism.  To find out if a ray has been blocked, you must
         use trace().
+
+        The group keeps the transfer matrix up to each element and the
+        z position of each element: finding the element where "upTo" falls
+        is a binary search and does not multiply all matrices again. Only
+        the elements before "upTo" are checked for changes made in place
+        (e.g. the d of a Space): a change to an element after "upTo" is
+        picked up when "upTo" reaches that element.
         """
-        transferMatrix = Matrix(A=1, B=0, C=0, D=1)
-        distance = upTo
-        for element in self.elements:
-            if element.L <= distance:
-                transferMatrix = element * transferMatrix
-                distance -= element.L
-            else:
-                transferMatrix = element.transferMatrix(upTo=distance) * transferMatrix
-                break
+        self._updateTransferMatrixCache(checkCount=0)
+
+        # Number of elements that end before upTo, once they are checked
+        count = bisect.bisect_right(self._cumulativeLengths, upTo)
+        self._updateTransferMatrixCache(checkCount=count + 1)
+        count = bisect.bisect_right(self._cumulativeLengths, upTo)
+        transferMatrix = copy.copy(self._prefixTransferMatrix(count))
+        if count < len(self.elements):
+            distance = upTo
+            if count > 0:
+                distance -= self._cumulativeLengths[count - 1]
+            transferMatrix = self.elements[count].transferMatrix(upTo=distance) * transferMatrix
 
         return transferMatrix
 
@@ -362,6 +517,122 @@ class MatrixGroup(Matrix):
             transferMatrices.extend(elementTransferMatrices)
         return transferMatrices
 
+    def compile(self):
+        r""" A TracePlan that gives the same output rays as tracing through
+        all the elements of this group, but with fewer steps. Each run of
+        consecutive elements that cannot block rays (e.g., Space() or a Lens()
+        of infinite diameter) is multiplied into a single matrix, and only the
+        elements with a finite aperture diameter or NA remain as checkpoints.
+        Tracing then costs one step per aperture instead of one per element.
+
+        traceThrough() and traceManyThrough() use the plan automatically. The
+        plan is kept and compiled again only if the elements, or their matrices,
+        lengths or apertures, have changed since the last call: checking this
+        only reads a few attributes of each element, which is much faster than
+        tracing through each of them.
+
+        Returns
+        -------
+        plan : TracePlan
+            The steps to trace through.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Lens(f=10), Space(d=10), Lens(f=10, diameter=5), Space(d=10)])
+        >>> plan = path.compile()
+        >>> print(plan)
+        TracePlan: 3 steps, 1 checkpoints
+        >>> print(plan.elementIndices)
+        (2, 3, 4)
+
+        See Also
+        --------
+        raytracing.MatrixGroup.traceThrough
+        raytracing.Matrix.traceManyThrough
+
+        Notes
+        -----
+        The combined matrices are computed in a different order than when
+        tracing one element at a time: the output rays may differ by rounding
+        errors, which can change the result for rays exactly at the edge of an aperture.
+        """
+        matrices = self.transferMatrices()
+        properties = list(map(_planProperties, matrices))
+        if self._isCompiledPlanCurrent(matrices, properties):
+            return self._compiledPlan
+
+        steps = []
+        elementIndices = []
+        isCheckpoint = []
+
+        fusedMatrix = None
+        for i, matrix in enumerate(matrices):
+            if matrix._isFusable():
+                if fusedMatrix is None:
+                    fusedMatrix = matrix
+                else:
+                    fusedMatrix = matrix * fusedMatrix
+                continue
+
+            if fusedMatrix is not None:
+                steps.append(fusedMatrix)
+                elementIndices.append(i - 1)
+                isCheckpoint.append(False)
+                fusedMatrix = None
+
+            steps.append(matrix)
+            elementIndices.append(i)
+            isCheckpoint.append(True)
+
+        if fusedMatrix is not None:
+            steps.append(fusedMatrix)
+            elementIndices.append(len(matrices) - 1)
+            isCheckpoint.append(False)
+
+        self._compiledMatrices = matrices
+        self._compiledProperties = properties
+        self._compiledPlan = TracePlan(steps, elementIndices=elementIndices, isCheckpoint=isCheckpoint)
+        return self._compiledPlan
+
+    def traceThrough(self, inputRay):
+        """Contrary to trace(), this only returns the last ray. The ray
+        is traced through the plan obtained with compile(), so elements that
+        cannot block rays are not traced one by one.
+
+        Parameters
+        ----------
+        inputRay : object of Ray class
+            A ray at height y and angle theta
+
+        Returns
+        -------
+        outputRay : object of Ray class
+            The last ray after propagating through the group, including apertures.
+
+        See Also
+        --------
+        raytracing.MatrixGroup.compile
+        raytracing.MatrixGroup.trace
+        """
+        if not isinstance(inputRay, Ray):
+            return super(MatrixGroup, self).traceThrough(inputRay)
+
+        return self.compile().traceThrough(inputRay)
+
+    def _resetCompiledPlan(self):
+        self._compiledMatrices = None
+        self._compiledProperties = None
+        self._compiledPlan = None
+
+    def _isCompiledPlanCurrent(self, matrices, properties):
+        """ True if the plan was compiled for the same matrices (the same objects)
+        with the same properties. The matrices are kept with the plan, so their
+        ids cannot be reused by other objects. """
+        return self._compiledPlan is not None and len(matrices) == len(self._compiledMatrices) \
+            and all(map(operator.is_, matrices, self._compiledMatrices)) \
+            and properties == self._compiledProperties
+
     def intermediateConjugates(self):
         """ This function calculates the position and the magnification of the conjugate planes.
 
@@ -430,7 +701,8 @@ class MatrixGroup(Matrix):
         if not isinstance(inputRay, (Ray, GaussianBeam)):
             raise TypeError("'inputRay' must be a Ray or a GaussianBeam {0}".format(inputRay))
         ray = inputRay
-        if ray != self._lastRayToBeTraced:
+        lastRayToBeTraced, lastRayTrace = self._lastTraceInThisThread()
+        if ray != lastRayToBeTraced:
             rayTrace = [ray]
             for element in self.elements:
                 rayTraceInElement = element.trace(ray)
@@ -439,13 +711,134 @@ class MatrixGroup(Matrix):
                 else:
                     rayTrace.extend(rayTraceInElement)
                 ray = rayTraceInElement[-1]  # last
-            self._lastRayToBeTraced = inputRay
-            self._lastRayTrace = rayTrace
+            self._keepLastTraceInThisThread(inputRay, rayTrace)
         else:
-            rayTrace = self._lastRayTrace
+            rayTrace = lastRayTrace
 
         return rayTrace
 
+    @property
+    def _lastRayToBeTraced(self):
+        """ The last ray traced by trace() in the current thread, or None """
+        return self._lastTraceInThisThread()[0]
+
+    @property
+    def _lastRayTrace(self):
+        """ The ray trace of _lastRayToBeTraced, or None """
+        return self._lastTraceInThisThread()[1]
+
+    def _lastTraceInThisThread(self):
+        lastTraces = getattr(_threadTraces, 'lastTraces', {})
+        group, inputRay, rayTrace = lastTraces.get(id(self), (None, None, None))
+        if group is None or group() is not self:
+            return None, None
+        return inputRay, rayTrace
+
+    def _keepLastTraceInThisThread(self, inputRay, rayTrace):
+        """ Keeps inputRay and its rayTrace for this thread, keyed by id(self). The
+        group is kept with a weak reference (to recognize a new group with the same
+        id), but inputRay and rayTrace are kept until they are replaced or until the
+        group is among the oldest of more than _threadTracesMaxCount groups. """
+        if not hasattr(_threadTraces, 'lastTraces'):
+            _threadTraces.lastTraces = {}
+        lastTraces = _threadTraces.lastTraces
+
+        lastTraces.pop(id(self), None)
+        lastTraces[id(self)] = (weakref.ref(self), inputRay, rayTrace)
+        if len(lastTraces) > _threadTracesMaxCount:
+            del lastTraces[next(iter(lastTraces))]  # The oldest
+
+    def sweep(self, elementIndex, attribute, values, rays):
+        """ Trace the same rays through several variants of this group, where a single
+        property of one element takes each of the provided values. All variants are
+        traced at once: the rays and the properties of the elements are stacked in arrays
+        of shape (len(values), len(rays)), which is much faster than building and
+        tracing a new group for each value.
+
+        Parameters
+        ----------
+        elementIndex : int
+            The index of the element to vary. It must be a single element (not a group).
+        attribute : str
+            The property to vary: "A", "B", "C", "D", "L", "apertureDiameter", "apertureNA",
+            or "d" for the length of a Space (which changes both B and L).
+        values : list of float
+            The values of the property, one for each variant.
+        rays : list of Ray, Rays or CompactRays
+            The rays to trace through every variant.
+
+        Returns
+        -------
+        transmission : array
+            The fraction of rays that are not blocked, for each value.
+
+        Raises
+        ------
+        ValueError
+            If an element overrides mul_ray() (e.g. Axicon), because the variants
+            are traced with the ABCD matrices only.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path = ImagingPath([Space(d=10), Lens(f=10), Space(d=10), Aperture(diameter=1)])
+        >>> rays = UniformRays(yMax=0.5, thetaMax=0.05, M=11, N=11)
+        >>> transmission = path.sweep(3, "apertureDiameter", [0.45, 0.85, 2], rays)
+        >>> print(transmission)
+        [0.45454545 0.81818182 1.        ]
+
+        See Also
+        --------
+        raytracing.Matrix.traceManyThrough
+        """
+        element = self.elements[elementIndex]
+        if len(element.transferMatrices()) != 1:
+            raise ValueError("Only a single element can be varied, not a group of elements.")
+        for matrix in self.transferMatrices():
+            if type(matrix).mul_ray is not Matrix.mul_ray:
+                raise ValueError("Cannot sweep a group with a {0}: it changes how rays are multiplied "
+                                 "and cannot be traced with its ABCD matrix.".format(type(matrix).__name__))
+
+        if attribute == "d":
+            if not isinstance(element, Space):
+                raise ValueError("The attribute 'd' can only be varied for a Space().")
+            attributes = ["B", "L"]
+        elif attribute in ["A", "B", "C", "D", "L", "apertureDiameter", "apertureNA"]:
+            attributes = [attribute]
+        else:
+            raise ValueError("Cannot vary the attribute '{0}'.".format(attribute))
+
+        if elementIndex < 0:
+            elementIndex += len(self.elements)
+        variedIndex = sum([len(e.transferMatrices()) for e in self.elements[:elementIndex]])
+
+        values = np.asarray(values, dtype=float).reshape((-1, 1))
+        inputRays = self._asCompactRays(rays)._rays
+        shape = (len(values), len(inputRays))
+
+        y = np.broadcast_to(inputRays['y'].astype(float), shape)
+        theta = np.broadcast_to(inputRays['theta'].astype(float), shape)
+        z = np.broadcast_to(inputRays['z'].astype(float), shape)
+        isBlocked = np.broadcast_to(inputRays['isBlocked'] != 0, shape)
+        apertureDiameter = np.broadcast_to(inputRays['apertureDiameter'].astype(float), shape)
+
+        for i, matrix in enumerate(self.transferMatrices()):
+            properties = {"A": matrix.A, "B": matrix.B, "C": matrix.C, "D": matrix.D, "L": matrix.L,
+                          "apertureDiameter": matrix.apertureDiameter, "apertureNA": matrix.apertureNA}
+            if i == variedIndex:
+                for name in attributes:
+                    properties[name] = values
+
+            (y, theta, z, isBlocked, apertureDiameter) = Matrix._propagateArrays(
+                y, theta, z, isBlocked, apertureDiameter,
+                properties["A"], properties["B"], properties["C"], properties["D"], properties["L"],
+                properties["apertureDiameter"], properties["apertureNA"])
+
+        if shape[1] == 0:
+            return np.zeros(shape[0])
+
+        return np.count_nonzero(~isBlocked, axis=1) / shape[1]
+
     def hasFiniteApertureDiameter(self):
         """ True if ImagingPath has at least one element of finite diameter """
         for element in self.elements:
@@ -478,6 +871,7 @@ class MatrixGroup(Matrix):
         allElements = self.elements
         allElements.reverse()
         self.elements = []
+        self._resetTransferMatrixCache()
 
         for element in allElements:
             element.flipOrientation()
@@ -486,8 +880,13 @@ class MatrixGroup(Matrix):
         return self
 
     def __iter__(self):
-        self.iteration = 0
-        return self
+        # A new iterator at each call, independent of next(group), so that
+        # several loops (in several threads) can iterate over the elements.
+        # It does not reset the cursor of next(group) (self.iteration).
+        index = 0
+        while index < len(self.elements):
+            yield self.elements[index]
+            index += 1
 
     def __next__(self):
         if self.elements is None:
@@ -498,44 +897,73 @@ class MatrixGroup(Matrix):
             return element
         raise StopIteration
 
-    def save(self, filePath: str):
+    pathFormat = "raytracing.MatrixGroup"
+    pathFormatVersion = 1
+    unsavedAttributes = ()  # Not saved with format="json" (e.g. display state)
+
+    def save(self, filePath, format="pickle"):
 
         """ A MatrixGroup can be saved using this function and loaded with `load()`
 
+        With format="pickle", the file contains the pickled list of elements.
+        With format="json", it is a JSON document that does not depend on the
+        version of Python or of the module::
+
+            {"format": "raytracing.MatrixGroup", "version": 1,
+             "hash": "<sha256 of the elements>",
+             "elements": [{"type": "raytracing.matrix:Space", "state": {"L": 10, ...}}, ...]}
+
+        The state of an element is its list of attributes. Infinite and NaN values
+        (e.g. the diameter of most elements) are saved as {"float": "inf"},
+        {"float": "-inf"} or {"float": "nan"}, so that the file is strict JSON.
+        Materials are saved by name ({"class": "raytracing.materials:N_BK7"}) and
+        the elements of groups (e.g. a thorlabs lens) are saved recursively. The
+        display state of an ImagingPath (its figure) is not saved.
+
         Parameters
         ----------
         filePath : str or PathLike or file-like object
             A path, or a Python file-like object, or possibly some backend-dependent object.
             Must be provided in OS-dependent format.
+        format : str
+            "pickle" or "json" (default="pickle").
+
+        Raises
+        ------
+        ValueError
+            If the format is not "pickle" or "json".
+
+        Examples
+        --------
+        >>> import os, tempfile
+        >>> from raytracing import *
+        >>> filePath = os.path.join(tempfile.mkdtemp(), "path.json")
+        >>> MatrixGroup([Space(d=10), Lens(f=10), Space(d=10)]).save(filePath, format="json")
+        >>> path = MatrixGroup()
+        >>> path.load(filePath)
+        >>> len(path)
+        3
         """
-        with open(filePath, "wb") as outfile:
-            pickle.Pickler(outfile).dump(self.elements)
-
-            # We save the data to disk using a module called Pickler
-            # Some asynchronous magic is happening here with Pickle
-            # and sometimes, access to files is wonky, especially
-            # when the files are very large.
-            # Make sure file exists
-            while not os.path.exists(filePath):
-                time.sleep(0.1)
-
-            oldSize = None
-            # Make sure file is not still being written to
-            while True:
-                try:
-                    currentSize = os.path.getsize(filePath)
-                    if currentSize == oldSize:
-                        break
-
-                    time.sleep(1)
-                    oldSize = currentSize
-                except:
-                    # Not possible, yet: sometimes we get here
-                    time.sleep(0.1)
+
+        if format == "json":
+            elements = [self._elementDescription(element) for element in self.elements]
+            document = {"format": self.pathFormat, "version": self.pathFormatVersion,
+                        "hash": self._descriptionHash(elements), "elements": elements}
+            with open(filePath, "w") as outfile:
+                json.dump(document, outfile, allow_nan=False)
+        elif format == "pickle":
+            with open(filePath, "wb") as outfile:
+                pickle.Pickler(outfile).dump(self.elements)
+        else:
+            raise ValueError(f"Unknown format '{format}': use 'pickle' or 'json'.")
 
     def load(self, filePath, append=False):
         """ A MatrixGroup saved with `save()` can be loaded using this function.
 
+        The format ("pickle" or "json") is recognized from the content of the file.
+        The indices of the elements are checked and the transfer matrices are
+        computed once for all the loaded elements.
+
         Parameters
         ----------
         filePath : str or PathLike or file-like object
@@ -546,15 +974,142 @@ class MatrixGroup(Matrix):
         """
 
         with open(filePath, 'rb') as infile:
-            loadedMatrices = pickle.Unpickler(infile).load()
-            if not isinstance(loadedMatrices, collections.Iterable):
-                raise IOError(f"{filePath} does not contain an iterable of Matrix objects.")
-            if not all([isinstance(matrix, Matrix) for matrix in loadedMatrices]):
-                raise IOError(f"{filePath} must contain only Matrix objects.")
-            if append and self.elements is not None:
-                for element in loadedMatrices:
-                    self.append(element)
+            isJSON = infile.read(1) == b"{"
+            infile.seek(0)
+            if isJSON:
+                loadedMatrices = self._elementsFromDocument(json.load(infile), filePath)
             else:
-                self.elements = []
-                for element in loadedMatrices:
-                    self.append(element)
+                loadedMatrices = pickle.Unpickler(infile).load()
+
+        if not isinstance(loadedMatrices, collections.Iterable):
+            raise IOError(f"{filePath} does not contain an iterable of Matrix objects.")
+        loadedMatrices = list(loadedMatrices)
+        if not all([isinstance(matrix, Matrix) for matrix in loadedMatrices]):
+            raise IOError(f"{filePath} must contain only Matrix objects.")
+
+        if not append or self.elements is None:
+            self.elements = []
+            self._resetTransferMatrixCache()
+
+        lastElement = self.elements[-1] if len(self.elements) != 0 else None
+        for element in loadedMatrices:
+            if lastElement is not None:
+                self._matchIndices(lastElement, element)
+            lastElement = element
+
+        self.elements.extend(loadedMatrices)
+        self._updateABCD()
+
+    def contentHash(self) -> str:
+        """ The SHA-256 hash (in hexadecimal) of the elements of the group, as saved
+        with format="json". Groups with the same elements have the same hash, even if
+        they are different objects, in another process or another session. The label
+        of the group and the display state of an ImagingPath are not included.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> path1 = MatrixGroup([Space(d=10), Lens(f=10)])
+        >>> path2 = MatrixGroup([Space(d=10), Lens(f=10)])
+        >>> path1.contentHash() == path2.contentHash()
+        True
+        >>> path2.append(Space(d=10))
+        >>> path1.contentHash() == path2.contentHash()
+        False
+        """
+        return self._descriptionHash([self._elementDescription(element) for element in self.elements])
+
+    @staticmethod
+    def _descriptionHash(elements):
+        text = json.dumps(elements, sort_keys=True, separators=(",", ":"), allow_nan=False)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _elementDescription(cls, element):
+        """ The type and the attributes of element, for the JSON format. The cached
+        values of groups are left out (see __getstate__). """
+        elementType = type(element)
+        if isinstance(element, MatrixGroup):
+            state = element.__getstate__()
+        else:
+            state = element.__dict__
+        unsavedAttributes = getattr(element, "unsavedAttributes", ())
+
+        return {"type": f"{elementType.__module__}:{elementType.__qualname__}",
+                "state": {key: cls._encodedValue(value) for key, value in state.items()
+                          if key not in unsavedAttributes}}
+
+    @classmethod
+    def _encodedValue(cls, value):
+        if value is None or isinstance(value, (bool, int, str)):
+            return value
+        elif isinstance(value, (float, np.floating)):
+            value = float(value)
+            if not math.isfinite(value):
+                return {"float": str(value)}  # "inf", "-inf" or "nan"
+            return value
+        elif isinstance(value, np.bool_):
+            return bool(value)
+        elif isinstance(value, np.integer):
+            return int(value)
+        elif isinstance(value, list):
+            return [cls._encodedValue(item) for item in value]
+        elif isinstance(value, Matrix):
+            return cls._elementDescription(value)
+        elif isinstance(value, type):
+            return {"class": f"{value.__module__}:{value.__qualname__}"}
+
+        raise TypeError(f"Cannot save a value of type {type(value).__name__} in a path: {value!r}")
+
+    @classmethod
+    def _elementsFromDocument(cls, document, filePath):
+        if not isinstance(document, dict) or document.get("format") != cls.pathFormat:
+            raise IOError(f"{filePath} is not a {cls.pathFormat} JSON file.")
+        if document.get("version") != cls.pathFormatVersion:
+            raise IOError(f"{filePath} has version {document.get('version')} of the format, "
+                          f"only version {cls.pathFormatVersion} can be read.")
+
+        try:
+            return [cls._decodedValue(description) for description in document["elements"]]
+        except (KeyError, TypeError, AttributeError, ImportError) as err:
+            raise IOError(f"{filePath} contains an invalid element: {err}")
+
+    @classmethod
+    def _decodedValue(cls, value):
+        if isinstance(value, list):
+            return [cls._decodedValue(item) for item in value]
+        elif not isinstance(value, dict):
+            return value
+        elif "float" in value:
+            return float(value["float"])
+        elif "class" in value:
+            return cls._namedClass(value["class"])
+
+        elementType = cls._namedClass(value["type"])
+        if not issubclass(elementType, Matrix):
+            raise TypeError(f"{value['type']} is not a Matrix")
+        state = {key: cls._decodedValue(item) for key, item in value["state"].items()}
+        element = elementType.__new__(elementType)
+        if isinstance(element, MatrixGroup):
+            element.__setstate__(state)
+        else:
+            element.__dict__.update(state)
+        return element
+
+    @staticmethod
+    def _namedClass(qualifiedName):
+        """ The class of this package named "module:name" in a JSON file. Only the
+        modules of this package are imported: the elements are created without
+        calling __init__, so a file cannot name any other class. """
+        package = __name__.partition(".")[0]
+        moduleName, _, name = qualifiedName.partition(":")
+        if moduleName != package and not moduleName.startswith(package + "."):
+            raise TypeError(f"{qualifiedName} is not a class of {package}")
+
+        value = importlib.import_module(moduleName)
+        for attribute in name.split("."):
+            value = getattr(value, attribute)
+
+        if not isinstance(value, type) or value.__module__.partition(".")[0] != package:
+            raise TypeError(f"{qualifiedName} is not a class of {package}")
+        return value
@@ -0,0 +1,298 @@
+"""A persistent OpenCL runtime for tracing rays on a GPU or CPU device.
+
+Creating an OpenCL context, a command queue and building a program are slow
+operations (the build alone can take longer than tracing a small batch of
+rays). The ``OpenCLRuntime`` does them once: it keeps the context and the queue
+of its device, the kernels already built (one for each memory layout of the
+rays and matrices, see ``CompactRay.structFor()``) and the device buffers, which
+are reused by the following calls as long as they are large enough.
+
+A single runtime is shared by all calls to ``Matrix.traceManyOpenCL()``. It is
+created the first time it is needed, on the device selected with
+``setOpenCLDevice()``: by default the first GPU found on any platform, or the
+first CPU device (e.g., with the pocl driver) if there is no GPU.
+
+``pyopencl`` is optional: it is only imported when a runtime is created.
+
+See Also
+--------
+raytracing.Matrix.traceManyOpenCL
+raytracing.CompactRays
+"""
+
+import threading
+import numpy as np
+from .compact import CompactRays
+
+_KERNEL_SOURCE = """
+kernel void product(global MatrixStruct *mat, global RayStruct *vec, global RayStruct* res, int M)
+              {
+              int i    = get_global_id(0); // the vector index
+              int j;                       // the matrix index
+              RayStruct v = vec[i];
+              res[i*(M+1)] = v;
+              for (j = 0; j < M; j++) {
+                  MatrixStruct m = mat[j];
+
+                  if (!v.isBlocked) {
+                      real old_y = v.y;
+                      v.y     = m.A * old_y + m.B * v.theta;
+                      v.theta = m.C * old_y + m.D * v.theta;
+
+                      v.z += m.L;
+                      v.apertureDiameter = m.apertureDiameter;
+
+                      if ( (v.y > m.apertureDiameter/2) || (v.y < -m.apertureDiameter/2) || (v.theta > m.apertureNA) || (v.theta < -m.apertureNA) )  {
+                         v.isBlocked = 1;
+                      }
+                  }
+
+                  res[i*(M+1)+(j+1)] = v;
+              }
+            }
+"""
+
+_deviceTypes = ("any", "gpu", "cpu")
+_sharedRuntime = None
+_sharedRuntimeOptions = {"deviceType": "any", "platformIndex": None, "deviceIndex": 0}
+_sharedRuntimeLock = threading.Lock()
+
+
+class OpenCLRuntime:
+    """The OpenCL context, queue, built kernels and device buffers of one device,
+    kept between calls to trace rays.
+
+    Parameters
+    ----------
+    deviceType : str
+        "gpu", "cpu", or "any" for the first GPU or else the first CPU
+        device. (Default="any")
+    platformIndex : int, optional
+        Only look for devices on this platform. (Default=None, all platforms)
+    deviceIndex : int
+        Which of the devices found to use. (Default=0)
+
+    Raises
+    ------
+    ValueError
+        If the device type is not "any", "gpu" or "cpu".
+    RuntimeError
+        If pyopencl is not installed, or if no device is found.
+
+    See Also
+    --------
+    raytracing.openCLRuntime
+    raytracing.setOpenCLDevice
+    """
+
+    def __init__(self, deviceType="any", platformIndex=None, deviceIndex=0):
+        if deviceType not in _deviceTypes:
+            raise ValueError("The device type must be one of {0}, not '{1}'.".format(_deviceTypes, deviceType))
+
+        try:
+            import pyopencl as pycl
+        except ImportError:
+            raise RuntimeError(
+                "pyopencl is required for GPU-accelerated tracing but is not installed.\n"
+                "Install it with: pip install pyopencl\n"
+                "Or use traceManyNative() instead."
+            )
+        self.pycl = pycl
+
+        devices = OpenCLRuntime.availableDevices(deviceType=deviceType, platformIndex=platformIndex)
+        if not devices:
+            raise RuntimeError(
+                "No OpenCL device of type '{0}' found on this system.\n"
+                "Use traceManyNative() instead.".format(deviceType)
+            )
+        if not 0 <= deviceIndex < len(devices):
+            raise RuntimeError("There are only {0} OpenCL devices of type '{1}': no device {2}.".format(len(devices), deviceType, deviceIndex))
+
+        self.device = devices[deviceIndex]
+        self.context = pycl.Context(devices=[self.device])
+        self.queue = pycl.CommandQueue(self.context)
+
+        self._kernels = {}
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def availableDevices(deviceType="any", platformIndex=None):
+        """ The OpenCL devices of the requested type on all platforms (or only
+        on platformIndex), in the order of the platforms. With "any", the GPU
+        devices are listed before the CPU devices. An empty list is returned if
+        pyopencl is not installed.
+        """
+        if deviceType not in _deviceTypes:
+            raise ValueError("The device type must be one of {0}, not '{1}'.".format(_deviceTypes, deviceType))
+
+        try:
+            import pyopencl as pycl
+            platforms = pycl.get_platforms()
+        except Exception:
+            return []
+
+        if platformIndex is not None:
+            platforms = platforms[platformIndex:platformIndex + 1]
+
+        if deviceType == "gpu":
+            types = [pycl.device_type.GPU]
+        elif deviceType == "cpu":
+            types = [pycl.device_type.CPU]
+        else:
+            types = [pycl.device_type.GPU, pycl.device_type.CPU]
+
+        devices = []
+        for clType in types:
+            for platform in platforms:
+                try:
+                    devices.extend(platform.get_devices(device_type=clType))
+                except Exception:
+                    pass  # pyopencl raises when a platform has no device of that type
+        return devices
+
+    def __str__(self):
+        return "OpenCLRuntime: {0} ({1}), {2} kernels".format(self.device.name.strip(),
+                                                              self.device.platform.name.strip(),
+                                                              len(self._kernels))
+
+    def kernel(self, rayStruct, matrixStruct):
+        """ The traced kernel built for these ray and matrix layouts, with the
+        layouts as they must be in memory on the device. It is built the first
+        time and then reused.
+
+        Parameters
+        ----------
+        rayStruct : numpy.dtype
+            The layout of the rays, CompactRay.Struct or CompactRay.Struct64.
+        matrixStruct : numpy.dtype
+            The layout of the matrices, Matrix.Struct or Matrix.Struct64.
+
+        Returns
+        -------
+        rayStruct, matrixStruct, kernel
+            The layouts on the device and the kernel.
+        """
+        key = (rayStruct, matrixStruct)
+        if key not in self._kernels:
+            pycl = self.pycl
+            deviceRayStruct, rayStructSource = pycl.tools.match_dtype_to_c_struct(self.device, "RayStruct", rayStruct)
+            deviceMatrixStruct, matrixStructSource = pycl.tools.match_dtype_to_c_struct(self.device, "MatrixStruct", matrixStruct)
+
+            if rayStruct['y'] == np.float64:
+                real = "#pragma OPENCL EXTENSION cl_khr_fp64 : enable\ntypedef double real;\n"
+            else:
+                real = "typedef float real;\n"
+
+            program = pycl.Program(self.context, real + rayStructSource + matrixStructSource + _KERNEL_SOURCE).build()
+            self._kernels[key] = (deviceRayStruct, deviceMatrixStruct, program.product)
+
+        return self._kernels[key]
+
+    def buffer(self, name, nbytes):
+        """ A device buffer of at least nbytes, reused from the previous calls
+        with the same name if it is large enough. """
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.size < nbytes:
+            buffer = self.pycl.Buffer(self.context, self.pycl.mem_flags.READ_WRITE, size=max(nbytes, 1))
+            self._buffers[name] = buffer
+        return buffer
+
+    def releaseBuffers(self):
+        """ Releases the device buffers kept for the next calls. """
+        with self._lock:
+            self._buffers = {}
+
+    def traceAllPlanes(self, matricesAsStructArray, inputRays):
+        """ Traces the rays through the matrices on the device and returns all
+        the rays: the input ray followed by the ray after each matrix, for each
+        input ray.
+
+        Parameters
+        ----------
+        matricesAsStructArray : numpy.ndarray
+            The matrices, from Matrix.toStruct(), at the precision of the rays.
+        inputRays : CompactRays
+            The rays to trace.
+
+        Returns
+        -------
+        outputRays : CompactRays
+            len(inputRays) * (len(matrices)+1) rays, trace after trace.
+        """
+        rayStruct, matrixStruct, kernel = self.kernel(inputRays._rays.dtype, matricesAsStructArray.dtype)
+        rays = inputRays._rays.astype(rayStruct, copy=False)
+        matrices = matricesAsStructArray.astype(matrixStruct, copy=False)
+
+        N = len(rays)
+        M = len(matrices)
+        outputRays = CompactRays(compactRaysStructuredBuffer=np.zeros((N * (M + 1),), dtype=rayStruct))
+        if N == 0:
+            return outputRays
+
+        with self._lock:
+            pycl = self.pycl
+            matrixBuffer = self.buffer("matrices", matrices.nbytes)
+            inputRayBuffer = self.buffer("inputRays", rays.nbytes)
+            outputRayBuffer = self.buffer("outputRays", outputRays._rays.nbytes)
+
+            if M > 0:
+                pycl.enqueue_copy(self.queue, matrixBuffer, matrices)
+            pycl.enqueue_copy(self.queue, inputRayBuffer, rays)
+            kernel(self.queue, (N,), None, matrixBuffer, inputRayBuffer, outputRayBuffer, np.int32(M))
+            pycl.enqueue_copy(self.queue, outputRays._rays, outputRayBuffer)
+
+        return outputRays
+
+
+def openCLRuntime():
+    """ The OpenCL runtime shared by all calls to traceManyOpenCL(). It is created
+    the first time, on the device selected with setOpenCLDevice().
+
+    Raises
+    ------
+    RuntimeError
+        If pyopencl is not installed, or if no device is found.
+    """
+    global _sharedRuntime
+    with _sharedRuntimeLock:
+        if _sharedRuntime is None:
+            _sharedRuntime = OpenCLRuntime(**_sharedRuntimeOptions)
+        return _sharedRuntime
+
+
+def setOpenCLDevice(deviceType="any", platformIndex=None, deviceIndex=0):
+    """ Selects the device of the shared OpenCL runtime. The current runtime,
+    with its kernels and buffers, is released and the next call to
+    openCLRuntime() creates a new one on this device.
+
+    Parameters
+    ----------
+    deviceType : str
+        "gpu", "cpu", or "any" for the first GPU or else the first CPU
+        device. (Default="any")
+    platformIndex : int, optional
+        Only look for devices on this platform. (Default=None, all platforms)
+    deviceIndex : int
+        Which of the devices found to use. (Default=0)
+
+    Raises
+    ------
+    ValueError
+        If the device type is not "any", "gpu" or "cpu".
+
+    Examples
+    --------
+    To trace on the CPU with a driver like pocl, when there is no GPU:
+
+    >>> from raytracing import *
+    >>> setOpenCLDevice("cpu")
+    >>> setOpenCLDevice()  # Back to the default: any device
+    """
+    global _sharedRuntime, _sharedRuntimeOptions
+    if deviceType not in _deviceTypes:
+        raise ValueError("The device type must be one of {0}, not '{1}'.".format(_deviceTypes, deviceType))
+
+    with _sharedRuntimeLock:
+        _sharedRuntimeOptions = {"deviceType": deviceType, "platformIndex": platformIndex, "deviceIndex": deviceIndex}
+        _sharedRuntime = None
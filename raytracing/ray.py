@@ -1,3 +1,4 @@
+import numpy as np
 from .utils import deprecated, areAbsolutelyAlmostEqual
 
 class Ray:
@@ -208,14 +209,11 @@ class Ray:
         else:
             raise ValueError("M must be 1 or larger.")
 
-        rays = []
-        for j in range(M):
-            for i in range(N):
-                theta = radianMin + float(i) * deltaRadian
-                y = yMin + float(j) * deltaHeight
-                rays.append(Ray(y, theta))
+        heights = yMin + np.arange(M, dtype=float) * deltaHeight
+        angles = radianMin + np.arange(N, dtype=float) * deltaRadian
+        y, theta = np.meshgrid(heights, angles, indexing='ij')
 
-        return rays
+        return [Ray(y, theta) for y, theta in zip(y.ravel().tolist(), theta.ravel().tolist())]
 
     def at(self, z):
         """This function returns a ray at position z parallel to the current ray.
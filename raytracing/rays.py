@@ -6,6 +6,67 @@ import time
 import os
 import collections.abc as collections
 import warnings
+import threading
+
+_randomRaysLock = threading.RLock()
+
+
+def randomSeedSequence(seed=None):
+    """ The numpy.random.SeedSequence from which the streams of random numbers
+    of a random ray source are derived.
+
+    Parameters
+    ----------
+    seed : None, int, sequence of int, numpy.random.SeedSequence or numpy.random.Generator
+        An integer (or sequence of integers) always gives the same sequence. A
+        Generator gives a new sequence drawn from it, so sources seeded with the
+        same Generator are independent. (Default=None, no sequence: the global
+        numpy.random functions are used)
+
+    Returns
+    -------
+    seedSequence : numpy.random.SeedSequence or None
+    """
+    if seed is None or isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(0, 2**63, size=4))
+    return np.random.SeedSequence(seed)
+
+
+def randomBlockGenerator(seedSequence, block):
+    """ The generator of random numbers for the block of rays number block. It
+    is seeded with the same child as seedSequence.spawn(block+1)[block], but
+    without spawning: the stream of a block only depends on the seed and on the
+    block, not on the blocks generated before, nor on the process or the thread
+    that generates it.
+
+    Parameters
+    ----------
+    seedSequence : numpy.random.SeedSequence
+        The sequence of the source, see randomSeedSequence().
+    block : int
+        The index of the block of rays.
+
+    Returns
+    -------
+    generator : numpy.random.Generator
+    """
+    child = np.random.SeedSequence(seedSequence.entropy, spawn_key=tuple(seedSequence.spawn_key) + (block,),
+                                   pool_size=seedSequence.pool_size)
+    return np.random.default_rng(child)
+
+
+def _rayValues(rays, attributes):
+    """ The values of the attributes (e.g. "y", "theta" or "isBlocked") of all
+    the rays, as numpy arrays. rays can be a Rays, a CompactRays, a ColumnarRays
+    or any sequence of Ray. """
+    if hasattr(rays, "_fieldValues"):
+        return [np.asarray(rays._fieldValues(attribute)) for attribute in attributes]
+
+    rays = list(rays)
+    return [np.fromiter((getattr(ray, attribute) for ray in rays), dtype=float, count=len(rays))
+            for attribute in attributes]
 
 
 class Rays:
@@ -33,8 +94,9 @@ class Rays:
     Attributes
     ----------
     iteration : int
-        When used as an iterator, this represents the current iteration. Reinitialized to 
-        zero everytime.
+        The position of next(rays). A for loop does not use it: every loop gets
+        its own iterator, so that several loops (in several threads) can iterate
+        over the same rays at the same time.
     progressLog : int
         How many iterations after which the progress through the iterator is shown (default=1000)
         This is mutliplied by 3 after progress report.
@@ -64,8 +126,9 @@ class Rays:
             self._rays = []
         else:
             if isinstance(rays, collections.Iterable):
-                if all([isinstance(ray, Ray) for ray in rays]):
-                    self._rays = list(rays)
+                rays = list(rays)
+                if all(isinstance(ray, Ray) for ray in rays):
+                    self._rays = rays
                 else:
                     raise TypeError("'rays' elements must be of type Ray.")
             else:
@@ -76,6 +139,7 @@ class Rays:
         self.z = 0
         self.rayColors = None
         self.label = None
+        self._rayArrays = None  # See _setRaysFromArrays()
 
         # We cache these because they can be lengthy to calculate
         self._yValues = None
@@ -90,7 +154,22 @@ class Rays:
         self._anglesHistogramParameters = None
         self._xValuesAnglesHistogram = None
 
+    def __getattr__(self, name):
+        # Only called for missing attributes: the rays of a grid are created
+        # from its arrays when they are first needed, see _setRaysFromArrays()
+        rayArrays = self.__dict__.get("_rayArrays")
+        if name != "_rays" or rayArrays is None:
+            raise AttributeError("'{0}' object has no attribute '{1}'".format(type(self).__name__, name))
+
+        y, theta = rayArrays
+        self._rays = [Ray(y, theta) for y, theta in zip(y.tolist(), theta.tolist())]
+        self._rayArrays = None
+        return self._rays
+
     def __len__(self) -> int:
+        rayArrays = self._uncreatedRayArrays()
+        if rayArrays is not None:
+            return len(rayArrays[0])
         if self._rays is None:
             return 0
         return len(self._rays)
@@ -198,23 +277,21 @@ class Rays:
         if binCount is None:
             binCount = 40
 
+        yValues = np.asarray(self.yValues)
         if minValue is None:
-            minValue = min(self.yValues)
+            minValue = yValues.min()
 
         if maxValue is None:
-            maxValue = max(self.yValues)
+            maxValue = yValues.max()
 
         if self._countHistogramParameters != (binCount, minValue, maxValue):
             self._countHistogramParameters = (binCount, minValue, maxValue)
 
-            (self._yHistogram, binEdges) = np.histogram(self.yValues,
+            (self._yHistogram, binEdges) = np.histogram(yValues,
                                                      bins=binCount,
                                                      range=(minValue, maxValue))
             self._yHistogram = list(self._yHistogram)
-            xValues = []
-            for i in range(len(binEdges) - 1):
-                xValues.append((binEdges[i] + binEdges[i + 1]) / 2)
-            self._xValuesCountHistogram = xValues
+            self._xValuesCountHistogram = list((binEdges[:-1] + binEdges[1:]) / 2)
 
         return (self._xValuesCountHistogram, self._yHistogram)
 
@@ -278,21 +355,19 @@ class Rays:
         if binCount is None:
             binCount = 40
 
+        thetaValues = np.asarray(self.thetaValues)
         if minValue is None:
-            minValue = min(self.thetaValues)
+            minValue = thetaValues.min()
 
         if maxValue is None:
-            maxValue = max(self.thetaValues)
+            maxValue = thetaValues.max()
 
         if self._anglesHistogramParameters != (binCount, minValue, maxValue):
             self._anglesHistogramParameters = (binCount, minValue, maxValue)
 
-            (self._thetaHistogram, binEdges) = np.histogram(self.thetaValues, bins=binCount, range=(minValue, maxValue))
+            (self._thetaHistogram, binEdges) = np.histogram(thetaValues, bins=binCount, range=(minValue, maxValue))
             self._thetaHistogram = list(self._thetaHistogram)
-            xValues = []
-            for i in range(len(binEdges) - 1):
-                xValues.append((binEdges[i] + binEdges[i + 1]) / 2)
-            self._xValuesAnglesHistogram = xValues
+            self._xValuesAnglesHistogram = list((binEdges[:-1] + binEdges[1:]) / 2)
 
         return (self._xValuesAnglesHistogram, self._thetaHistogram)
 
@@ -323,11 +398,36 @@ class Rays:
                     :width: 70%
                     :align: center
 
+        """
+        countHistogram = self.rayCountHistogram()
+        anglesHistogram = self.rayAnglesHistogram() if showTheta else None
+        self.displayHistograms(countHistogram, anglesHistogram, title=title)
+
+    @staticmethod
+    def displayHistograms(countHistogram, anglesHistogram=None, title="Intensity profile"):  # pragma: no cover
+        """This function plots intensity profiles like display(), from histograms
+        that were already calculated (e.g. a RayHistogram filled in chunks).
+
+        Parameters
+        ----------
+        countHistogram : tuple of lists
+            The bins and the counts for the height of rays, as returned by
+            rayCountHistogram(), or None.
+        anglesHistogram : tuple of lists
+            The bins and the counts for the angle of rays, as returned by
+            rayAnglesHistogram(), or None (default=None).
+        title : string
+            the title for the plot (default="Intensity profile")
+
+        See Also
+        --------
+        raytracing.RayHistogram
+        raytracing.PhaseSpaceHistogram
         """
         fontScale = 1.5
 
         plt.ioff()
-        if showTheta:
+        if countHistogram is not None and anglesHistogram is not None:
             fig, axes = plt.subplots(2, figsize=(10, 7))
             fig.suptitle(title, fontsize=12*fontScale)
             fig.tight_layout(pad=3.0)
@@ -335,20 +435,23 @@ class Rays:
             axis1 = axes[0]
             axis2 = axes[1]
         else:
-            fig, axis1 = plt.subplots(1, figsize=(10, 7))
+            fig, axis = plt.subplots(1, figsize=(10, 7))
             fig.suptitle(title, fontsize=13*fontScale)
             fig.tight_layout(pad=3.0)
 
-        (x, y) = self.rayCountHistogram()
+            axis1 = axis
+            axis2 = axis
 
-        axis1.plot(x, y, 'k-', label="Intensity")
-        axis1.set_ylim([0, max(y) * 1.1])
-        axis1.set_xlabel("Height of ray", fontsize=13*fontScale)
-        axis1.set_ylabel("Ray count", fontsize=13*fontScale)
-        axis1.tick_params(labelsize=13*fontScale)
+        if countHistogram is not None:
+            (x, y) = countHistogram
+            axis1.plot(x, y, 'k-', label="Intensity")
+            axis1.set_ylim([0, max(y) * 1.1])
+            axis1.set_xlabel("Height of ray", fontsize=13*fontScale)
+            axis1.set_ylabel("Ray count", fontsize=13*fontScale)
+            axis1.tick_params(labelsize=13*fontScale)
 
-        if showTheta:
-            (x, y) = self.rayAnglesHistogram()
+        if anglesHistogram is not None:
+            (x, y) = anglesHistogram
             axis2.plot(x, y, 'k--', label="Orientation profile")
             axis2.set_ylim([0, max(y) * 1.1])
             axis2.set_xlim([-np.pi / 2, np.pi / 2])
@@ -359,21 +462,53 @@ class Rays:
         plt.subplots_adjust(left=0.12)
         plt.show()
 
-    def displayProgress(self):
-        """This function prints the progress of the iterations"""
+    def displayProgress(self, iteration=None, progressLog=None):
+        """This function prints the progress of the iterations.
+
+        Without arguments, it uses and updates the attributes iteration and
+        progressLog: iteration only counts the rays returned by next(rays), not
+        those of a for loop or of an index. Any other loop keeps its own count
+        and gives iteration and progressLog, and keeps the returned progressLog
+        for the next call: the rays are not modified.
+
+        Parameters
+        ----------
+        iteration : int, optional
+            The number of rays done (default=None, the attribute iteration)
+        progressLog : int, optional
+            The progress is shown when iteration is a multiple of progressLog
+            (default=None, the attribute progressLog)
+
+        Returns
+        -------
+        progressLog : int
+            The value of progressLog for the next call
+        """
+        useAttributes = iteration is None
+        if iteration is None:
+            iteration = self.iteration
+        if progressLog is None:
+            progressLog = self.progressLog
 
         nRays = len(self)
-        if self.iteration % self.progressLog == 0:
-            self.progressLog *= 3
-            if self.progressLog > nRays:
-                self.progressLog = nRays
+        if iteration % progressLog == 0:
+            progressLog *= 3
+            if progressLog > nRays:
+                progressLog = nRays
+
+            print("Progress {0}/{1} ({2:.0f}%) ".format(iteration, nRays, iteration / nRays * 100))
 
-            print("Progress {0}/{1} ({2:.0f}%) ".format(self.iteration, nRays, self.iteration / nRays * 100))
+        if useAttributes:
+            self.progressLog = progressLog
+        return progressLog
 
     def __iter__(self):
-        self.iteration = 0
-        self.progressLog = 10000
-        return self
+        # A new iterator at each call, independent of next(rays): it does
+        # not reset the cursor of next(rays) (self.iteration)
+        index = 0
+        while index < len(self):
+            yield self[index]
+            index += 1
 
     def __next__(self) -> Ray:
         if self._rays is None:
@@ -402,19 +537,71 @@ class Rays:
             raise TypeError("'ray' must be a 'Ray' object.")
         if self._rays is not None:
             if copy:
-                rayCopy = Ray()
-                rayCopy.y = ray.y
-                rayCopy.theta = ray.theta
-                rayCopy.z = ray.z
-                rayCopy.isBlocked = ray.isBlocked
-                rayCopy.wavelength = ray.wavelength
-                rayCopy.apertureDiameter = ray.apertureDiameter
-
-                self._rays.append(rayCopy)
+                self._rays.append(self._copyOfRay(ray))
             else:
                 self._rays.append(ray)
 
-        # Invalidate cached values
+        self._invalidateCachedValues()
+
+    def extend(self, rays, copy=False):
+        """Many rays can be appended at once to the list of the rays using this
+        function. It is faster than append() for each ray: the cached values
+        (e.g., the histograms) are invalidated once for all the rays.
+
+        Parameters
+        ----------
+        rays : iterable of Ray
+            The rays to append, e.g. a list of Ray or another Rays.
+        copy : bool
+            If True, copies of the rays are appended (default=False).
+
+        Raises
+        ------
+        TypeError
+            If one of the elements is not a Ray.
+
+        Examples
+        --------
+        >>> from raytracing import *
+        >>> rays = Rays()
+        >>> rays.extend([Ray(y=0), Ray(y=1)])
+        >>> rays.count
+        2
+        """
+        rays = list(rays)
+        if not all(isinstance(ray, Ray) for ray in rays):
+            raise TypeError("'rays' elements must be of type Ray.")
+        if self._rays is not None:
+            if copy:
+                rays = [self._copyOfRay(ray) for ray in rays]
+            self._rays.extend(rays)
+
+        self._invalidateCachedValues()
+
+    def appendMany(self, rays, copy=False):
+        """The same as extend(), with a name that goes with append().
+
+        Parameters
+        ----------
+        rays : iterable of Ray
+            The rays to append.
+        copy : bool
+            If True, copies of the rays are appended (default=False).
+        """
+        self.extend(rays, copy=copy)
+
+    @staticmethod
+    def _copyOfRay(ray):
+        rayCopy = Ray()
+        rayCopy.y = ray.y
+        rayCopy.theta = ray.theta
+        rayCopy.z = ray.z
+        rayCopy.isBlocked = ray.isBlocked
+        rayCopy.wavelength = ray.wavelength
+        rayCopy.apertureDiameter = ray.apertureDiameter
+        return rayCopy
+
+    def _invalidateCachedValues(self):
         self._yValues = None
         self._thetaValues = None
         self._yHistogram = None
@@ -427,6 +614,31 @@ class Rays:
         self._anglesHistogramParameters = None
         self._xValuesAnglesHistogram = None
 
+    def _setRaysFromArrays(self, y, theta):
+        """ Replaces the rays by rays with the heights y and the angles theta,
+        without the type checks of __init__. The Ray objects are only created
+        when they are first needed: yValues, thetaValues and CompactRays(rays=...)
+        are obtained from the arrays instead. """
+        self.__dict__.pop("_rays", None)
+        self._rayArrays = (np.asarray(y, dtype=float), np.asarray(theta, dtype=float))
+        self._invalidateCachedValues()
+        self._yValues = self._rayArrays[0].tolist()
+        self._thetaValues = self._rayArrays[1].tolist()
+
+    def _uncreatedRayArrays(self):
+        """ The heights and angles given to _setRaysFromArrays(), or None once
+        the Ray objects are created (they can then be modified). """
+        if "_rays" in self.__dict__:
+            return None
+        return self.__dict__.get("_rayArrays")
+
+    @staticmethod
+    def _gridArrays(heights, angles):
+        """ The heights and angles of a grid of rays: all the angles for the first
+        height, then all the angles for the second height, etc. """
+        y, theta = np.meshgrid(np.asarray(heights, dtype=float), np.asarray(angles, dtype=float), indexing='ij')
+        return y.ravel(), theta.ravel()
+
     def load(self, filePath, append=False):
 
         """ A list of rays can be loaded using this function.
@@ -438,54 +650,125 @@ class Rays:
             Must be provided in OS-dependent format.
         append : bool
             If True, the loaded rays will be appended to the current list of rays.
+
+        Notes
+        -----
+        Files saved with format="npy" are recognized and read as well, see save().
         """
 
         with open(filePath, 'rb') as infile:
-            loadedRays = pickle.Unpickler(infile).load()
-            if not isinstance(loadedRays, collections.Iterable):
-                raise IOError(f"{filePath} does not contain an iterable of Ray objects.")
-            if not all([isinstance(ray, Ray) for ray in loadedRays]):
-                raise IOError(f"{filePath} must contain only Ray objects.")
-            if append and self._rays is not None:
-                self._rays.extend(loadedRays)
-            else:
-                self._rays = loadedRays
+            isNpyFile = infile.read(len(Rays.npyMagic)) == Rays.npyMagic
 
-    def save(self, filePath):
+        if isNpyFile:
+            loadedRays = [self._copyOfRay(ray) for ray in Rays.open(filePath, mmap=False)]
+        else:
+            with open(filePath, 'rb') as infile:
+                loadedRays = pickle.Unpickler(infile).load()
+
+        if not isinstance(loadedRays, collections.Iterable):
+            raise IOError(f"{filePath} does not contain an iterable of Ray objects.")
+        if not all([isinstance(ray, Ray) for ray in loadedRays]):
+            raise IOError(f"{filePath} must contain only Ray objects.")
+        if append and self._rays is not None:
+            self._rays.extend(loadedRays)
+        else:
+            self._rays = loadedRays
+        self._invalidateCachedValues()
+
+    npyMagic = b"\x93NUMPY"
+
+    def save(self, filePath, format="pickle", precision=None):
 
         """ A list of rays can be saved using this function.
 
+        With format="pickle", the file contains the pickled list of Ray objects.
+        With format="npy", it is a standard NumPy .npy file: a header (with the
+        layout and the number of rays) followed by one record per ray, in the
+        layout of ``CompactRay.Struct`` (float32) or ``CompactRay.Struct64``
+        (float64), i.e. the buffer of a ``CompactRays``. It can be read with
+        ``numpy.load()``, or opened with ``Rays.open()`` to trace the rays in place
+        without reading the whole file in memory.
+
         Parameters
         ----------
         filePath : str or PathLike or file-like object
             A path, or a Python file-like object, or possibly some backend-dependent object.
             Must be provided in OS-dependent format.
+        format : str
+            "pickle" or "npy" (default="pickle").
+        precision : str or numpy dtype, optional
+            With format="npy", "float32" or "float64" (default=None, the precision of
+            CompactRays and ColumnarRays, or else float32).
+
+        Raises
+        ------
+        ValueError
+            If the format is not "pickle" or "npy".
+
+        Examples
+        --------
+        >>> import os, tempfile
+        >>> from raytracing import *
+        >>> filePath = os.path.join(tempfile.mkdtemp(), "rays.npy")
+        >>> RandomLambertianRays(maxCount=1000, seed=1).save(filePath, format="npy")
+        >>> rays = Rays.open(filePath)
+        >>> len(rays)
+        1000
+        """
+
+        if format == "npy":
+            from .compact import CompactRays
+            compactRays = CompactRays(rays=self, precision=precision)
+            with open(filePath, 'wb') as outfile:
+                np.save(outfile, compactRays._rays, allow_pickle=False)
+        elif format == "pickle":
+            if isinstance(self._rays, list):
+                rays = self._rays
+            else:
+                rays = [self._copyOfRay(ray) for ray in self]
+            with open(filePath, 'wb') as outfile:
+                pickle.Pickler(outfile).dump(rays)
+        else:
+            raise ValueError("Unknown format '{0}': use 'pickle' or 'npy'.".format(format))
+
+    @staticmethod
+    def open(filePath, mmap=True):
+
+        """ Opens rays saved with save(filePath, format="npy") as a CompactRays.
+        With mmap=True, the file is mapped in memory (with numpy.memmap) and only
+        read when needed: the rays can be traced in place, e.g. with
+        traceManyThroughNumpy(), and several processes can open the same file and
+        share its pages. The mapped rays are read-only.
+
+        Parameters
+        ----------
+        filePath : str or PathLike
+            The path of the .npy file.
+        mmap : bool
+            If True, the file is mapped in memory read-only; if False, it is read
+            in memory and the rays can be modified (default=True).
+
+        Returns
+        -------
+        rays : CompactRays
+            The rays of the file, in float32 or float64 as saved.
+
+        Raises
+        ------
+        IOError
+            If the file is not a .npy file of rays.
         """
+        from .compact import CompactRay, CompactRays
+
+        try:
+            array = np.load(filePath, mmap_mode="r" if mmap else None, allow_pickle=False)
+        except ValueError as err:
+            raise IOError(f"{filePath} is not a .npy file of rays: {err}")
 
-        with open(filePath, 'wb') as outfile:
-            pickle.Pickler(outfile).dump(self._rays)
-
-        # We save the data to disk using a module called Pickler
-        # Some asynchronous magic is happening here with Pickle
-        # and sometimes, access to files is wonky, especially
-        # when the files are very large.
-        # Make sure file exists
-        while not os.path.exists(filePath):
-            time.sleep(0.1)
-
-        oldSize = None
-        # Make sure file is not still being written to
-        while True:
-            try:
-                currentSize = os.path.getsize(filePath)
-                if currentSize == oldSize:
-                    break
-
-                time.sleep(1)
-                oldSize = currentSize
-            except:
-                # Not possible, yet: sometimes we get here
-                time.sleep(0.1)
+        if array.ndim != 1 or array.dtype not in (CompactRay.Struct, CompactRay.Struct64):
+            raise IOError(f"{filePath} does not contain rays in the layout of CompactRay.Struct or CompactRay.Struct64.")
+
+        return CompactRays(compactRaysStructuredBuffer=array)
 
     # For 2D histogram:
     # https://en.wikipedia.org/wiki/Xiaolin_Wu's_line_algorithm
@@ -548,17 +831,15 @@ class UniformRays(Rays):
 
         self.M = M
         self.N = N
-        rays = []
 
         if self.M == 1:
             heights = [0]
         else:
             heights = np.linspace(self.yMin, self.yMax, self.M, endpoint=True)
+        angles = np.linspace(self.thetaMin, self.thetaMax, self.N, endpoint=True)
 
-        for y in heights:
-            for theta in np.linspace(self.thetaMin, self.thetaMax, self.N, endpoint=True):
-                rays.append(Ray(y, theta))
-        super(UniformRays, self).__init__(rays=rays)
+        super(UniformRays, self).__init__()
+        self._setRaysFromArrays(*Rays._gridArrays(heights, angles))
 
 
 class LambertianRays(Rays):
@@ -611,13 +892,16 @@ class LambertianRays(Rays):
         self.M = M
         self.N = N
         self.I = I
-        rays = []
-        for theta in np.linspace(self.thetaMin, self.thetaMax, N, endpoint=True):
-            intensity = int(I * np.cos(theta))
-            for y in np.linspace(self.yMin, self.yMax, M, endpoint=True):
-                for k in range(intensity):
-                    rays.append(Ray(y, theta))
-        super(LambertianRays, self).__init__(rays=rays)
+
+        # For each angle, each height is repeated int(I*cos(theta)) times
+        angles = np.linspace(self.thetaMin, self.thetaMax, N, endpoint=True)
+        heights = np.linspace(self.yMin, self.yMax, M, endpoint=True)
+        theta, y = Rays._gridArrays(angles, heights)
+        intensities = np.array([int(I * np.cos(angle)) for angle in angles], dtype=int)
+        repeats = np.repeat(np.maximum(intensities, 0), len(heights))
+
+        super(LambertianRays, self).__init__()
+        self._setRaysFromArrays(np.repeat(y, repeats), np.repeat(theta, repeats))
 
 
 class RandomRays(Rays):
@@ -637,16 +921,28 @@ class RandomRays(Rays):
         If no value is assigned to this parameter it will be -thetaMax
     maxCount : int
         Number of rays in the list
+    seed : None, int, numpy.random.SeedSequence or numpy.random.Generator
+        The seed of the random rays (default=None, the global numpy.random
+        functions are used). With a seed, the rays are generated in blocks of
+        randomBlockSize rays, each with its own stream derived from the seed
+        with SeedSequence.spawn(): the ray at an index is always the same for the
+        same seed, whatever the order, the thread or the process that generates it.
 
 
     See Also
     --------
     raytracing.RandomLambertianRays
     raytracing.RandomUniformRays
+    raytracing.randomSeedSequence
 
     """
-    def __init__(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, maxCount=100000):
+    randomBlockSize = 4096
+
+    def __init__(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, maxCount=100000, seed=None):
         self.maxCount = maxCount
+        self.seedSequence = randomSeedSequence(seed)
+        self._blockGenerator = None
+        self._blockGeneratorIndex = None
         self.yMax = yMax
         self.yMin = yMin
         if self.yMin is None:
@@ -668,11 +964,21 @@ class RandomRays(Rays):
         if item < 0 or item >= self.maxCount:
             raise IndexError(f"Index {item} out of bound, min = 0, max {self.maxCount}.")
 
-        start = time.monotonic()
-        while len(self._rays) <= item:
-            self.randomRay()
-            if time.monotonic() - start > 3:
-                warnings.warn("Generating missing rays. This can take a few seconds.", UserWarning)
+        with _randomRaysLock:  # Two threads must not generate the same missing rays
+            start = time.monotonic()
+            if not self.hasRandomRayArrays():
+                while len(self._rays) <= item:
+                    self.randomRay()
+                    if time.monotonic() - start > 3:
+                        warnings.warn("Generating missing rays. This can take a few seconds.", UserWarning)
+            elif len(self._rays) <= item:
+                # The missing rays up to the end of the block of item, a block at a time
+                stop = min((item // self.randomBlockSize + 1) * self.randomBlockSize, self.maxCount)
+                for y, theta in self.randomRayBlocks(len(self._rays), stop):
+                    self._rays.extend([Ray(y, theta) for y, theta in zip(y.tolist(), theta.tolist())])
+                    if time.monotonic() - start > 3:
+                        warnings.warn("Generating missing rays. This can take a few seconds.", UserWarning)
+                self._invalidateCachedValues()
 
         return self._rays[item]
 
@@ -687,6 +993,84 @@ class RandomRays(Rays):
     def randomRay(self) -> Ray:
         raise NotImplementedError("You must implement randomRay() in your subclass")
 
+    def randomRayArrays(self, random, count):
+        """ The heights and angles of count random rays, drawn at once with
+        numpy. Subclasses implement it to generate their rays in blocks instead
+        of one at a time with randomRay().
+
+        Parameters
+        ----------
+        random : numpy.random.Generator or the numpy.random module
+            The source of random numbers, see randomGenerator().
+        count : int
+            The number of rays.
+
+        Returns
+        -------
+        y, theta : numpy.ndarray
+            The heights and the angles of the rays.
+        """
+        raise NotImplementedError("You must implement randomRayArrays() in your subclass")
+
+    def hasRandomRayArrays(self) -> bool:
+        """ True if the rays are drawn in blocks with randomRayArrays(). A subclass
+        that only overrides randomRay() keeps its own distribution, one ray at a
+        time. """
+        owners = {}
+        for cls in reversed(type(self).__mro__):
+            for name in ("randomRay", "randomRayArrays"):
+                if name in cls.__dict__:
+                    owners[name] = cls
+        return issubclass(owners["randomRayArrays"], owners["randomRay"])
+
+    def randomRayBlocks(self, start, stop):
+        """ The heights and angles of the random rays with an index from start to
+        stop, as numpy arrays, a block of randomBlockSize rays at a time. With a
+        seed, each block is drawn with its own generator, so a ray is the same
+        whether it is generated here, by indexing or in another process.
+
+        Parameters
+        ----------
+        start : int
+            The index of the first ray.
+        stop : int
+            The index after the last ray.
+
+        Returns
+        -------
+        blocks : iterator of (numpy.ndarray, numpy.ndarray)
+            The heights and the angles of the rays, block after block.
+        """
+        blockSize = self.randomBlockSize
+        while start < stop:
+            block = start // blockSize
+            blockStart = block * blockSize
+            blockStop = min(blockStart + blockSize, self.maxCount)
+            if self.seedSequence is None:
+                # No stream to reproduce: only draw the rays needed
+                blockStart = start
+                random = np.random
+            else:
+                random = randomBlockGenerator(self.seedSequence, block)
+
+            y, theta = self.randomRayArrays(random, blockStop - blockStart)
+            end = min(stop, blockStop)
+            yield y[start - blockStart:end - blockStart], theta[start - blockStart:end - blockStart]
+            start = end
+
+    def randomGenerator(self):
+        """ The source of random numbers for the next ray: the generator of its
+        block if the rays are seeded, or else the numpy.random module. Both
+        have the same random() method. """
+        if self.seedSequence is None:
+            return np.random
+
+        block = len(self._rays) // self.randomBlockSize
+        if self._blockGeneratorIndex != block:
+            self._blockGenerator = randomBlockGenerator(self.seedSequence, block)
+            self._blockGeneratorIndex = block
+        return self._blockGenerator
+
 
 class RandomUniformRays(RandomRays):
     """A list of random rays with Uniform distribution.
@@ -705,6 +1089,8 @@ class RandomUniformRays(RandomRays):
             If no value is assigned to this parameter it will be -thetaMax
         maxCount : int
             Number of rays in the list
+        seed : None, int, numpy.random.SeedSequence or numpy.random.Generator
+            The seed of the random rays, see RandomRays (default=None)
 
         Examples
         --------
@@ -729,20 +1115,28 @@ class RandomUniformRays(RandomRays):
 
         """
 
-    def __init__(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, maxCount=100000):
+    def __init__(self, yMax=1.0, yMin=None, thetaMax=np.pi / 2, thetaMin=None, maxCount=100000, seed=None):
         super(RandomUniformRays, self).__init__(yMax=yMax, yMin=yMin, thetaMax=thetaMax, thetaMin=thetaMin,
-                                                maxCount=maxCount)
+                                                maxCount=maxCount, seed=seed)
 
     def randomRay(self) -> Ray:
         if len(self._rays) == self.maxCount:
             raise AttributeError("Cannot generate more random rays, maximum count achieved")
 
-        theta = self.thetaMin + np.random.random() * (self.thetaMax - self.thetaMin)
-        y = self.yMin + np.random.random() * (self.yMax - self.yMin)
+        random = self.randomGenerator()
+        theta = self.thetaMin + random.random() * (self.thetaMax - self.thetaMin)
+        y = self.yMin + random.random() * (self.yMax - self.yMin)
         ray = Ray(y=y, theta=theta)
         self.append(ray)
         return ray
 
+    def randomRayArrays(self, random, count):
+        # The same draws as randomRay(): theta, then y, ray after ray
+        draws = random.random((count, 2))
+        theta = self.thetaMin + draws[:, 0] * (self.thetaMax - self.thetaMin)
+        y = self.yMin + draws[:, 1] * (self.yMax - self.yMin)
+        return y, theta
+
 
 class RandomLambertianRays(RandomRays):
     """A list of random rays with Lambertian distribution.
@@ -756,6 +1150,8 @@ class RandomLambertianRays(RandomRays):
         If no value is assigned to this parameter it will be -yMax.
     maxCount : int
         Number of rays in the list
+    seed : None, int, numpy.random.SeedSequence or numpy.random.Generator
+        The seed of the random rays, see RandomRays (default=None)
 
     Examples
     --------
@@ -780,27 +1176,36 @@ class RandomLambertianRays(RandomRays):
 
     """
 
-    def __init__(self, yMax=1.0, yMin=None, maxCount=10000):
+    def __init__(self, yMax=1.0, yMin=None, maxCount=10000, seed=None):
         super(RandomLambertianRays, self).__init__(yMax=yMax, yMin=yMin, thetaMax=np.pi / 2, thetaMin=-np.pi / 2,
-                                                   maxCount=maxCount)
+                                                   maxCount=maxCount, seed=seed)
 
     def randomRay(self) -> Ray:
         if len(self._rays) == self.maxCount:
             raise AttributeError("Cannot generate more random rays, maximum count achieved")
 
+        random = self.randomGenerator()
         theta = 0
         while (True):
-            theta = self.thetaMin + np.random.random() * (self.thetaMax - self.thetaMin)
+            theta = self.thetaMin + random.random() * (self.thetaMax - self.thetaMin)
             intensity = np.cos(theta)
-            randomValue = np.random.random()
+            randomValue = random.random()
             if randomValue < intensity:
                 break
 
-        y = self.yMin + np.random.random() * (self.yMax - self.yMin)
+        y = self.yMin + random.random() * (self.yMax - self.yMin)
         ray = Ray(y, theta)
         self.append(ray)
         return ray
 
+    def randomRayArrays(self, random, count):
+        # Inverse of the cumulative distribution of cos(theta): sin(theta) is uniform
+        sinThetaMin = np.sin(self.thetaMin)
+        sinThetaMax = np.sin(self.thetaMax)
+        theta = np.arcsin(sinThetaMin + random.random(count) * (sinThetaMax - sinThetaMin))
+        y = self.yMin + random.random(count) * (self.yMax - self.yMin)
+        return y, theta
+
 
 class GaussianProfileUniformRays(RandomRays):
     """A list of random rays with Gaussian intensity distribution.
@@ -811,6 +1216,8 @@ class GaussianProfileUniformRays(RandomRays):
         1/e gaussien width in intensity
     maxCount : int
         Number of rays in the list
+    seed : None, int, numpy.random.SeedSequence or numpy.random.Generator
+        The seed of the random rays, see RandomRays (default=None)
 
     Examples
     --------
@@ -830,9 +1237,9 @@ class GaussianProfileUniformRays(RandomRays):
     raytracing.RandomUniformRays
 
     """
-    def __init__(self, intensityWidth, maxCount=10000):
+    def __init__(self, intensityWidth, maxCount=10000, seed=None):
         super(GaussianProfileUniformRays, self).__init__(yMax=4*intensityWidth, yMin=-4*intensityWidth, thetaMax=np.pi / 2, thetaMin=-np.pi / 2,
-                                                   maxCount=maxCount)
+                                                   maxCount=maxCount, seed=seed)
         self.intensityWidth = intensityWidth
 
     def randomRay(self) -> Ray:
@@ -845,19 +1252,32 @@ class GaussianProfileUniformRays(RandomRays):
         if len(self._rays) == self.maxCount:
             raise AttributeError("Cannot generate more random rays, maximum count achieved")
 
-
+        random = self.randomGenerator()
         while (True):
-            y = self.yMin + np.random.random() * (self.yMax - self.yMin)
+            y = self.yMin + random.random() * (self.yMax - self.yMin)
             intensity = np.exp(-y*y/self.intensityWidth/self.intensityWidth)
-            randomValue = np.random.random()
+            randomValue = random.random()
             if randomValue < intensity:
                 break
 
-        theta = self.thetaMin + np.random.random() * (self.thetaMax - self.thetaMin)
+        theta = self.thetaMin + random.random() * (self.thetaMax - self.thetaMin)
         ray = Ray(y, theta)
         self.append(ray)
         return ray
 
+    def randomRayArrays(self, random, count):
+        # exp(-y^2/w^2) is a normal distribution of standard deviation w/sqrt(2),
+        # cut at yMin and yMax: the few heights outside are drawn again.
+        sigma = self.intensityWidth / np.sqrt(2)
+        y = random.standard_normal(count) * sigma
+        outside = (y < self.yMin) | (y > self.yMax)
+        while np.any(outside):
+            y[outside] = random.standard_normal(np.count_nonzero(outside)) * sigma
+            outside = (y < self.yMin) | (y > self.yMax)
+
+        theta = self.thetaMin + random.random(count) * (self.thetaMax - self.thetaMin)
+        return y, theta
+
 
 class RayTrace:
     """A single ray trace: the path of one ray through an optical system.
@@ -887,15 +1307,8 @@ class RayTrace:
         return self._rays[index]
 
     def __iter__(self):
-        self.iteration = 0
-        return self
-
-    def __next__(self):
-        if self.iteration < len(self):
-            ray = self[self.iteration]
-            self.iteration += 1
-            return ray
-        raise StopIteration
+        for index in range(len(self)):
+            yield self[index]
 
     def __str__(self):
         if len(self) == 0:
@@ -952,15 +1365,8 @@ class RayTraces:
         return self._rayTraces[index]
 
     def __iter__(self):
-        self.iteration = 0
-        return self
-
-    def __next__(self):
-        if self.iteration < len(self):
-            trace = self[self.iteration]
-            self.iteration += 1
-            return trace
-        raise StopIteration
+        for index in range(len(self)):
+            yield self[index]
 
     def __str__(self):
         lines = []
@@ -1048,15 +1454,18 @@ class LampRays(RandomUniformRays, Rays):
         Position of the lamp in the optical path.
     random: bool
         Use randomly distributed rays across the lamp's diameter. Better used with a high N.
+    seed: None, int, numpy.random.SeedSequence or numpy.random.Generator
+        The seed of the random rays, see RandomRays. Only used if random is true.
     rayColors
         Specify a color or a set of colors for the traced rays of this lamp.
     label: str
         Label to display over the lamp in the imaging path.
 
     """
-    def __init__(self, diameter, NA=1.0, N=100, T=10, H=None, random=False, z=0, rayColors=None, label=None):
+    def __init__(self, diameter, NA=1.0, N=100, T=10, H=None, random=False, z=0, rayColors=None, label=None, seed=None):
         if random:
-            RandomUniformRays.__init__(self, yMax=diameter/2, yMin=-diameter/2, thetaMax=NA, thetaMin=-NA, maxCount=N)
+            RandomUniformRays.__init__(self, yMax=diameter/2, yMin=-diameter/2, thetaMax=NA, thetaMin=-NA, maxCount=N,
+                                       seed=seed)
         else:
             self.yMin = -diameter/2
             self.yMax = diameter/2
@@ -1065,13 +1474,10 @@ class LampRays(RandomUniformRays, Rays):
                 N = H
             self.maxCount = N*T
 
-            rays = []
             heights = np.linspace(self.yMin, self.yMax, N, endpoint=True)
             angles = np.linspace(-NA, NA, T, endpoint=True)
-            for y in heights:
-                for theta in angles:
-                    rays.append(Ray(y, theta))
-            Rays.__init__(self, rays=rays)
+            Rays.__init__(self)
+            self._setRaysFromArrays(*Rays._gridArrays(heights, angles))
 
         self.z = z
         self.rayColors = rayColors
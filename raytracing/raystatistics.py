@@ -0,0 +1,335 @@
+"""Summary statistics of traced rays, calculated one group of rays at a time.
+
+The transmitted fraction, the mean, the RMS and the percentiles of the height
+and of the angle of the output rays are usually obtained from all the output
+rays (e.g. ``outputRays.yValues``), which must then be kept in memory. A
+``RayStatistics`` is updated with ``fill()`` for each chunk of traced rays and
+keeps only a few numbers: the moments are accumulated with Welford's method,
+and the percentiles with a ``QuantileSketch`` of a bounded number of values.
+Two statistics (e.g., calculated in different processes) are combined with
+``merge()``, which gives the same moments as if all the rays were in one
+chunk.
+
+See Also
+--------
+raytracing.Matrix.traceManyStatistics
+raytracing.TracingExecutor.traceManyStatistics
+raytracing.RayHistogram
+"""
+
+import numpy as np
+from .histograms import _unblockedValues
+
+
+class QuantileSketch:
+    """An approximation of the distribution of many values, from which the
+    quantiles are obtained, with a memory that does not depend on the number
+    of values.
+
+    The values are kept as weighted centroids, sorted by value, as in the
+    t-digest of Dunning and Ertl: when there are more than `compression`
+    centroids, neighbouring centroids are combined, with smaller centroids
+    near the extremes of the distribution so that the tails remain accurate.
+    The error on a quantile q is of the order of q(1-q)/compression.
+    Up to `compression` values, the quantiles are exact.
+
+    Parameters
+    ----------
+    compression : int
+        The approximate number of centroids that are kept (default=200).
+    """
+
+    def __init__(self, compression=200):
+        if compression < 2:
+            raise ValueError("The compression must be at least 2")
+
+        self.compression = int(compression)
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.minimum = float("+inf")
+        self.maximum = float("-inf")
+
+    @property
+    def count(self):
+        """ The number of values """
+        return int(round(self.weights.sum()))
+
+    def add(self, values):
+        """ Adds the values to the distribution.
+
+        Returns
+        -------
+        sketch : QuantileSketch
+            This sketch.
+        """
+        values = np.asarray(values, dtype=float).reshape(-1)
+        if len(values) != 0:
+            self.minimum = min(self.minimum, float(values.min()))
+            self.maximum = max(self.maximum, float(values.max()))
+            self._combine(values, np.ones(len(values)))
+        return self
+
+    def merge(self, other):
+        """ Adds the values of another sketch (e.g., from another process).
+
+        Returns
+        -------
+        sketch : QuantileSketch
+            This sketch.
+        """
+        if not isinstance(other, QuantileSketch):
+            raise TypeError("Only a QuantileSketch can be merged with a QuantileSketch")
+
+        if len(other.means) != 0:
+            self.minimum = min(self.minimum, other.minimum)
+            self.maximum = max(self.maximum, other.maximum)
+            self._combine(other.means, other.weights)
+        return self
+
+    def _combine(self, means, weights):
+        means = np.concatenate((self.means, means))
+        weights = np.concatenate((self.weights, weights))
+        order = np.argsort(means, kind="stable")
+        means = means[order]
+        weights = weights[order]
+
+        if len(means) > self.compression:
+            # Each centroid covers at most one unit of the scale function
+            # k(q) = compression/pi * arcsin(2q - 1), which is steeper in the tails
+            cumulativeWeights = np.cumsum(weights)
+            q = (cumulativeWeights - weights / 2) / cumulativeWeights[-1]
+            k = np.floor(self.compression / np.pi * np.arcsin(np.clip(2 * q - 1, -1, 1)))
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(k)) + 1))
+
+            combinedWeights = np.add.reduceat(weights, starts)
+            means = np.add.reduceat(means * weights, starts) / combinedWeights
+            weights = combinedWeights
+
+        self.means = means
+        self.weights = weights
+
+    def quantile(self, q):
+        """ The value below which there is a fraction q of the values.
+
+        Parameters
+        ----------
+        q : float or array of float
+            The fraction, between 0 and 1.
+
+        Returns
+        -------
+        value : float or array of float
+            The quantile, or NaN without values.
+        """
+        if len(self.means) == 0:
+            return np.full(np.shape(q), np.nan)[()]
+
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate(([0], centers, [total]))
+        values = np.concatenate(([self.minimum], self.means, [self.maximum]))
+        return np.interp(np.asarray(q, dtype=float) * total, positions, values)[()]
+
+
+class ValueStatistics:
+    """The count, the moments, the extremes and the quantiles of values
+    (e.g. the heights of rays) added one group at a time.
+
+    Parameters
+    ----------
+    compression : int
+        The compression of the QuantileSketch (default=200).
+    """
+
+    def __init__(self, compression=200):
+        self.count = 0
+        self.mean = float("nan")
+        self._sumOfSquaredDeviations = 0.0
+        self.sketch = QuantileSketch(compression)
+
+    def add(self, values):
+        """ Adds the values.
+
+        Returns
+        -------
+        statistics : ValueStatistics
+            These statistics.
+        """
+        values = np.asarray(values, dtype=float).reshape(-1)
+        if len(values) != 0:
+            mean = float(values.mean())
+            self._combineMoments(len(values), mean, float(np.sum((values - mean) ** 2)))
+            self.sketch.add(values)
+        return self
+
+    def merge(self, other):
+        """ Adds the values of other statistics (e.g., from another process).
+
+        Returns
+        -------
+        statistics : ValueStatistics
+            These statistics.
+        """
+        if other.count != 0:
+            self._combineMoments(other.count, other.mean, other._sumOfSquaredDeviations)
+            self.sketch.merge(other.sketch)
+        return self
+
+    def _combineMoments(self, count, mean, sumOfSquaredDeviations):
+        """ Chan et al.'s update of Welford's algorithm, for a group of values """
+        if self.count == 0:
+            self.count = count
+            self.mean = mean
+            self._sumOfSquaredDeviations = sumOfSquaredDeviations
+            return
+
+        totalCount = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / totalCount
+        self._sumOfSquaredDeviations += sumOfSquaredDeviations + delta ** 2 * self.count * count / totalCount
+        self.count = totalCount
+
+    @property
+    def variance(self):
+        """ The variance of the values (normalized by the count, not count-1) """
+        if self.count == 0:
+            return float("nan")
+        return self._sumOfSquaredDeviations / self.count
+
+    @property
+    def standardDeviation(self):
+        return np.sqrt(self.variance)
+
+    @property
+    def rms(self):
+        """ The root mean square of the values """
+        return np.sqrt(self.variance + self.mean ** 2)
+
+    @property
+    def minimum(self):
+        return self.sketch.minimum if self.count != 0 else float("nan")
+
+    @property
+    def maximum(self):
+        return self.sketch.maximum if self.count != 0 else float("nan")
+
+    def quantile(self, q):
+        """ The value below which there is a fraction q (between 0 and 1) of the
+        values, approximated by the QuantileSketch """
+        return self.sketch.quantile(q)
+
+    def percentile(self, p):
+        """ The value below which there is p percent of the values """
+        return self.quantile(np.asarray(p, dtype=float) / 100)
+
+
+class RayStatistics:
+    """The transmitted fraction and the statistics of the height and of the
+    angle of traced rays, updated one chunk of rays at a time.
+
+    Parameters
+    ----------
+    compression : int
+        The compression of the QuantileSketch of the heights and of the angles
+        (default=200).
+
+    Attributes
+    ----------
+    inputCount : int
+        The number of rays that were traced.
+    y : ValueStatistics
+        The statistics of the height of the transmitted rays.
+    theta : ValueStatistics
+        The statistics of the angle of the transmitted rays.
+
+    Examples
+    --------
+    >>> from raytracing import *
+    >>> path = ImagingPath([Space(d=10), Aperture(diameter=10)])
+    >>> statistics = RayStatistics()
+    >>> for seed in range(4):
+    ...     inputRays = CompactRays(rays=RandomUniformRays(yMax=10, thetaMax=0, maxCount=10000, seed=seed))
+    ...     _ = statistics.fill(path.traceManyThroughNumpy(inputRays), inputCount=len(inputRays))
+    >>> print("{0:.2f}".format(statistics.transmittedFraction))
+    0.50
+    >>> print("{0:.1f} {1:.1f}".format(statistics.y.rms, statistics.y.percentile(95)))
+    2.9 4.5
+
+    The same statistics are obtained with path.traceManyStatistics(inputRays).
+    """
+
+    def __init__(self, compression=200):
+        self.inputCount = 0
+        self.y = ValueStatistics(compression)
+        self.theta = ValueStatistics(compression)
+
+    @property
+    def transmittedCount(self):
+        """ The number of rays that were not blocked """
+        return self.y.count
+
+    @property
+    def blockedCount(self):
+        return self.inputCount - self.transmittedCount
+
+    @property
+    def transmittedFraction(self):
+        """ The fraction of the rays that were not blocked, or NaN without rays """
+        if self.inputCount == 0:
+            return float("nan")
+        return self.transmittedCount / self.inputCount
+
+    def fill(self, outputRays, inputCount=None):
+        """ Adds the rays that are not blocked in outputRays.
+
+        Parameters
+        ----------
+        outputRays : Rays, CompactRays, ColumnarRays or list of Ray
+            The rays at the output, e.g. from traceManyThroughNumpy().
+        inputCount : int, optional
+            The number of rays that were traced to obtain outputRays, for the
+            transmitted fraction. (Default=None, the number of rays in outputRays,
+            blocked or not)
+
+        Returns
+        -------
+        statistics : RayStatistics
+            These statistics.
+        """
+        yValues, thetaValues = _unblockedValues(outputRays, ["y", "theta"])
+        if inputCount is None:
+            inputCount = len(outputRays)
+        if inputCount < len(yValues):
+            raise ValueError("There cannot be fewer input rays ({0}) than transmitted rays ({1})".format(
+                inputCount, len(yValues)))
+
+        self.inputCount += int(inputCount)
+        self.y.add(yValues)
+        self.theta.add(thetaValues)
+        return self
+
+    def merge(self, other):
+        """ Adds the rays of other statistics (e.g., from another process).
+
+        Returns
+        -------
+        statistics : RayStatistics
+            These statistics.
+        """
+        if not isinstance(other, RayStatistics):
+            raise TypeError("Only RayStatistics can be merged with RayStatistics")
+
+        self.inputCount += other.inputCount
+        self.y.merge(other.y)
+        self.theta.merge(other.theta)
+        return self
+
+    def __str__(self):
+        lines = ["Transmitted rays: {0} of {1} ({2:.1%})".format(self.transmittedCount, self.inputCount,
+                                                                 self.transmittedFraction)]
+        for name, values in (("Height", self.y), ("Angle", self.theta)):
+            lines.append("{0:>6}: mean = {1:.4g}, rms = {2:.4g}, std = {3:.4g}, "
+                         "percentiles 5/50/95 = {4:.4g}/{5:.4g}/{6:.4g}".format(
+                             name, values.mean, values.rms, values.standardDeviation,
+                             *values.percentile([5, 50, 95])))
+        return "\n".join(lines)
@@ -1,5 +1,7 @@
 import envtest  # modifies path
 import subprocess
+import numpy as np
+import pickle
 
 from raytracing import *
 inf = float("+inf")
@@ -120,6 +122,14 @@ class TestCompactRays(envtest.RaytracingTestCase):
             self.assertGreaterEqual(ray.theta, 0.1)
             self.assertLessEqual(ray.theta, 0.5)
 
+    def testFillWithRandomUniformSeedSameAsRandomUniformRays(self):
+        rays = CompactRays(maxCount=RandomRays.randomBlockSize + 10)
+        rays.fillWithRandomUniform(yMax=2.0, thetaMax=0.3, seed=7)
+        randomRays = RandomUniformRays(yMax=2.0, thetaMax=0.3, maxCount=len(rays), seed=7)
+        expected = CompactRays(rays=randomRays)
+        self.assertTrue(np.array_equal(rays._rays['y'], expected._rays['y']))
+        self.assertTrue(np.array_equal(rays._rays['theta'], expected._rays['theta']))
+
     def testCompactRayIsBlockedSetter(self):
         rays = CompactRays(maxCount=1)
         ray = rays[0]
@@ -167,6 +177,54 @@ class TestCompactRays(envtest.RaytracingTestCase):
         with self.assertRaises(ValueError):
             CompactRays()
 
+    def testCompactRaysDefaultPrecision(self):
+        rays = CompactRays(maxCount=10)
+        self.assertEqual(rays.precision, "float32")
+        self.assertEqual(rays._rays.dtype, CompactRay.Struct)
+
+    def testCompactRaysFloat64KeepsValuesExactly(self):
+        originals = [Ray(y=0.1, theta=1/3), Ray(y=-2/7, theta=0.2, z=1e-9)]
+        rays = CompactRays(rays=originals, precision="float64")
+        self.assertEqual(rays.precision, "float64")
+        self.assertEqual(rays._rays.dtype, CompactRay.Struct64)
+        for i, original in enumerate(originals):
+            self.assertEqual(rays[i], original)
+
+    def testCompactRaysFloat64SetItem(self):
+        rays = CompactRays(maxCount=2, precision=np.float64)
+        rays[1] = Ray(y=1/3, theta=0.1)
+        self.assertEqual(rays[1].y, 1/3)
+        self.assertEqual(rays[1].theta, 0.1)
+        self.assertEqual(rays[0].y, 0)
+
+    def testCompactRaysFromFloat64BufferKeepsPrecision(self):
+        rays = CompactRays(maxCount=3, precision="float64")
+        self.assertEqual(CompactRays(compactRaysStructuredBuffer=rays._rays).precision, "float64")
+        self.assertEqual(CompactRays(compactRaysStructuredBuffer=bytearray(rays._rays.tobytes()),
+                                     precision="float64").precision, "float64")
+
+    def testCompactRaysCopyKeepsOrConvertsPrecision(self):
+        rays = CompactRays(rays=[Ray(y=1/3)], precision="float64")
+        self.assertEqual(CompactRays(rays=rays).precision, "float64")
+        converted = CompactRays(rays=rays, precision="float32")
+        self.assertEqual(converted.precision, "float32")
+        self.assertAlmostEqual(converted[0].y, 1/3, places=6)
+
+    def testCompactRaysCanBePickled(self):
+        rays = CompactRays(rays=[Ray(y=1/3, theta=0.1), Ray(y=2)], precision="float64")
+        copiedRays = pickle.loads(pickle.dumps(rays))
+        self.assertEqual(copiedRays.precision, "float64")
+        self.assertEqual(list(copiedRays), list(rays))
+        copiedRays[0].y = 5
+        self.assertEqual(copiedRays[0].y, 5)
+        self.assertEqual(rays[0].y, 1/3)
+
+    def testCompactRaysInvalidPrecisionRaises(self):
+        with self.assertRaises(ValueError):
+            CompactRays(maxCount=10, precision="float16")
+        with self.assertRaises(ValueError):
+            CompactRays(maxCount=10, precision="double precision")
+
 
     # def testDefaultCompactRay(self):
     #     ray = CompactRay()
@@ -194,6 +252,145 @@ class TestCompactRays(envtest.RaytracingTestCase):
     #     print(structArray)
 
 
+class TestColumnarRays(envtest.RaytracingTestCase):
+
+    def testEmpty(self):
+        rays = ColumnarRays()
+        self.assertEqual(len(rays), 0)
+        self.assertListEqual(list(rays), [])
+
+    def testFromRays(self):
+        raysList = [Ray(1, 0.1), Ray(2, 0.2, isBlocked=True), Ray(3, 0.3, wavelength=0.5)]
+        rays = ColumnarRays(rays=raysList, precision="float64")
+        self.assertEqual(rays.count, 3)
+        self.assertEqual(rays.precision, "float64")
+        self.assertListEqual(list(rays), raysList)
+        self.assertListEqual(rays.rays, raysList)
+        self.assertIsNone(rays[0].wavelength)
+        self.assertEqual(rays[2].wavelength, 0.5)
+        self.assertListEqual(rays.isBlockedValues.tolist(), [False, True, False])
+
+    def testFromArrays(self):
+        rays = ColumnarRays(y=[1, 2], theta=[0.1, 0.2], z=[5, 5])
+        self.assertEqual(rays.precision, "float32")
+        self.assertEqual(rays[1], Ray(2, 0.2, z=5))
+        self.assertEqual(rays[1].apertureDiameter, float("+Inf"))
+
+    def testFromArraysNeedsYAndTheta(self):
+        with self.assertRaises(ValueError):
+            ColumnarRays(y=[1, 2])
+
+    def testValuesAreViews(self):
+        rays = ColumnarRays(y=[1, 2], theta=[0.1, 0.2])
+        self.assertIsInstance(rays.yValues, np.ndarray)
+        rays.yValues[0] = 10
+        self.assertEqual(rays[0].y, 10)
+        rays[1].theta = 0.5
+        self.assertAlmostEqual(rays.thetaValues[1], 0.5)
+
+    def testSetItem(self):
+        rays = ColumnarRays(y=[1, 2], theta=[0.1, 0.2], precision="float64")
+        rays[0] = Ray(5, 0.5, isBlocked=True)
+        self.assertEqual(rays[0], Ray(5, 0.5, isBlocked=True))
+
+    def testIndexOutOfBounds(self):
+        rays = ColumnarRays(y=[1, 2], theta=[0.1, 0.2])
+        self.assertEqual(rays[-1].y, 2)
+        with self.assertRaises(IndexError):
+            rays[2]
+
+    def testSlice(self):
+        rays = ColumnarRays(y=[1, 2, 3], theta=[0.1, 0.2, 0.3])
+        self.assertListEqual(rays[1:].yValues.tolist(), [2, 3])
+
+    def testAppendGrows(self):
+        rays = ColumnarRays(precision="float64")
+        for i in range(100):
+            rays.append(Ray(i, 0))
+        self.assertEqual(len(rays), 100)
+        self.assertListEqual(rays.yValues.tolist(), list(range(100)))
+        with self.assertRaises(TypeError):
+            rays.append("not a ray")
+
+    def testExtend(self):
+        rays = ColumnarRays(y=[1], theta=[0.1], precision="float64")
+        rays.extend([Ray(2, 0.2, isBlocked=True), Ray(3, 0.3, wavelength=0.5)])
+        self.assertListEqual(list(rays), [Ray(1, 0.1), Ray(2, 0.2, isBlocked=True), Ray(3, 0.3)])
+        self.assertEqual(rays[2].wavelength, 0.5)
+        with self.assertRaises(TypeError):
+            rays.extend(["not a ray"])
+
+    def testExtendFromCompactRays(self):
+        compactRays = CompactRays(rays=[Ray(1, 0.1), Ray(2, 0.2)])
+        rays = ColumnarRays()
+        rays.extend(compactRays)
+        rays.extend(ColumnarRays(rays=compactRays))
+        self.assertListEqual(rays.yValues.tolist(), [1, 2, 1, 2])
+
+    def testReserve(self):
+        rays = ColumnarRays()
+        rays.reserve(1000)
+        self.assertEqual(rays.capacity, 1000)
+        columns = rays._columns['y']
+        rays.extend([Ray(1, 0)] * 1000)
+        self.assertIs(rays._columns['y'], columns)
+        self.assertEqual(len(rays), 1000)
+
+    def testCompactRaysCannotBeExtended(self):
+        rays = CompactRays(maxCount=2)
+        with self.assertRaises(RuntimeError):
+            rays.extend([Ray()])
+
+    def testHistogramOnArrays(self):
+        rays = ColumnarRays(rays=RandomUniformRays(yMax=1, maxCount=1000, seed=1), precision="float64")
+        expected = Rays(rays=rays.rays)
+        self.assertListEqual(rays.rayCountHistogram(binCount=10)[1], expected.rayCountHistogram(binCount=10)[1])
+        self.assertListEqual(rays.rayAnglesHistogram(binCount=10)[1], expected.rayAnglesHistogram(binCount=10)[1])
+
+    def testHistogramAfterAppend(self):
+        rays = ColumnarRays(y=[0, 1], theta=[0, 0])
+        self.assertEqual(sum(rays.rayCountHistogram(binCount=2)[1]), 2)
+        rays.append(Ray(1, 0))
+        self.assertEqual(sum(rays.rayCountHistogram(binCount=2)[1]), 3)
+
+    def testToAndFromCompactRays(self):
+        compactRays = CompactRays(rays=RandomLambertianRays(maxCount=100, seed=1))
+        rays = ColumnarRays(rays=compactRays)
+        self.assertEqual(rays.precision, "float32")
+        self.assertTrue(np.array_equal(rays.yValues, compactRays._rays['y']))
+
+        backToCompact = CompactRays(rays=rays)
+        for field in ColumnarRays.fields:
+            self.assertTrue(np.array_equal(backToCompact._rays[field], compactRays._rays[field], equal_nan=True))
+
+    def testTraceThrough(self):
+        rays = ColumnarRays(rays=UniformRays(yMax=1, thetaMax=0.1, M=5, N=5))
+        path = ImagingPath([Space(d=10), Aperture(diameter=1)])
+        outputRays = ColumnarRays(rays=path.traceManyThroughNumpy(rays))
+        self.assertEqual(len(outputRays), len(path.traceManyThrough(rays, progress=False)))
+
+    def testPickle(self):
+        rays = ColumnarRays(y=[1, 2], theta=[0.1, 0.2])
+        rays.append(Ray(3, 0.3))
+        copy = pickle.loads(pickle.dumps(rays))
+        self.assertListEqual(list(copy), list(rays))
+
+    def testSaveLoad(self):
+        rays = ColumnarRays(rays=[Ray(1, 0.1), Ray(2, 0.2)])
+        filePath = self.tempFilePath("columnar.pkl")
+        rays.save(filePath)
+
+        loadedRays = ColumnarRays(rays=[Ray(5, 0.5)])
+        loadedRays.load(filePath)
+        self.assertListEqual(list(loadedRays), list(rays))
+        loadedRays.load(filePath, append=True)
+        self.assertEqual(len(loadedRays), 4)
+
+        plainRays = Rays()
+        plainRays.load(filePath)
+        self.assertListEqual(plainRays.rays, rays.rays)
+
+
 class TestCompactRaytraces(envtest.RaytracingTestCase):
 
     def testCompactRaytraceInit(self):
@@ -106,5 +106,28 @@ class TestAxicon(envtest.RaytracingTestCase):
         with self.assertRaises(TypeError):
             axicon * matrix
 
+    def testNumpyEngineSameAsNative(self):
+        group = MatrixGroup([Space(10), Axicon(alpha=2, n=1.5, diameter=50), Space(10)])
+        rays = [Ray(1, 0), Ray(-1, 0.1), Ray(0, 0), Ray(30, 0)]
+
+        nativeRays = group.traceManyThrough(rays, progress=False)
+        numpyRays = group.traceManyThroughNumpy(CompactRays(rays=rays, precision="float64"))
+        self.assertEqual(len(numpyRays), len(nativeRays))
+        for numpyRay, nativeRay in zip(numpyRays, nativeRays):
+            self.assertAlmostEqual(numpyRay.y, nativeRay.y)
+            self.assertAlmostEqual(numpyRay.theta, nativeRay.theta)
+        self.assertAlmostEqual(numpyRays[0].y, -9)
+        self.assertAlmostEqual(numpyRays[0].theta, -1)
+
+        nativeTraces = group.traceMany(rays, engine="native")
+        numpyTraces = group.traceMany(CompactRays(rays=rays, precision="float64"), engine="numpy")
+        for numpyTrace, nativeTrace in zip(numpyTraces, nativeTraces):
+            self.assertEqual(len(numpyTrace), len(nativeTrace))
+            self.assertEqual([ray.isBlocked for ray in numpyTrace], [ray.isBlocked for ray in nativeTrace])
+            for numpyRay, nativeRay in zip(numpyTrace, nativeTrace):
+                self.assertAlmostEqual(numpyRay.y, nativeRay.y)
+                self.assertAlmostEqual(numpyRay.theta, nativeRay.theta)
+
+
 if __name__ == '__main__':
     envtest.main()
@@ -17,6 +17,7 @@ with patch('matplotlib.pyplot.show', new=Mock()):
         doctest.testmod(m=raytracing.eo,verbose=False)
         doctest.testmod(m=raytracing.figure,verbose=False)
         doctest.testmod(m=raytracing.gaussianbeam,verbose=False)
+        doctest.testmod(m=raytracing.histograms,verbose=False)
         doctest.testmod(m=raytracing.imagingpath,verbose=False)
         doctest.testmod(m=raytracing.lasercavity,verbose=False)
         doctest.testmod(m=raytracing.laserpath,verbose=False)
@@ -25,5 +26,6 @@ with patch('matplotlib.pyplot.show', new=Mock()):
         doctest.testmod(m=raytracing.matrixgroup,verbose=False)
         doctest.testmod(m=raytracing.ray,verbose=False)
         doctest.testmod(m=raytracing.rays,verbose=False)
+        doctest.testmod(m=raytracing.raystatistics,verbose=False)
         doctest.testmod(m=raytracing.specialtylenses,verbose=False)
         doctest.testmod(m=raytracing.utils,verbose=False)
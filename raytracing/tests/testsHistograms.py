@@ -0,0 +1,145 @@
+import envtest  # modifies path
+import pickle
+from raytracing import *
+
+
+class TestRayHistogram(envtest.RaytracingTestCase):
+
+    def testInit(self):
+        histogram = RayHistogram(minValue=-1, maxValue=1, binCount=10)
+        self.assertEqual(len(histogram.counts), 10)
+        self.assertEqual(histogram.rayCount, 0)
+        self.assertEqual(len(histogram.binEdges), 11)
+        self.assertAlmostEqual(histogram.binCenters[0], -0.9)
+
+    def testInvalidParameters(self):
+        with self.assertRaises(ValueError):
+            RayHistogram(minValue=1, maxValue=-1)
+        with self.assertRaises(ValueError):
+            RayHistogram(minValue=-1, maxValue=1, binCount=0)
+        with self.assertRaises(ValueError):
+            RayHistogram(minValue=-1, maxValue=1, attribute="z")
+
+    def testSameAsRayCountHistogram(self):
+        rays = RandomUniformRays(yMin=-5, yMax=5, maxCount=10000, seed=1)
+        histogram = RayHistogram(minValue=-5, maxValue=5, binCount=20).fill(rays)
+        x, counts = rays.rayCountHistogram(binCount=20, minValue=-5, maxValue=5)
+        self.assertEqual(histogram.histogram()[1], counts)
+        self.assertTrue(np.allclose(histogram.histogram()[0], x))
+        self.assertEqual(histogram.rayCount, 10000)
+
+    def testSameAsRayAnglesHistogram(self):
+        rays = RandomLambertianRays(yMax=5, maxCount=10000, seed=1)
+        histogram = RayHistogram(minValue=-1, maxValue=1, binCount=20, attribute="theta").fill(rays)
+        x, counts = rays.rayAnglesHistogram(binCount=20, minValue=-1, maxValue=1)
+        self.assertEqual(histogram.histogram()[1], counts)
+
+    def testFillInChunksSameAsAllRays(self):
+        rays = list(RandomUniformRays(yMax=10, maxCount=10000, seed=2))
+
+        allRays = RayHistogram(minValue=-5, maxValue=5).fill(CompactRays(rays=rays, precision="float64"))
+        chunks = RayHistogram(minValue=-5, maxValue=5)
+        for start in range(0, 10000, 3000):
+            chunks.fill(rays[start:start + 3000])
+
+        self.assertTrue(np.array_equal(chunks.counts, allRays.counts))
+        self.assertEqual(chunks.overflowCount, allRays.overflowCount)
+        self.assertEqual(chunks.underflowCount, allRays.underflowCount)
+        self.assertEqual(chunks.rayCount, 10000)
+
+    def testOutOfRange(self):
+        histogram = RayHistogram(minValue=0, maxValue=1, binCount=2)
+        histogram.fillValues([-1, -0.5, 0, 0.25, 0.75, 1, 2])
+        self.assertEqual(list(histogram.counts), [2, 2])
+        self.assertEqual(histogram.underflowCount, 2)
+        self.assertEqual(histogram.overflowCount, 1)
+
+    def testBlockedRaysNotCounted(self):
+        rays = [Ray(y=0.1), Ray(y=0.2), Ray(y=0.3)]
+        rays[1].isBlocked = True
+        histogram = RayHistogram(minValue=0, maxValue=1).fill(rays)
+        self.assertEqual(histogram.rayCount, 2)
+
+        compactRays = CompactRays(rays=rays)
+        histogram = RayHistogram(minValue=0, maxValue=1).fill(compactRays)
+        self.assertEqual(histogram.rayCount, 2)
+
+    def testFillWithTracedRays(self):
+        path = MatrixGroup([Space(d=10), Aperture(diameter=10), Space(d=10)])
+        inputRays = RandomUniformRays(yMax=10, thetaMax=0.1, maxCount=5000, seed=3)
+        outputRays = path.traceManyThrough(inputRays, progress=False)
+
+        histogram = RayHistogram(minValue=-10, maxValue=10).fill(outputRays)
+        compactHistogram = RayHistogram(minValue=-10, maxValue=10).fill(
+            path.traceManyThroughNumpy(CompactRays(rays=inputRays, precision="float64")))
+        self.assertEqual(histogram.rayCount, len(outputRays))
+        self.assertTrue(np.array_equal(histogram.counts, compactHistogram.counts))
+
+    def testMerge(self):
+        rays = list(RandomUniformRays(yMax=10, maxCount=1000, seed=4))
+        allRays = RayHistogram(minValue=0, maxValue=5).fill(rays)
+        first = RayHistogram(minValue=0, maxValue=5).fill(rays[:400])
+        second = RayHistogram(minValue=0, maxValue=5).fill(rays[400:])
+
+        self.assertIs(first.merge(second), first)
+        self.assertTrue(np.array_equal(first.counts, allRays.counts))
+        self.assertEqual(first.overflowCount, allRays.overflowCount)
+
+    def testMergeDifferentBins(self):
+        histogram = RayHistogram(minValue=0, maxValue=5)
+        with self.assertRaises(ValueError):
+            histogram.merge(RayHistogram(minValue=0, maxValue=5, binCount=10))
+        with self.assertRaises(ValueError):
+            histogram.merge(RayHistogram(minValue=0, maxValue=5, attribute="theta"))
+        with self.assertRaises(ValueError):
+            histogram.merge(PhaseSpaceHistogram(0, 5, 0, 5))
+
+    def testMergeAfterPickle(self):
+        histogram = RayHistogram(minValue=0, maxValue=5).fill(RandomUniformRays(yMax=5, maxCount=100, seed=5))
+        copied = pickle.loads(pickle.dumps(histogram))
+        histogram.merge(copied)
+        self.assertEqual(histogram.rayCount, 200)
+
+
+class TestPhaseSpaceHistogram(envtest.RaytracingTestCase):
+
+    def testFill(self):
+        rays = RandomLambertianRays(yMax=5, maxCount=2000, seed=1)
+        histogram = PhaseSpaceHistogram(yMin=-5, yMax=5, thetaMin=-2, thetaMax=2, yBinCount=10, thetaBinCount=8)
+        histogram.fill(rays)
+        self.assertEqual(histogram.counts.shape, (10, 8))
+        self.assertEqual(histogram.rayCount, 2000)
+        self.assertEqual(histogram.outOfRangeCount, 0)
+
+        self.assertEqual(list(histogram.counts.sum(axis=1)), histogram.yHistogram.histogram()[1])
+        self.assertEqual(list(histogram.counts.sum(axis=0)), histogram.thetaHistogram.histogram()[1])
+        x, counts = rays.rayCountHistogram(binCount=10, minValue=-5, maxValue=5)
+        self.assertEqual(histogram.yHistogram.histogram()[1], counts)
+
+    def testOutOfRange(self):
+        histogram = PhaseSpaceHistogram(yMin=0, yMax=1, thetaMin=0, thetaMax=1, yBinCount=2, thetaBinCount=2)
+        histogram.fillValues([0.25, 0.25, 2, 0.75], [0.25, 2, 0.25, 0.75])
+        self.assertEqual(histogram.counts.tolist(), [[1, 0], [0, 1]])
+        self.assertEqual(histogram.outOfRangeCount, 2)
+        self.assertEqual(histogram.rayCount, 4)
+        self.assertEqual(histogram.yHistogram.overflowCount, 1)
+        self.assertEqual(histogram.thetaHistogram.overflowCount, 1)
+
+    def testMerge(self):
+        rays = list(RandomLambertianRays(yMax=5, maxCount=1000, seed=2))
+        allRays = PhaseSpaceHistogram(-5, 5, -1, 1).fill(rays)
+        first = PhaseSpaceHistogram(-5, 5, -1, 1).fill(rays[:300])
+        second = PhaseSpaceHistogram(-5, 5, -1, 1).fill(rays[300:])
+
+        first.merge(second)
+        self.assertTrue(np.array_equal(first.counts, allRays.counts))
+        self.assertEqual(first.outOfRangeCount, allRays.outOfRangeCount)
+        self.assertTrue(np.array_equal(first.yHistogram.counts, allRays.yHistogram.counts))
+
+    def testMergeDifferentBins(self):
+        with self.assertRaises(ValueError):
+            PhaseSpaceHistogram(-5, 5, -1, 1).merge(PhaseSpaceHistogram(-5, 5, -1, 2))
+
+
+if __name__ == '__main__':
+    envtest.main()
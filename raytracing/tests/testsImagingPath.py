@@ -353,6 +353,83 @@ class TestImagingPath(envtest.RaytracingTestCase):
         with self.assertRaises(ValueError):
             path.chiefRay()
 
+    def vignettingPath(self):
+        return ImagingPath([Space(d=50), Lens(f=50, diameter=25), Space(d=50), Lens(f=50, diameter=25),
+                            Space(d=50), Aperture(diameter=10)])
+
+    def testCollectionEfficiencyStopsWhenPrecise(self):
+        path = self.vignettingPath()
+        source = RandomUniformRays(yMax=5, yMin=-5, thetaMax=0.5, thetaMin=-0.5, maxCount=10**6, seed=1)
+        result = path.collectionEfficiency(source, tolerance=0.01, batchSize=1000)
+        self.assertTrue(result.isConverged)
+        self.assertLess(result.rayCount, 10**6)
+        self.assertLessEqual(result.efficiency.upper - result.efficiency.lower, 0.02)
+        self.assertLessEqual(result.vignettingLoss.upper - result.vignettingLoss.lower, 0.02)
+        self.assertAlmostEqual(result.efficiency.value, result.transmittedCount / result.rayCount)
+
+        rays = CompactRays(rays=RandomUniformRays(yMax=5, yMin=-5, thetaMax=0.5, thetaMin=-0.5,
+                                                  maxCount=result.rayCount, seed=1))
+        self.assertEqual(result.transmittedCount, len(path.traceManyThroughNumpy(rays)))
+
+    def testCollectionEfficiencyMorePreciseNeedsMoreRays(self):
+        path = self.vignettingPath()
+        source = RandomUniformRays(yMax=5, yMin=-5, thetaMax=0.5, thetaMin=-0.5, maxCount=10**6, seed=2)
+        coarse = path.collectionEfficiency(source, tolerance=0.02)
+        fine = path.collectionEfficiency(source, tolerance=0.005)
+        self.assertLess(coarse.rayCount, fine.rayCount)
+        self.assertLessEqual(fine.efficiency.lower, coarse.efficiency.upper)
+        self.assertGreaterEqual(fine.efficiency.upper, coarse.efficiency.lower)
+
+    def testCollectionEfficiencySourceExhausted(self):
+        path = self.vignettingPath()
+        rays = [Ray(y=y, theta=0.1) for y in np.linspace(-4, 4, 50)]
+        result = path.collectionEfficiency(rays, tolerance=0.001, batchSize=20)
+        self.assertFalse(result.isConverged)
+        self.assertEqual(result.rayCount, 50)
+        self.assertEqual(result.transmittedCount, len(path.traceManyThroughNumpy(rays)))
+
+    def testCollectionEfficiencyVignettingAsInReport(self):
+        path = self.vignettingPath()
+        rays = list(RandomUniformRays(yMax=8, yMin=-8, thetaMax=0.5, thetaMin=-0.5, maxCount=500, seed=3))
+        principal = path.principalRay()
+        axial = path.axialRay()
+        Iap = abs(path.lagrangeInvariant())
+        expected = [abs(path.opticalInvariant(ray, principal)) <= Iap and abs(path.opticalInvariant(axial, ray)) <= Iap
+                    for ray in rays]
+        isBlocked = path.traceManyBlockingNumpy(rays).elementIndex >= 0
+
+        result = path.collectionEfficiency(rays, tolerance=0.001, batchSize=500)
+        self.assertEqual(result.vignettedCount, int(np.count_nonzero(np.array(expected) & isBlocked)))
+        self.assertAlmostEqual(result.vignettingLoss.value, result.vignettedCount / sum(expected))
+
+    def testCollectionEfficiencyNoRayExpectedToBeTransmitted(self):
+        path = self.vignettingPath()
+        source = RandomUniformRays(yMax=300, yMin=200, maxCount=10**6, seed=1)
+        result = path.collectionEfficiency(source, tolerance=0.01)
+        self.assertTrue(result.isConverged)
+        self.assertLess(result.rayCount, 10**6)
+        self.assertIsNone(result.vignettingLoss)
+        self.assertEqual(result.vignettedCount, 0)
+
+    def testCollectionEfficiencyWithoutFieldStop(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=10), Space(d=10)])
+        result = path.collectionEfficiency(RandomUniformRays(yMax=1, maxCount=10000, seed=1), tolerance=0.02)
+        self.assertIsNone(result.vignettingLoss)
+        self.assertTrue(result.isConverged)
+        with self.assertRaises(ValueError):
+            path.collectionEfficiency()
+
+    def testCollectionEfficiencyInvalidArguments(self):
+        path = self.vignettingPath()
+        with self.assertRaises(ValueError):
+            path.collectionEfficiency(tolerance=0)
+        with self.assertRaises(ValueError):
+            path.collectionEfficiency(confidence=1.5)
+        with self.assertRaises(ValueError):
+            path.collectionEfficiency(batchSize=0)
+        with self.assertRaises(ValueError):
+            path.collectionEfficiency([])
+
 
 if __name__ == "__main__":
     envtest.main()
@@ -1,6 +1,7 @@
 import envtest  # modifies path
 import os
 import subprocess
+import itertools
 
 from raytracing import *
 inf = float("+inf")
@@ -351,6 +352,267 @@ class TestMatrix(envtest.RaytracingTestCase):
         for i, ray in enumerate(rays):
             self.assertEqual(result[i][0], ray)
 
+    def testTraceManyNumpyWithList_Rays_And_CompactRays(self):
+        inputRays1 = []
+        for y in [-1, 0, 1]:
+            for t in [-1, -0.5, 0, 0.5, 1.0]:
+                inputRays1.append(Ray(y, t))
+                inputRays1.append(Ray(-y, -t))
+
+        inputRays2 = CompactRays(rays=inputRays1)
+        inputRays3 = Rays(inputRays1)
+
+        group = MatrixGroup()
+        group.append(Space(d=10))
+        group.append(Lens(f=5, diameter=5))
+        group.append(Space(d=10))
+
+        outputRayTraces = group.traceManyNative(inputRays1)
+        for inputRays in [inputRays1, inputRays2, inputRays3]:
+            numpyRayTraces = group.traceManyNumpy(inputRays)
+            self.assertEqual(len(numpyRayTraces), len(outputRayTraces))
+            for nativeTrace, numpyTrace in zip(outputRayTraces, numpyRayTraces):
+                self.assertEqual(len(numpyTrace), 4)
+                self.assertEqual(nativeTrace[0], numpyTrace[0])
+                self.assertEqual(nativeTrace[-1], numpyTrace[-1])
+
+    def testTraceManyNumpyBlockedAtEntranceOfThickElement(self):
+        group = MatrixGroup([Space(d=10, diameter=2), Lens(f=5)])
+        traces = group.traceManyNumpy([Ray(y=2, theta=0), Ray(y=0.5, theta=0)])
+
+        self.assertTrue(traces[0][-1].isBlocked)
+        self.assertEqual(traces[0][-1].z, 0)
+        self.assertFalse(traces[1][-1].isBlocked)
+        self.assertEqual(traces[1][-1].z, 10)
+
+    def testTraceManyNumpyApertureNA(self):
+        m = MatrixGroup([Aperture(diameter=10, NA=0.25)])
+        traces = m.traceManyNumpy([Ray(y=0, theta=0.5), Ray(y=0, theta=0.1)])
+        self.assertTrue(traces[0][-1].isBlocked)
+        self.assertFalse(traces[1][-1].isBlocked)
+
+    def testTraceManyWithNumpyEngine(self):
+        inputRays = UniformRays(M=100, N=10)
+        path = ImagingPath()
+        path.append(Space(d=2))
+        path.append(Lens(f=10, diameter=25))
+        path.append(Space(d=2))
+        path.append(Aperture(diameter=20, NA=0.4))
+        path.append(Space(d=4))
+
+        outputRaytracesNumpy = path.traceMany(inputRays, engine="numpy")
+        outputRaytracesNative = path.traceManyNative(inputRays)
+
+        self.assertTrue(isinstance(outputRaytracesNumpy, CompactRaytraces))
+        for traceNumpy, traceNative in zip(outputRaytracesNumpy, outputRaytracesNative):
+            self.assertEqual(traceNumpy[0], traceNative[0])
+            self.assertEqual(traceNumpy[-1], traceNative[-1])
+
+    def testTraceManyUnknownEngine(self):
+        with self.assertRaises(ValueError):
+            Matrix().traceMany([Ray()], engine="cuda")
+
+    def testTraceManyRecordAtNumpy(self):
+        inputRays = RandomUniformRays(yMax=5, thetaMax=0.2, maxCount=200)
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=8), Space(d=5), Aperture(diameter=6), Space(d=5)])
+
+        allTraces = path.traceMany(inputRays, engine="numpy")
+        traces = path.traceMany(inputRays, engine="numpy", recordAt=[0.0, 3, -1, 12.0])
+
+        self.assertEqual(len(traces), len(inputRays))
+        self.assertEqual(traces.traceLength, 4)
+        for fullTrace, trace in zip(allTraces, traces):
+            self.assertEqual(len(trace), 4)
+            for ray, traceIndex in zip(trace, [0, 4, 5, 2]):
+                self.assertEqual(ray, fullTrace[traceIndex])
+
+    def testTraceManyRecordAtNative(self):
+        inputRays = [Ray(y=1, theta=0.1), Ray(y=5, theta=0), Ray(y=-2, theta=-0.3)]
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=8), Space(d=5), Aperture(diameter=6), Space(d=5)])
+
+        traces = path.traceMany(inputRays, useOpenCL=False, recordAt=[1, 20.0])
+
+        self.assertEqual(len(traces), 3)
+        for inputRay, trace in zip(inputRays, traces):
+            self.assertEqual(len(trace), 2)
+            self.assertEqual(trace[-1], path.traceThrough(inputRay))
+            self.assertEqual(trace[0], path[:2].traceThrough(inputRay))
+
+    def testTraceManyRecordAtInvalidPlanes(self):
+        path = ImagingPath([Space(d=10), Lens(f=10)])
+        with self.assertRaises(ValueError):
+            path.traceMany([Ray()], engine="numpy", recordAt=[2])
+        with self.assertRaises(ValueError):
+            path.traceMany([Ray()], engine="numpy", recordAt=[])
+
+    def testTraceManyThroughNumpyEngine(self):
+        inputRays = RandomUniformRays(yMax=15, thetaMax=0.5, maxCount=1000)
+        path = ImagingPath()
+        path.append(Space(d=2))
+        path.append(Lens(f=10, diameter=25))
+        path.append(Space(d=2))
+        path.append(Aperture(diameter=20, NA=0.4))
+
+        nativeRays = path.traceManyThrough(inputRays, progress=False)
+        numpyRays = path.traceManyThrough(inputRays, engine="numpy")
+
+        self.assertTrue(isinstance(numpyRays, CompactRays))
+        self.assertEqual(len(numpyRays), len(nativeRays))
+        for nativeRay, numpyRay in zip(nativeRays, numpyRays):
+            self.assertEqual(nativeRay, numpyRay)
+
+    def testTraceManyThroughNumpySurvivorCounts(self):
+        inputRays = UniformRays(yMax=4, thetaMax=0.1, M=41, N=11)
+        path = ImagingPath()
+        path.append(Space(d=2))
+        path.append(Aperture(diameter=6.1))
+        path.append(Space(d=2))
+        path.append(Lens(f=10))
+        path.append(Aperture(diameter=3.1))
+        path.append(Space(d=10))
+        path.append(Aperture(diameter=1.1))
+
+        outputRays, survivorCounts = path.traceManyThroughNumpy(inputRays, returnSurvivorCounts=True)
+
+        self.assertEqual(len(survivorCounts), 3)
+        self.assertEqual(survivorCounts[-1], len(outputRays))
+        self.assertTrue(survivorCounts[0] >= survivorCounts[1] >= survivorCounts[2])
+        for i, elementIndex in enumerate([1, 4, 6]):
+            subPath = MatrixGroup(path.elements[:elementIndex + 1])
+            self.assertEqual(survivorCounts[i], len(subPath.traceManyThrough(inputRays, progress=False)))
+
+    def testTraceManyThroughNumpySkipsBlockedInputRays(self):
+        inputRays = [Ray(y=1), Ray(y=2), Ray(y=3)]
+        inputRays[1].isBlocked = True
+
+        outputRays = Space(d=10).traceManyThroughNumpy(inputRays)
+        self.assertEqual(len(outputRays), 2)
+        self.assertAlmostEqual(outputRays[1].y, 3)
+
+    def testTraceManyNumpyKeepsFloat64Precision(self):
+        path = ImagingPath([Space(d=1/3), Lens(f=7, diameter=10), Space(d=1/7), Aperture(diameter=3)])
+        inputRays = UniformRays(yMax=1.4, thetaMax=0.1, M=7, N=5)
+        compactRays = CompactRays(rays=inputRays, precision="float64")
+
+        traces = path.traceManyNumpy(compactRays)
+        self.assertEqual(traces.compactRays.precision, "float64")
+        for inputRay, trace in zip(inputRays, traces):
+            expected = path.trace(inputRay)
+            for expectedRay, ray in zip(expected, trace):
+                self.assertEqual(ray.isBlocked, expectedRay.isBlocked)
+                self.assertAlmostEqual(ray.y, expectedRay.y, places=12)
+                self.assertAlmostEqual(ray.theta, expectedRay.theta, places=12)
+                self.assertAlmostEqual(ray.z, expectedRay.z, places=12)
+
+        outputRays = path.traceManyThroughNumpy(compactRays)
+        self.assertEqual(outputRays.precision, "float64")
+        self.assertEqual(path.traceManyBlockingNumpy(compactRays).z.dtype, np.float64)
+
+    def testTraceManyNumpyDefaultsToFloat32(self):
+        traces = Space(d=1).traceManyNumpy([Ray(y=1/3)])
+        self.assertEqual(traces.compactRays.precision, "float32")
+
+    def testTraceManyWithThreadsSameAsNumpy(self):
+        path = ImagingPath([Space(d=2), Lens(f=10, diameter=5), Space(d=3), Aperture(diameter=3)])
+        inputRays = CompactRays(rays=UniformRays(yMax=4, thetaMax=0.1, M=21, N=11))
+        expected = path.traceMany(inputRays, engine="numpy")
+
+        for workers in [2, 3, 1000]:
+            traces = path.traceMany(inputRays, executor="threads", workers=workers)
+            self.assertTrue(np.array_equal(traces.compactRays._rays['y'], expected.compactRays._rays['y']))
+            self.assertTrue(np.array_equal(traces.compactRays._rays['isBlocked'], expected.compactRays._rays['isBlocked']))
+
+        traces = path.traceMany(list(inputRays), executor="threads", workers=4, recordAt=[0, 3])
+        expected = path.traceMany(inputRays, engine="numpy", recordAt=[0, 3])
+        self.assertTrue(np.array_equal(traces.compactRays._rays['theta'], expected.compactRays._rays['theta']))
+        self.assertTrue(np.array_equal(traces.compactRays._rays['z'], expected.compactRays._rays['z']))
+        self.assertEqual(len(path.traceMany(CompactRays(maxCount=0), executor="threads")), 0)
+
+    def testTraceManyInvalidExecutorRaises(self):
+        with self.assertRaises(ValueError):
+            Space(d=1).traceMany([Ray()], executor="processes")
+        with self.assertRaises(ValueError):
+            Space(d=1).traceMany([Ray()], executor="threads", engine="native")
+
+    def testTraceManyStreamSameAsTraceManyThrough(self):
+        path = ImagingPath([Space(d=2), Lens(f=10, diameter=5), Space(d=3), Aperture(diameter=3)])
+        inputRays = UniformRays(yMax=4, thetaMax=0.1, M=21, N=11)
+        expected = path.traceManyThroughNumpy(inputRays)
+
+        for rays in [inputRays, CompactRays(rays=inputRays)]:
+            chunks = list(path.traceManyStream(rays, chunkSize=50))
+            self.assertEqual(len(chunks), 5)
+            self.assertEqual(sum([len(chunk) for chunk in chunks]), len(expected))
+            outputRays = [ray for chunk in chunks for ray in chunk]
+            for ray, expectedRay in zip(outputRays, expected):
+                self.assertEqual(ray, expectedRay)
+
+        counts = list(path.traceManyStream(inputRays, chunkSize=100, engine="native", reduce=len))
+        self.assertEqual(sum(counts), len(path.traceManyThrough(inputRays, progress=False)))
+
+    def testTraceManyStreamPullsRaysOnlyWhenNeeded(self):
+        def endlessRays():
+            for i in itertools.count():
+                yield Ray(y=(i % 10) / 10)
+
+        stream = Space(d=1).traceManyStream(endlessRays(), chunkSize=1000)
+        self.assertEqual(len(next(stream)), 1000)
+        self.assertEqual(len(next(stream)), 1000)
+
+    def testTraceManyStreamPrecision(self):
+        chunk = next(Space(d=1/3).traceManyStream([Ray(y=1/3, theta=1/7)], precision="float64"))
+        self.assertEqual(chunk.precision, "float64")
+        self.assertEqual(chunk[0].y, 1/3 + 1/21)
+
+    def testTraceManyStreamInvalidArguments(self):
+        with self.assertRaises(ValueError):
+            next(Space(d=1).traceManyStream([Ray()], chunkSize=0))
+        with self.assertRaises(ValueError):
+            next(Space(d=1).traceManyStream([Ray()], engine="opencl"))
+        with self.assertRaises(TypeError):
+            next(Space(d=1).traceManyStream(1))
+
+    def testTraceManyBlockingNumpySameAsTrace(self):
+        inputRays = UniformRays(yMax=4, thetaMax=0.1, M=21, N=11)
+        path = ImagingPath()
+        path.append(Space(d=2))
+        path.append(Aperture(diameter=6.1))
+        path.append(Space(d=2))
+        path.append(Lens(f=10, diameter=5.1))
+        path.append(Space(d=10))
+        path.append(Aperture(diameter=1.1))
+
+        blockedRays = path.traceManyBlockingNumpy(inputRays)
+
+        self.assertEqual(len(blockedRays.elementIndex), len(inputRays))
+        for i, ray in enumerate(inputRays):
+            lastRay = path.trace(ray)[-1]
+            if lastRay.isBlocked:
+                self.assertTrue(blockedRays.elementIndex[i] in [1, 3, 5])
+                self.assertAlmostEqual(blockedRays.z[i], lastRay.z, places=5)
+            else:
+                self.assertEqual(blockedRays.elementIndex[i], -1)
+                self.assertTrue(np.isnan(blockedRays.z[i]))
+
+    def testApertureLosses(self):
+        inputRays = UniformRays(yMax=4, thetaMax=0, M=41, N=1)
+        path = ImagingPath()
+        path.append(Space(d=2))
+        path.append(Aperture(diameter=6.1, label="Iris"))
+        path.append(Space(d=2))
+        path.append(Lens(f=10))
+        path.append(Aperture(diameter=3.1))
+
+        losses = path.apertureLosses(path.traceManyBlockingNumpy(inputRays))
+
+        self.assertEqual([loss.label for loss in losses], ["Iris", "Aperture"])
+        self.assertEqual([loss.elementIndex for loss in losses], [1, 4])
+        self.assertEqual([loss.z for loss in losses], [2, 4])
+        self.assertTrue(losses[0].count > 0)
+        self.assertTrue(losses[1].count > 0)
+        outputRays = path.traceManyThroughNumpy(inputRays)
+        self.assertEqual(sum([loss.count for loss in losses]), len(inputRays) - len(outputRays))
+
     def testTraceManyJustOne(self):
         rays = [Ray()]
         m = Matrix(physicalLength=1e-9)
@@ -711,6 +973,24 @@ f = +inf (afocal)
         m2.fromStruct(theStruct)
         self.assertEqual(m, m2)
 
+    def testToAndFromStructFloat64(self):
+        m = Matrix(1,1/3,0,1, physicalLength=1/3, frontVertex=0.1, backVertex=0.1+1/3, apertureDiameter=2/3)
+        theStruct = m.toStruct(precision="float64")
+        self.assertEqual(theStruct.dtype, Matrix.Struct64)
+        m2 = Matrix(1,0,0,1)
+        m2.fromStruct(theStruct)
+        self.assertEqual(m, m2)
+
+    def testToStructFloat32RoundsValues(self):
+        m = Matrix(1,1/3,0,1, physicalLength=1/3)
+        self.assertEqual(m.toStruct().dtype, Matrix.Struct)
+        self.assertNotEqual(float(m.toStruct()["B"]), 1/3)
+        self.assertAlmostEqual(float(m.toStruct()["B"]), 1/3, places=6)
+
+    def testStructInvalidPrecisionRaises(self):
+        with self.assertRaises(ValueError):
+            Matrix().toStruct(precision="int32")
+
 class TestTrace(envtest.RaytracingTestCase):
     def testTrace(self):
         ray = Ray(y=1, theta=1)
@@ -1160,5 +1440,46 @@ class TestComputationValidation(envtest.RaytracingTestCase):
         self.assertTrue(traces[1][-1].isBlocked)
 
 
+class TestOpenCLRuntime(envtest.RaytracingTestCase):
+    def tearDown(self):
+        setOpenCLDevice()
+        super().tearDown()
+
+    def testSetOpenCLDeviceInvalidTypeRaises(self):
+        with self.assertRaises(ValueError):
+            setOpenCLDevice("tpu")
+        with self.assertRaises(ValueError):
+            OpenCLRuntime.availableDevices(deviceType="tpu")
+
+    @envtest.skipIf(hasOpenCL, "pyopencl is installed")
+    def testOpenCLRuntimeWithoutPyOpenCL(self):
+        self.assertEqual(OpenCLRuntime.availableDevices(), [])
+        with self.assertRaises(RuntimeError):
+            openCLRuntime()
+        with self.assertRaises(RuntimeError):
+            Space(d=1).traceManyOpenCL(CompactRays(maxCount=1))
+
+    @envtest.skipIf(not hasOpenCL, "pyopencl not installed")
+    def testOpenCLRuntimeIsReused(self):
+        if not OpenCLRuntime.availableDevices():
+            self.skipTest("No OpenCL device")
+        group = MatrixGroup([Space(d=5), Lens(f=10, diameter=25), Space(d=5)])
+        group.traceManyOpenCL(CompactRays(rays=UniformRays(M=10, N=5)))
+        runtime = openCLRuntime()
+        kernels = len(runtime._kernels)
+        group.traceManyOpenCL(CompactRays(rays=UniformRays(M=20, N=5)))
+        self.assertIs(openCLRuntime(), runtime)
+        self.assertEqual(len(runtime._kernels), kernels)
+
+    @envtest.skipIf(not hasOpenCL, "pyopencl not installed")
+    def testOpenCLOnCPUDevice(self):
+        if not OpenCLRuntime.availableDevices("cpu"):
+            self.skipTest("No OpenCL CPU device")
+        setOpenCLDevice("cpu")
+        originals = [Ray(y=1.0, theta=0.2), Ray(y=-1.0, theta=-0.1)]
+        traces = MatrixGroup([Space(d=7)]).traceManyOpenCL(CompactRays(rays=originals))
+        for i, ray in enumerate(originals):
+            self.assertAlmostEqual(traces[i][-1].y, ray.y + ray.theta * 7, places=3)
+
 if __name__ == '__main__':
     envtest.main()
@@ -1,4 +1,6 @@
 import envtest  # modifies path
+import threading
+import json
 
 from raytracing import *
 
@@ -203,6 +205,43 @@ class TestMatrixGroup(envtest.RaytracingTestCase):
         self.assertEqual(mg._lastRayToBeTraced, ray)
         self.assertListEqual(mg._lastRayTrace, trace)
 
+    def testLastTraceIsKeptPerThread(self):
+        mg = MatrixGroup([Space(d=2), Lens(f=6, diameter=5)])
+        ray = Ray(1, 0.1)
+        mg.trace(ray)
+
+        otherThreadRays = []
+        thread = threading.Thread(target=lambda: otherThreadRays.append(mg._lastRayToBeTraced))
+        thread.start()
+        thread.join()
+        self.assertEqual(otherThreadRays, [None])
+        self.assertEqual(mg._lastRayToBeTraced, ray)
+
+    def testTraceFromManyThreads(self):
+        mg = MatrixGroup([Space(d=2), Lens(f=6, diameter=5), Space(d=6)])
+        rays = [Ray(y / 10, theta / 100) for y in range(-30, 30) for theta in range(-5, 5)]
+        expected = [mg.trace(ray)[-1] for ray in rays]
+
+        errors = []
+
+        def traceAll(threadRays, threadExpected):
+            for _ in range(5):
+                for ray, expectedRay in zip(threadRays, threadExpected):
+                    if mg.trace(ray)[-1] != expectedRay:
+                        errors.append(ray)
+
+        threads = [threading.Thread(target=traceAll, args=(rays[i::4], expected[i::4])) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def testNestedIterationOverElements(self):
+        mg = MatrixGroup([Space(d=2), Lens(f=6), Space(d=6)])
+        pairs = [(a, b) for a in mg for b in mg]
+        self.assertEqual(len(pairs), 9)
+
     def testTrace(self):
         s = Space(2, diameter=5)
         l = Lens(6, diameter=5)
@@ -523,6 +562,226 @@ class TestMatrixGroup(envtest.RaytracingTestCase):
         structArray = np.array([ m.toStruct() for m in mg ], dtype=Matrix.Struct)
         print(structArray)
 
+    def testSweepApertureDiameter(self):
+        rays = UniformRays(yMax=0.5, thetaMax=0.05, M=11, N=11)
+        diameters = [0.45, 0.85, 2]
+        path = ImagingPath([Space(d=10), Lens(f=10), Space(d=10), Aperture(diameter=1)])
+
+        transmission = path.sweep(3, "apertureDiameter", diameters, rays)
+
+        self.assertEqual(len(transmission), len(diameters))
+        for diameter, value in zip(diameters, transmission):
+            variant = ImagingPath([Space(d=10), Lens(f=10), Space(d=10), Aperture(diameter=diameter)])
+            outputRays = variant.traceManyThrough(rays, progress=False)
+            self.assertAlmostEqual(value, outputRays.count / rays.count)
+
+    def testSweepSpaceLength(self):
+        rays = UniformRays(yMax=0.5, thetaMax=0.05, M=11, N=11)
+        distances = [5, 10, 15]
+        path = ImagingPath([Space(d=10), Lens(f=10), Space(d=10), Aperture(diameter=0.93)])
+
+        transmission = path.sweep(-2, "d", distances, rays)
+
+        for d, value in zip(distances, transmission):
+            variant = ImagingPath([Space(d=10), Lens(f=10), Space(d=d), Aperture(diameter=0.93)])
+            outputRays = variant.traceManyThrough(rays, progress=False)
+            self.assertAlmostEqual(value, outputRays.count / rays.count)
+
+    def testSweepInvalidAttribute(self):
+        path = ImagingPath([Space(d=10), Lens(f=10), Space(d=10)])
+        with self.assertRaises(ValueError):
+            path.sweep(1, "d", [1, 2], [Ray()])
+        with self.assertRaises(ValueError):
+            path.sweep(1, "f", [1, 2], [Ray()])
+
+    def testSweepGroupElementNotAllowed(self):
+        path = ImagingPath([Space(d=10), System4f(f1=10, f2=10)])
+        with self.assertRaises(ValueError):
+            path.sweep(1, "L", [1, 2], [Ray()])
+
+    def testSweepWithAxiconNotAllowed(self):
+        path = MatrixGroup([Space(d=10), Axicon(alpha=2, n=1.5), Space(d=10), Aperture(diameter=1)])
+        with self.assertRaises(ValueError):
+            path.sweep(3, "apertureDiameter", [1, 2], [Ray()])
+
+    def assertMatrixAlmostEqual(self, matrix, expected):
+        for attribute in ["A", "B", "C", "D", "L"]:
+            self.assertAlmostEqual(getattr(matrix, attribute), getattr(expected, attribute))
+
+    def testTransferMatrixUpToAllPositions(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(5), ThickLens(n=1.5, R1=10, R2=-10, thickness=4),
+                          Space(3), Lens(20), Space(20)])
+        for upTo in [0, 2.5, 10, 12, 15, 17, 19, 20, 21.5, 30, 42, 100]:
+            distance = upTo
+            expected = Matrix(A=1, B=0, C=0, D=1)
+            for element in mg.elements:
+                if element.L <= distance:
+                    expected = element * expected
+                    distance -= element.L
+                else:
+                    expected = element.transferMatrix(upTo=distance) * expected
+                    break
+            self.assertMatrixAlmostEqual(mg.transferMatrix(upTo=upTo), expected)
+
+    def testTransferMatrixReturnsCopy(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10)])
+        mg.transferMatrix().A = 100
+        self.assertAlmostEqual(mg.transferMatrix().A, 0)
+
+    def testInsertAndPopUpdateTransferMatrix(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10)])
+        mg.insert(1, Space(5))
+        self.assertMatrixAlmostEqual(mg, MatrixGroup([Space(10), Space(5), Lens(10), Space(10)]))
+        self.assertMatrixAlmostEqual(mg.transferMatrix(upTo=14), Space(14))
+        mg.pop(-1)
+        self.assertMatrixAlmostEqual(mg, MatrixGroup([Space(15), Lens(10)]))
+        mg[0] = Space(1)
+        self.assertMatrixAlmostEqual(mg, MatrixGroup([Space(6), Lens(10)]))
+
+    def testInsertFixesIndexOfFollowingSpace(self):
+        mg = MatrixGroup([Space(10), Space(10)])
+        mg.insert(1, DielectricInterface(n1=1, n2=1.5, R=10))
+        self.assertEqual(mg.elements[2].frontIndex, 1.5)
+        self.assertEqual(mg.backIndex, 1.5)
+
+    def testPopLastElementGivesIdentity(self):
+        mg = MatrixGroup([Lens(10)])
+        mg.pop(0)
+        self.assertMatrixAlmostEqual(mg, Matrix(A=1, B=0, C=0, D=1))
+
+    def testTransferMatrixAfterElementsModifiedDirectly(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(10)])
+        mg.elements.append(Space(10))
+        self.assertMatrixAlmostEqual(mg.transferMatrix(), MatrixGroup([Space(10), Lens(10), Space(20)]))
+        mg.elements[1] = Lens(20)
+        self.assertMatrixAlmostEqual(mg.transferMatrix(), MatrixGroup([Space(10), Lens(20), Space(20)]))
+        mg.elements = [Space(5)]
+        self.assertMatrixAlmostEqual(mg.transferMatrix(), Space(5))
+
+    def testTransferMatrixAfterElementModifiedInPlace(self):
+        space = Space(10)
+        mg = MatrixGroup([Space(10), Lens(10), space])
+        self.assertMatrixAlmostEqual(mg.transferMatrix(upTo=25), MatrixGroup([Space(10), Lens(10), Space(10)]))
+        space.B = 20
+        space.L = 20
+        self.assertMatrixAlmostEqual(mg.transferMatrix(upTo=25), MatrixGroup([Space(10), Lens(10), Space(15)]))
+        self.assertMatrixAlmostEqual(mg.transferMatrix(), MatrixGroup([Space(10), Lens(10), Space(20)]))
+
+    def testTransferMatrixChecksElementsUpToDistance(self):
+        firstSpace = Space(10)
+        lastSpace = Space(10)
+        mg = MatrixGroup([firstSpace, Lens(10), lastSpace])
+        self.assertMatrixAlmostEqual(mg.transferMatrix(), MatrixGroup([Space(10), Lens(10), Space(10)]))
+        lastSpace.B = 20
+        lastSpace.L = 20
+        self.assertMatrixAlmostEqual(mg.transferMatrix(upTo=5), Space(5))
+        self.assertEqual(mg._cumulativeLengths[-1], 20)  # The last space is checked later
+        firstSpace.B = 5
+        firstSpace.L = 5
+        self.assertMatrixAlmostEqual(mg.transferMatrix(upTo=4), Space(4))
+        self.assertMatrixAlmostEqual(mg.transferMatrix(upTo=15), MatrixGroup([Space(5), Lens(10), Space(10)]))
+        self.assertMatrixAlmostEqual(mg.transferMatrix(), MatrixGroup([Space(5), Lens(10), Space(20)]))
+
+    def testTransferMatrixAfterNestedGroupModified(self):
+        group = MatrixGroup([Space(10), Lens(10)])
+        mg = MatrixGroup([group, Space(10)])
+        self.assertMatrixAlmostEqual(mg.transferMatrix(), MatrixGroup([Space(10), Lens(10), Space(10)]))
+        group.append(Space(5))
+        self.assertMatrixAlmostEqual(mg.transferMatrix(), MatrixGroup([Space(10), Lens(10), Space(15)]))
+
+    def testCompileFusesElementsWithoutApertures(self):
+        path = ImagingPath([Space(d=10), Lens(f=10), Space(d=10), Aperture(diameter=5),
+                            Space(d=10), Lens(f=10, diameter=20), Space(d=10), Space(d=5)])
+        plan = path.compile()
+        self.assertEqual(len(plan), 5)
+        self.assertEqual(len(plan.checkpoints), 2)
+        self.assertEqual(plan.elementIndices, (2, 3, 4, 5, 7))
+        self.assertIs(plan.steps[1], path.elements[3])
+        self.assertAlmostEqual(plan.steps[0].L, 20)
+        self.assertAlmostEqual(plan.steps[0].B, 10)
+
+    def testCompileGroupWithoutApertures(self):
+        plan = MatrixGroup([Space(d=10), Lens(f=10), Space(d=10)]).compile()
+        self.assertEqual(len(plan), 1)
+        self.assertEqual(len(plan.checkpoints), 0)
+
+    def testCompileEmptyGroup(self):
+        ray = Ray(y=1, theta=0.1)
+        plan = MatrixGroup().compile()
+        self.assertEqual(len(plan), 0)
+        self.assertIs(plan.traceThrough(ray), ray)
+
+    def testCompileKeepsPlanUntilElementsChange(self):
+        lens = Lens(f=10)
+        path = ImagingPath([Space(d=10), lens, Space(d=10)])
+        plan = path.compile()
+        self.assertIs(path.compile(), plan)
+        lens.apertureDiameter = 2
+        self.assertIsNot(path.compile(), plan)
+        self.assertEqual(len(path.compile().checkpoints), 1)
+
+    def testTraceThroughKeepsPlanForEachRay(self):
+        path = ImagingPath([Space(d=10), Lens(f=10), Space(d=10), Aperture(diameter=2)])
+        plan = path.compile()
+        self.assertTrue(path.traceThrough(Ray(y=0.5, theta=0.1)).isNotBlocked)
+        self.assertIs(path.compile(), plan)
+
+    def testTraceThroughCompilesAgainWhenElementsChange(self):
+        path = MatrixGroup([Space(d=10), Lens(f=20)])
+        self.assertTrue(path.traceThrough(Ray(y=1)).isNotBlocked)
+        path.append(Aperture(diameter=1))
+        self.assertTrue(path.traceThrough(Ray(y=1)).isBlocked)
+        path.pop(-1)
+        self.assertTrue(path.traceThrough(Ray(y=1)).isNotBlocked)
+        path.elements.append(Aperture(diameter=1))
+        self.assertTrue(path.traceThrough(Ray(y=1)).isBlocked)
+
+    def testTraceThroughAfterElementModifiedInPlace(self):
+        path = ImagingPath([Space(d=10), Lens(f=10), Space(d=10)])
+        self.assertAlmostEqual(path.traceThrough(Ray(1, 0)).y, 0)
+        path.elements[2].B = 30
+        path.elements[2].L = 30
+        outputRay = path.traceThrough(Ray(1, 0))
+        expected = path.trace(Ray(1, 0))[-1]
+        self.assertAlmostEqual(outputRay.y, -2)
+        self.assertAlmostEqual(outputRay.y, expected.y)
+        self.assertAlmostEqual(outputRay.z, expected.z)
+
+        path.elements[1].apertureDiameter = 1
+        self.assertTrue(path.traceThrough(Ray(1, 0)).isBlocked)
+
+    def testTraceThroughAfterElementOfNestedGroupModifiedInPlace(self):
+        lens = Lens(f=10)
+        path = MatrixGroup([Space(d=10), MatrixGroup([lens, Space(d=10)])])
+        self.assertTrue(path.traceThrough(Ray(y=1)).isNotBlocked)
+        lens.apertureDiameter = 1
+        self.assertTrue(path.traceThrough(Ray(y=1)).isBlocked)
+
+    def testCompiledTraceThroughSameAsTrace(self):
+        path = ImagingPath([Space(d=10), Lens(f=10), Space(d=5), Aperture(diameter=3), Space(d=5),
+                            Lens(f=20, diameter=10), Space(d=20), Space(d=2), Aperture(diameter=4)])
+        rays = UniformRays(yMax=2, thetaMax=0.2, M=9, N=9)
+        for ray in rays:
+            expected = path.trace(ray)[-1]
+            outputRay = path.traceThrough(ray)
+            self.assertEqual(outputRay.isBlocked, expected.isBlocked)
+            self.assertAlmostEqual(outputRay.y, expected.y)
+            self.assertAlmostEqual(outputRay.theta, expected.theta)
+            self.assertAlmostEqual(outputRay.z, expected.z)
+
+    def testCompiledTraceManyThroughSameAsTrace(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=8), Space(d=10), Space(d=10), Aperture(diameter=3)])
+        rays = UniformRays(yMax=4, thetaMax=0.2, M=7, N=7)
+        expected = [path.trace(ray)[-1] for ray in rays]
+        outputRays = path.traceManyThrough(rays, progress=False)
+        self.assertEqual(len(outputRays), len([ray for ray in expected if ray.isNotBlocked]))
+
+    def testFlipOrientationUpdatesTransferMatrix(self):
+        mg = MatrixGroup([Space(10), Lens(10), Space(5)])
+        mg.flipOrientation()
+        self.assertMatrixAlmostEqual(mg.transferMatrix(upTo=4), Space(4))
+        self.assertMatrixAlmostEqual(mg, MatrixGroup([Space(5), Lens(10), Space(10)]))
+
 
 class TestSaveAndLoadMatrixGroup(envtest.RaytracingTestCase):
 
@@ -558,6 +817,10 @@ class TestSaveAndLoadMatrixGroup(envtest.RaytracingTestCase):
             self.assertEqual(loadMatrixGroup.elements[i].frontVertex, tempList[i].frontVertex)
             self.assertEqual(loadMatrixGroup.elements[i].backVertex, tempList[i].backVertex)
 
+    def assertSameTransferMatrix(self, matrix, expected):
+        for attribute in ["A", "B", "C", "D", "L"]:
+            self.assertEqual(getattr(matrix, attribute), getattr(expected, attribute))
+
     def testSaveEmpty(self):
         fname = self.tempFilePath("emptyMG.pkl")
         mg = MatrixGroup()
@@ -649,6 +912,108 @@ class TestSaveAndLoadMatrixGroup(envtest.RaytracingTestCase):
         self.assertLoadNotFailed(mg2, fname)
         self.assertLoadEqualsMatrixGroup(mg2, mg1)
 
+    def testSaveThenLoadJSON(self):
+        fname = self.tempFilePath("saveThenLoad.json")
+        mg1 = MatrixGroup([Space(10), Lens(10, 100), Space(10), Aperture(50), ThickLens(1.5, 10, -10, 3)])
+        mg1.save(fname, format="json")
+        mg2 = MatrixGroup()
+        mg2.load(fname)
+        self.assertEqual(mg2.elements, mg1.elements)
+        self.assertSameTransferMatrix(mg2, mg1)
+        self.assertEqual(mg2.L, mg1.L)
+
+    def testSaveThenLoadJSONAppend(self):
+        fname = self.tempFilePath("append.json")
+        self.testMG.save(fname, format="json")
+        mg = MatrixGroup([Lens(10), Space(10)])
+        supposedMatrixGroup = MatrixGroup(mg.elements + self.testMG.elements)
+        mg.load(fname, append=True)
+        self.assertLoadEqualsMatrixGroup(mg, supposedMatrixGroup)
+        self.assertSameTransferMatrix(mg, supposedMatrixGroup)
+
+    def testSaveThenLoadJSONLensesAndImagingPath(self):
+        fname = self.tempFilePath("imagingPath.json")
+        path = ImagingPath([Space(d=50), thorlabs.AC254_050_A(), Space(d=50)])
+        mg1 = MatrixGroup([path, Aperture(diameter=10)])
+        mg1.save(fname, format="json")
+        mg2 = MatrixGroup()
+        mg2.load(fname)
+        self.assertIsInstance(mg2[0], ImagingPath)
+        self.assertIsNotNone(mg2[0].figure)
+        self.assertEqual(mg2[0].elements, path.elements)
+        self.assertIs(mg2[0][1].mat1, path[1].mat1)
+        self.assertSameTransferMatrix(mg2, mg1)
+        self.assertEqual(mg2.contentHash(), mg1.contentHash())
+
+    def testSaveUnknownFormat(self):
+        with self.assertRaises(ValueError):
+            self.testMG.save(self.tempFilePath("testMG.xml"), format="xml")
+
+    def testLoadJSONWrongVersion(self):
+        fname = self.tempFilePath("wrongVersion.json")
+        self.testMG.save(fname, format="json")
+        with open(fname) as file:
+            document = json.load(file)
+        document["version"] = 1000
+        with open(fname, "w") as file:
+            json.dump(document, file)
+
+        with self.assertRaises(IOError):
+            MatrixGroup().load(fname)
+
+    def testLoadJSONNotAMatrix(self):
+        fname = self.tempFilePath("notAMatrix.json")
+        with open(fname, "w") as file:
+            json.dump({"format": MatrixGroup.pathFormat, "version": MatrixGroup.pathFormatVersion,
+                       "elements": [{"type": "raytracing.ray:Ray", "state": {}}]}, file)
+
+        with self.assertRaises(IOError):
+            MatrixGroup().load(fname)
+
+    def testSaveJSONIsStrict(self):
+        fname = self.tempFilePath("strict.json")
+        mg1 = MatrixGroup([Space(10), Lens(10), Aperture(diameter=float("+inf"))])
+        mg1.elements[1].apertureNA = float("nan")
+        mg1.save(fname, format="json")
+
+        def rejectConstant(name):
+            raise ValueError(f"{name} is not valid JSON")
+
+        with open(fname) as file:
+            document = json.load(file, parse_constant=rejectConstant)
+        self.assertEqual(document["elements"][0]["state"]["apertureDiameter"], {"float": "inf"})
+
+        mg2 = MatrixGroup()
+        mg2.load(fname)
+        self.assertEqual(mg2[0].apertureDiameter, float("+inf"))
+        self.assertTrue(math.isnan(mg2[1].apertureNA))
+        self.assertSameTransferMatrix(mg2, mg1)
+
+    def testLoadJSONOnlyClassesOfThePackage(self):
+        fname = self.tempFilePath("otherPackage.json")
+        for typeName in ["subprocess:Popen", "raytracing.matrix:np.ndarray", "collections:OrderedDict"]:
+            with open(fname, "w") as file:
+                json.dump({"format": MatrixGroup.pathFormat, "version": MatrixGroup.pathFormatVersion,
+                           "elements": [{"type": typeName, "state": {}}]}, file)
+            with self.assertRaises(IOError):
+                MatrixGroup().load(fname)
+
+        with open(fname, "w") as file:
+            json.dump({"format": MatrixGroup.pathFormat, "version": MatrixGroup.pathFormatVersion,
+                       "elements": [{"type": "raytracing.matrix:Space",
+                                     "state": {"material": {"class": "subprocess:Popen"}}}]}, file)
+        with self.assertRaises(IOError):
+            MatrixGroup().load(fname)
+
+    def testContentHash(self):
+        mg1 = MatrixGroup([Space(10), Lens(10), Space(10)], label="first")
+        mg2 = MatrixGroup([Space(10), Lens(10), Space(10)], label="second")
+        self.assertEqual(mg1.contentHash(), mg2.contentHash())
+        self.assertEqual(mg1.contentHash(), self.testMG.contentHash())
+
+        mg2[1] = Lens(11)
+        self.assertNotEqual(mg1.contentHash(), mg2.contentHash())
+
 
 if __name__ == '__main__':
     envtest.main()
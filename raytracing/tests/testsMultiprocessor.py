@@ -1,6 +1,7 @@
 import envtest  # modifies path
 from raytracing import *
 import itertools
+import numpy as np
 import matplotlib.pyplot as plt
 
 inf = float("+inf")
@@ -107,5 +108,114 @@ class TestSingleAndMultiProcessorCalculation(envtest.RaytracingTestCase):
         axis.legend()
         plt.show()
 
+class TestParallelBackends(envtest.RaytracingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = ImagingPath([Space(d=10), Lens(f=10, diameter=5), Space(d=10), Aperture(diameter=3)])
+
+    def assertSameRays(self, rays, expectedRays):
+        self.assertEqual(len(rays), len(expectedRays))
+        for ray, expectedRay in zip(rays, expectedRays):
+            self.assertAlmostEqual(ray.y, expectedRay.y, places=5)
+            self.assertAlmostEqual(ray.theta, expectedRay.theta, places=5)
+            self.assertAlmostEqual(ray.z, expectedRay.z, places=5)
+
+    def testPickleBackendKeepsInputOrder(self):
+        inputRays = list(UniformRays(yMax=4, thetaMax=0.3, M=20, N=20))
+        outputRays = self.path.traceManyThroughInParallel(inputRays, progress=False, processes=3)
+        self.assertSameRays(outputRays, self.path.traceManyThrough(inputRays, progress=False))
+
+    def testSharedMemoryBackendKeepsInputOrder(self):
+        inputRays = CompactRays(rays=UniformRays(yMax=4, thetaMax=0.3, M=20, N=20))
+        outputRays = self.path.traceManyThroughInParallel(inputRays, processes=3)
+        self.assertIsInstance(outputRays, CompactRays)
+        self.assertSameRays(outputRays, self.path.traceManyThroughNumpy(inputRays))
+
+    def testSharedMemoryBackendWithRaysAndPrecision(self):
+        inputRays = UniformRays(yMax=4, thetaMax=0.3, M=7, N=3)
+        outputRays = self.path.traceManyThroughInParallel(inputRays, processes=2, backend="sharedMemory")
+        self.assertSameRays(outputRays, self.path.traceManyThrough(inputRays, progress=False))
+
+        inputRays = CompactRays(rays=inputRays, precision="float64")
+        self.assertEqual(self.path.traceManyThroughInParallel(inputRays, processes=2).precision, "float64")
+
+    def testSharedMemoryBackendMoreProcessesThanRays(self):
+        inputRays = CompactRays(rays=[Ray(y=0), Ray(y=10)])
+        outputRays = self.path.traceManyThroughInParallel(inputRays, processes=4)
+        self.assertEqual(len(outputRays), 1)
+        self.assertEqual(len(self.path.traceManyThroughInParallel(CompactRays(maxCount=0), processes=2)), 0)
+
+    def testUnknownBackendRaises(self):
+        with self.assertRaises(ValueError):
+            self.path.traceManyThroughInParallel([Ray()], backend="mpi")
+
+class TestTracingExecutor(envtest.RaytracingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = ImagingPath([Space(d=10), Lens(f=10, diameter=5), Space(d=10), Aperture(diameter=3)])
+        self.inputRays = CompactRays(rays=UniformRays(yMax=4, thetaMax=0.3, M=30, N=20))
+
+    def testSubmit(self):
+        with TracingExecutor(processes=2) as executor:
+            future = executor.submit(self.path, self.inputRays)
+            outputRays = future.result()
+        self.assertIsInstance(outputRays, CompactRays)
+        self.assertTrue(np.array_equal(outputRays._rays['y'], self.path.traceManyThroughNumpy(self.inputRays)._rays['y']))
+
+    def testMapKeepsOrder(self):
+        paths = [ImagingPath([Space(d=10), Aperture(diameter=diameter)]) for diameter in [1, 8, 2, 4]]
+        with TracingExecutor(processes=2) as executor:
+            outputRays = list(executor.map(paths, [self.inputRays] * len(paths)))
+        self.assertEqual([len(rays) for rays in outputRays],
+                         [len(path.traceManyThroughNumpy(self.inputRays)) for path in paths])
+
+    def testTraceManyThroughInChunksKeepsOrder(self):
+        expected = self.path.traceManyThroughNumpy(self.inputRays)
+        with TracingExecutor(processes=2, chunkSize=7) as executor:
+            outputRays = executor.traceManyThrough(self.path, self.inputRays)
+            self.assertTrue(np.array_equal(outputRays._rays['y'], expected._rays['y']))
+            outputRays = executor.traceManyThrough(self.path, list(UniformRays(M=5, N=5)), chunkSize=3)
+            self.assertEqual(len(outputRays), len(self.path.traceManyThroughNumpy(UniformRays(M=5, N=5))))
+            self.assertEqual(len(executor.traceManyThrough(self.path, [])), 0)
+
+    def testTraceManyStatisticsMergesChunks(self):
+        expected = self.path.traceManyStatistics(self.inputRays)
+        with TracingExecutor(processes=2, chunkSize=7) as executor:
+            statistics = executor.traceManyStatistics(self.path, self.inputRays)
+        self.assertEqual(statistics.inputCount, len(self.inputRays))
+        self.assertEqual(statistics.transmittedCount, expected.transmittedCount)
+        self.assertAlmostEqual(statistics.y.mean, expected.y.mean)
+        self.assertAlmostEqual(statistics.theta.variance, expected.theta.variance)
+
+    def testPathIsSharedOncePerContent(self):
+        samePath = ImagingPath([Space(d=10), Lens(f=10, diameter=5), Space(d=10), Aperture(diameter=3)])
+        self.assertEqual(TracingExecutor.pathKey(self.path), TracingExecutor.pathKey(samePath))
+        self.assertNotEqual(TracingExecutor.pathKey(self.path), TracingExecutor.pathKey(Space(d=1)))
+
+        with TracingExecutor(processes=2) as executor:
+            executor.traceManyThrough(self.path, self.inputRays)
+            executor.submit(samePath, self.inputRays).result()
+            self.assertEqual(len(executor._pathBlocks), 1)
+            executor.submit(Space(d=1), self.inputRays).result()
+            self.assertEqual(len(executor._pathBlocks), 2)
+        self.assertEqual(len(executor._pathBlocks), 0)
+
+    def testPathKeyDependsOnClassOfGroup(self):
+        elements = [Space(d=10), Lens(f=10, diameter=5)]
+        self.assertNotEqual(TracingExecutor.pathKey(ImagingPath(elements)),
+                            TracingExecutor.pathKey(MatrixGroup(elements)))
+
+    def testShutdownExecutorRaises(self):
+        executor = TracingExecutor(processes=1)
+        executor.shutdown()
+        with self.assertRaises(RuntimeError):
+            executor.submit(self.path, self.inputRays)
+
+    def testInvalidArgumentsRaise(self):
+        with self.assertRaises(ValueError):
+            TracingExecutor(processes=0)
+        with self.assertRaises(ValueError):
+            TracingExecutor(processes=1, chunkSize=0)
+
 if __name__ == '__main__':
     envtest.main()
@@ -44,6 +44,10 @@ class TestRay(envtest.RaytracingTestCase):
         self.assertEqual(min(map(lambda r: r.y, fanGroup)), 0)
         self.assertEqual(max(map(lambda r: r.y, fanGroup)), 1)
 
+    def testFanGroupOrder(self):
+        fanGroup = Ray.fanGroup(yMin=0, yMax=1, M=2, radianMin=-0.1, radianMax=0.1, N=3)
+        self.assertListEqual(fanGroup, [Ray(0, -0.1), Ray(0, 0), Ray(0, 0.1), Ray(1, -0.1), Ray(1, 0), Ray(1, 0.1)])
+
     def testUnitFanGroup(self):
         fanGroup = Ray.fanGroup(yMin=0, yMax=1, M=1, radianMin=-0.1, radianMax=0.1, N=1)
         self.assertIsNotNone(fanGroup)
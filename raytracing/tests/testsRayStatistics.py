@@ -0,0 +1,153 @@
+import envtest  # modifies path
+import pickle
+from raytracing import *
+
+
+class TestQuantileSketch(envtest.RaytracingTestCase):
+
+    def testEmpty(self):
+        sketch = QuantileSketch()
+        self.assertEqual(sketch.count, 0)
+        self.assertTrue(np.isnan(sketch.quantile(0.5)))
+
+    def testExactForFewValues(self):
+        values = np.arange(11.0)
+        sketch = QuantileSketch(compression=100).add(values)
+        self.assertTrue(np.allclose(sketch.quantile([0, 0.25, 0.5, 1]),
+                                    np.quantile(values, [0, 0.25, 0.5, 1], method="hazen")))
+
+    def testInvalidCompression(self):
+        with self.assertRaises(ValueError):
+            QuantileSketch(compression=1)
+
+    def testBoundedMemory(self):
+        sketch = QuantileSketch(compression=100)
+        for seed in range(10):
+            sketch.add(np.random.default_rng(seed).random(10000))
+        self.assertEqual(sketch.count, 100000)
+        self.assertLessEqual(len(sketch.means), 110)
+
+    def testQuantilesOfChunksAndMerge(self):
+        values = np.random.default_rng(1).standard_normal(200000)
+        sortedValues = np.sort(values)
+        q = np.array([0.001, 0.01, 0.1, 0.5, 0.9, 0.99, 0.999])
+
+        chunks = QuantileSketch()
+        for chunk in np.array_split(values, 17):
+            chunks.add(chunk)
+        merged = QuantileSketch()
+        for chunk in np.array_split(values, 8):
+            merged.merge(QuantileSketch().add(chunk))
+
+        for sketch in [chunks, merged]:
+            ranks = np.searchsorted(sortedValues, sketch.quantile(q)) / len(values)
+            self.assertTrue(np.all(np.abs(ranks - q) < 1e-3))
+            self.assertEqual(sketch.quantile(0), values.min())
+            self.assertEqual(sketch.quantile(1), values.max())
+
+
+class TestValueStatistics(envtest.RaytracingTestCase):
+
+    def testEmpty(self):
+        statistics = ValueStatistics()
+        self.assertEqual(statistics.count, 0)
+        self.assertTrue(np.isnan(statistics.mean))
+        self.assertTrue(np.isnan(statistics.variance))
+        self.assertTrue(np.isnan(statistics.minimum))
+
+    def testMomentsOfChunks(self):
+        values = np.random.default_rng(2).normal(loc=1000, scale=0.5, size=10000)
+        statistics = ValueStatistics()
+        for chunk in np.array_split(values, 7):
+            statistics.add(chunk)
+        statistics.add([])
+
+        self.assertEqual(statistics.count, 10000)
+        self.assertAlmostEqual(statistics.mean, values.mean())
+        self.assertAlmostEqual(statistics.variance, values.var())
+        self.assertAlmostEqual(statistics.standardDeviation, values.std())
+        self.assertAlmostEqual(statistics.rms, np.sqrt(np.mean(values ** 2)))
+        self.assertEqual(statistics.minimum, values.min())
+        self.assertEqual(statistics.maximum, values.max())
+
+    def testMerge(self):
+        values = np.random.default_rng(3).random(1000)
+        statistics = ValueStatistics().add(values[:100])
+        statistics.merge(ValueStatistics().add(values[100:]))
+        statistics.merge(ValueStatistics())
+        self.assertAlmostEqual(statistics.mean, values.mean())
+        self.assertAlmostEqual(statistics.variance, values.var())
+        self.assertAlmostEqual(statistics.percentile(50), np.median(values), places=2)
+
+
+class TestRayStatistics(envtest.RaytracingTestCase):
+
+    def testEmpty(self):
+        statistics = RayStatistics()
+        self.assertEqual(statistics.transmittedCount, 0)
+        self.assertTrue(np.isnan(statistics.transmittedFraction))
+        self.assertIsNotNone(str(statistics))
+
+    def testFillSkipsBlockedRays(self):
+        rays = [Ray(y=1), Ray(y=2), Ray(y=3, theta=0.1)]
+        rays[0].isBlocked = True
+        statistics = RayStatistics().fill(rays)
+        self.assertEqual(statistics.inputCount, 3)
+        self.assertEqual(statistics.transmittedCount, 2)
+        self.assertEqual(statistics.blockedCount, 1)
+        self.assertAlmostEqual(statistics.y.mean, 2.5)
+        self.assertAlmostEqual(statistics.theta.mean, 0.05)
+
+        statistics = RayStatistics().fill(CompactRays(rays=rays))
+        self.assertEqual(statistics.transmittedCount, 2)
+
+    def testFillWithInputCount(self):
+        statistics = RayStatistics().fill([Ray(y=1)], inputCount=4)
+        self.assertEqual(statistics.transmittedFraction, 0.25)
+        with self.assertRaises(ValueError):
+            statistics.fill([Ray(y=1), Ray(y=2)], inputCount=1)
+
+    def testMergeAfterPickle(self):
+        rays = list(RandomUniformRays(yMax=5, maxCount=1000, seed=1))
+        statistics = RayStatistics().fill(rays[:500], inputCount=600)
+        other = pickle.loads(pickle.dumps(RayStatistics().fill(rays[500:], inputCount=600)))
+        statistics.merge(other)
+        self.assertEqual(statistics.inputCount, 1200)
+        self.assertEqual(statistics.transmittedCount, 1000)
+        self.assertAlmostEqual(statistics.y.mean, np.mean([ray.y for ray in rays]))
+        with self.assertRaises(TypeError):
+            statistics.merge(RayHistogram(0, 1))
+
+    def testTraceManyStatistics(self):
+        path = ImagingPath([Space(d=10), Lens(f=10, diameter=8), Space(d=10)])
+        inputRays = RandomLambertianRays(yMax=5, maxCount=10000, seed=1)
+        outputRays = path.traceManyThrough(inputRays, progress=False)
+        yValues = np.array(outputRays.yValues)
+
+        for engine in ["native", "numpy"]:
+            statistics = path.traceManyStatistics(inputRays, chunkSize=3000, engine=engine, precision="float64")
+            self.assertEqual(statistics.inputCount, 10000)
+            self.assertEqual(statistics.transmittedCount, len(outputRays))
+            self.assertAlmostEqual(statistics.y.mean, yValues.mean())
+            self.assertAlmostEqual(statistics.y.rms, np.sqrt(np.mean(yValues ** 2)))
+            self.assertAlmostEqual(statistics.y.percentile(50), np.median(yValues), places=1)
+
+    def testTraceManyStatisticsUpdatesStatistics(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=1)])
+        statistics = path.traceManyStatistics([Ray(y=0), Ray(y=1)])
+        path.traceManyStatistics([Ray(y=0.1)], statistics=statistics)
+        self.assertEqual(statistics.inputCount, 3)
+        self.assertEqual(statistics.transmittedCount, 2)
+
+    def testTraceManyStatisticsInvalidArguments(self):
+        path = ImagingPath([Space(d=10)])
+        with self.assertRaises(ValueError):
+            path.traceManyStatistics([Ray()], chunkSize=0)
+        with self.assertRaises(ValueError):
+            path.traceManyStatistics([Ray()], engine="opencl")
+        with self.assertRaises(TypeError):
+            path.traceManyStatistics(1)
+
+
+if __name__ == '__main__':
+    envtest.main()
@@ -1,4 +1,5 @@
 import envtest  # modifies path
+import threading
 from raytracing import *
 
 inf = float("+inf")
@@ -132,6 +133,29 @@ class TestRays(envtest.RaytracingTestCase):
         r._thetaValues = thetaValues
         self.assertListEqual(r.thetaValues, thetaValues)
 
+    def testNestedIterationOverSameRays(self):
+        rays = Rays([Ray(y, 0) for y in range(5)])
+        pairs = [(ray1.y, ray2.y) for ray1 in rays for ray2 in rays]
+        self.assertEqual(len(pairs), 25)
+        self.assertEqual(pairs[6], (1, 1))
+
+    def testIterationFromManyThreads(self):
+        rays = RandomUniformRays(maxCount=2000)
+        counts = []
+        threads = [threading.Thread(target=lambda: counts.append(len([ray for ray in rays]))) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counts, [2000] * 4)
+        self.assertEqual(len(rays.rays), 2000)
+
+    def testDisplayProgressWithOwnCount(self):
+        rays = Rays([Ray(0, 0), Ray(1, 0)])
+        self.assertPrints(lambda: rays.displayProgress(iteration=2, progressLog=1), "Progress 2/2 (100%)")
+        self.assertEqual(rays.displayProgress(iteration=2, progressLog=1), 2)
+        self.assertEqual(rays.progressLog, 10000)
+
     def testDisplayProgress(self):
         rays = [Ray(0, 0)]
         rays = Rays(rays)
@@ -247,6 +271,42 @@ class TestRays(envtest.RaytracingTestCase):
         with self.assertRaises(TypeError):
             rays.append("This is a ray")
 
+    def testExtend(self):
+        r = Rays([Ray(1, 1)])
+        r.extend([Ray(), Ray(2, 2)])
+        self.assertListEqual(r.rays, [Ray(1, 1), Ray(), Ray(2, 2)])
+
+    def testExtendWithCopy(self):
+        ray = Ray(1, 1)
+        r = Rays()
+        r.extend([ray], copy=True)
+        self.assertEqual(r[0], ray)
+        self.assertIsNot(r[0], ray)
+
+    def testExtendFromGenerator(self):
+        r = Rays()
+        r.extend(Ray(y, 0) for y in range(3))
+        self.assertEqual(len(r), 3)
+
+    def testExtendInvalidateCachedValues(self):
+        r = Rays([Ray(1, 1), Ray()])
+        r.rayCountHistogram()
+        r.extend([Ray(2, 0)])
+        self.assertIsNone(r._yValues)
+        self.assertIsNone(r._yHistogram)
+        self.assertIsNone(r._countHistogramParameters)
+
+    def testExtendInvalidInput(self):
+        rays = Rays()
+        with self.assertRaises(TypeError):
+            rays.extend([Ray(), "This is a ray"])
+        self.assertEqual(len(rays), 0)
+
+    def testAppendMany(self):
+        r = Rays()
+        r.appendMany([Ray(1, 1), Ray()])
+        self.assertListEqual(r.rays, [Ray(1, 1), Ray()])
+
 
 
 
@@ -343,6 +403,70 @@ class TestRaysSaveAndLoad(envtest.RaytracingTestCase):
         self.assertLoadNotFailed(raysLoad, fileName)
         self.assertListEqual(raysLoad.rays, rays.rays)
 
+    def testSaveInvalidFormat(self):
+        with self.assertRaises(ValueError):
+            self.testRays.save(self.tempFilePath('rays.txt'), format="txt")
+
+    def testSaveNpyThenOpen(self):
+        fileName = self.tempFilePath('rays.npy')
+        self.testRays.save(fileName, format="npy")
+        rays = Rays.open(fileName)
+        self.assertIsInstance(rays, CompactRays)
+        self.assertEqual(rays.precision, "float32")
+        self.assertListEqual(list(rays), self.testRays.rays)
+
+    def testSaveNpyIsStandardNpy(self):
+        fileName = self.tempFilePath('rays.npy')
+        self.testRays.save(fileName, format="npy", precision="float64")
+        array = np.load(fileName)
+        self.assertEqual(array.dtype, CompactRay.Struct64)
+        self.assertListEqual(array['y'].tolist(), [0, 1, -1, -1])
+
+    def testOpenIsMemoryMappedAndReadOnly(self):
+        fileName = self.tempFilePath('rays.npy')
+        self.testRays.save(fileName, format="npy")
+        rays = Rays.open(fileName)
+        with self.assertRaises(ValueError):
+            rays[0].y = 10
+
+        rays = Rays.open(fileName, mmap=False)
+        rays[0].y = 10
+        self.assertEqual(rays[0].y, 10)
+
+    def testTraceOpenedRaysInPlace(self):
+        fileName = self.tempFilePath('rays.npy')
+        inputRays = RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=1000, seed=1)
+        inputRays.save(fileName, format="npy")
+        path = ImagingPath([Space(d=10), Aperture(diameter=1)])
+        outputRays = path.traceManyThroughNumpy(Rays.open(fileName))
+        expected = path.traceManyThroughNumpy(CompactRays(rays=inputRays))
+        self.assertTrue(np.array_equal(outputRays._rays['y'], expected._rays['y']))
+
+    def testLoadNpy(self):
+        fileName = self.tempFilePath('rays.npy')
+        self.testRays.save(fileName, format="npy")
+        rays = Rays([Ray(5, 5)])
+        rays.load(fileName, append=True)
+        self.assertListEqual(rays.rays, [Ray(5, 5)] + self.testRays.rays)
+        self.assertIsInstance(rays[1], Ray)
+
+    def testOpenPickleFile(self):
+        with self.assertRaises(IOError):
+            Rays.open(self.fileName)
+
+    def testOpenNpyFileWithoutRays(self):
+        fileName = self.tempFilePath('notRays.npy')
+        np.save(fileName, np.zeros(3))
+        with self.assertRaises(IOError):
+            Rays.open(fileName)
+
+    def testSaveCompactRaysAsPickle(self):
+        fileName = self.tempFilePath('compact.pkl')
+        CompactRays(rays=self.testRays).save(fileName)
+        rays = Rays()
+        rays.load(fileName)
+        self.assertListEqual(rays.rays, self.testRays.rays)
+
     @envtest.skipIf(not testSaveHugeFile, "Don't test saving then loading a lot of rays")
     def testSaveThenLoadHugeFile(self):
         nbRays = 10_000
@@ -36,6 +36,65 @@ class TestUniformRays(envtest.RaytracingTestCase):
         self.assertEqual(rays.N, 100)
         # self.assertListEqual(rays, raysList)
 
+    def testRaysGridOrder(self):
+        rays = UniformRays(1, -1, 1, -1, 10, 11)
+        raysList = []
+        for y in np.linspace(-1, 1, 10):
+            for theta in np.linspace(-1, 1, 11):
+                raysList.append(Ray(y, theta))
+        self.assertListEqual(rays.rays, raysList)
+
+    def testRaysSingleHeight(self):
+        rays = UniformRays(1, -1, 1, -1, 1, 3)
+        self.assertListEqual(rays.rays, [Ray(0, -1), Ray(0, 0), Ray(0, 1)])
+
+    def testRaysValuesFromGrid(self):
+        rays = UniformRays(1, -1, 1, -1, 3, 2)
+        self.assertListEqual(rays.yValues, [-1, -1, 0, 0, 1, 1])
+        self.assertListEqual(rays.thetaValues, [-1, 1, -1, 1, -1, 1])
+
+    def testCompactRaysFromGrid(self):
+        rays = UniformRays(1, -1, 1, -1, 4, 5)
+        compactRays = CompactRays(rays=rays)
+        expected = CompactRays(rays=list(rays))
+        for field in compactRays._rays.dtype.names:
+            self.assertTrue(np.array_equal(compactRays._rays[field], expected._rays[field], equal_nan=True))
+
+    def testCompactRaysFromGridWithoutRayObjects(self):
+        for rays in [UniformRays(1, -1, 1, -1, 4, 5), LambertianRays(M=3, N=5, I=4), ObjectRays(2, H=3, T=3),
+                     LampRays(2, N=3, T=2)]:
+            compactRays = CompactRays(rays=rays)
+            columnarRays = ColumnarRays(rays=rays)
+            self.assertNotIn("_rays", rays.__dict__)
+            self.assertEqual(len(rays), len(compactRays))
+            self.assertTrue(np.array_equal(columnarRays.yValues, compactRays._rays['y']))
+            self.assertEqual(compactRays._rays.tobytes(), CompactRays(rays=list(rays))._rays.tobytes())
+
+    def testCompactRaysFromGridAfterRayChanged(self):
+        rays = UniformRays(1, -1, 1, -1, 2, 2)
+        rays[0].y = 7
+        rays[1].isBlocked = True
+        rays[2].z = 3
+        compactRays = CompactRays(rays=rays)
+        self.assertEqual(compactRays[0].y, 7)
+        self.assertTrue(compactRays[1].isBlocked)
+        self.assertFalse(compactRays[0].isBlocked)
+        self.assertEqual(compactRays[2].z, 3)
+
+    def testCompactRaysFromGridAfterRaysBlocked(self):
+        rays = UniformRays(yMax=10, yMin=-10, thetaMax=0, thetaMin=0, M=5, N=1)
+        MatrixGroup([Space(d=1, diameter=2)]).traceManyNative(rays)
+        compactRays = CompactRays(rays=rays)
+        self.assertListEqual([ray.isBlocked for ray in compactRays], [ray.isBlocked for ray in rays])
+        self.assertTrue(compactRays[0].isBlocked)
+
+    def testCompactRaysFromGridAfterAppend(self):
+        rays = UniformRays(1, -1, 1, -1, 2, 2)
+        rays.append(Ray(5, 0))
+        compactRays = CompactRays(rays=rays)
+        self.assertEqual(len(compactRays), 5)
+        self.assertEqual(compactRays[4].y, 5)
+
 
 class TestLambertianRays(envtest.RaytracingTestCase):
 
@@ -69,6 +128,32 @@ class TestLambertianRays(envtest.RaytracingTestCase):
         self.assertEqual(rays.I, 100)
         # self.assertListEqual(rays.rays, raysList)
 
+    def testLambertianRaysGridOrder(self):
+        rays = LambertianRays(1, -1, 10, 11, 12)
+        raysList = []
+        for theta in np.linspace(-pi / 2, pi / 2, 11):
+            intensity = int(12 * np.cos(theta))
+            for y in np.linspace(-1, 1, 10):
+                for _ in range(intensity):
+                    raysList.append(Ray(y, theta))
+        self.assertListEqual(rays.rays, raysList)
+
+
+class TestObjectAndLampRays(envtest.RaytracingTestCase):
+
+    def testObjectRaysGridOrder(self):
+        rays = ObjectRays(diameter=2, halfAngle=0.5, H=3, T=2, rayColors=['r', 'g'])
+        self.assertListEqual(rays.rays, [Ray(-1, -0.5), Ray(-1, 0.5), Ray(0, -0.5), Ray(0, 0.5),
+                                         Ray(1, -0.5), Ray(1, 0.5)])
+        self.assertListEqual(rays.rayColors, ['r', 'g'])
+
+    def testLampRaysGridOrder(self):
+        rays = LampRays(diameter=2, NA=0.5, N=2, T=3, z=1)
+        self.assertListEqual(rays.rays, [Ray(-1, -0.5), Ray(-1, 0), Ray(-1, 0.5),
+                                         Ray(1, -0.5), Ray(1, 0), Ray(1, 0.5)])
+        self.assertEqual(rays.z, 1)
+        self.assertEqual(len(rays), 6)
+
 
 class TestRandomRays(envtest.RaytracingTestCase):
 
@@ -82,6 +167,11 @@ class TestRandomRays(envtest.RaytracingTestCase):
         with self.assertRaises(NotImplementedError):
             rays.randomRay()
 
+    def testRandomRayArraysNotImplemented(self):
+        rays = RandomRays()
+        with self.assertRaisesRegex(NotImplementedError, "randomRayArrays"):
+            rays.randomRayArrays(np.random, 10)
+
     def testRandomRayNext(self):
         rays = RandomRays()
         with self.assertRaises(NotImplementedError):
@@ -121,6 +211,84 @@ class TestRandomRays(envtest.RaytracingTestCase):
         with self.assertRaises(IndexError):
             rays[-6]
 
+    def testSameSeedGivesSameRays(self):
+        rays1 = RandomUniformRays(maxCount=100, seed=42)
+        rays2 = RandomUniformRays(maxCount=100, seed=42)
+        self.assertListEqual(list(rays1), list(rays2))
+
+    def testDifferentSeedsGiveDifferentRays(self):
+        rays1 = RandomUniformRays(maxCount=100, seed=1)
+        rays2 = RandomUniformRays(maxCount=100, seed=2)
+        self.assertNotEqual(list(rays1), list(rays2))
+
+    def testSeededRaysDoNotUseGlobalRandomState(self):
+        np.random.seed(1)
+        rays1 = RandomLambertianRays(maxCount=10, seed=42)
+        list(rays1)
+        np.random.seed(2)
+        rays2 = RandomLambertianRays(maxCount=10, seed=42)
+        self.assertListEqual(list(rays1), list(rays2))
+
+    def testSeededBlockDependsOnlyOnSeedAndBlock(self):
+        blockSize = RandomRays.randomBlockSize
+        rays = RandomUniformRays(maxCount=2 * blockSize, seed=5)
+        ray = rays[blockSize]
+
+        seedSequence = np.random.SeedSequence(5)
+        child = seedSequence.spawn(2)[1]
+        random = np.random.default_rng(child)
+        theta = rays.thetaMin + random.random() * (rays.thetaMax - rays.thetaMin)
+        y = rays.yMin + random.random() * (rays.yMax - rays.yMin)
+        self.assertEqual(ray, Ray(y, theta))
+
+    def testSeedWithGenerator(self):
+        generator = np.random.default_rng(3)
+        rays1 = RandomUniformRays(maxCount=10, seed=generator)
+        rays2 = RandomUniformRays(maxCount=10, seed=generator)
+        self.assertNotEqual(list(rays1), list(rays2))
+
+        generator = np.random.default_rng(3)
+        self.assertListEqual(list(RandomUniformRays(maxCount=10, seed=generator)), list(rays1))
+
+    def testSubclassWithOnlyRandomRayKeepsItsDistribution(self):
+        class PositiveRays(RandomUniformRays):
+            def randomRay(self):
+                ray = Ray(y=1, theta=0)
+                self.append(ray)
+                return ray
+
+        rays = PositiveRays(maxCount=10)
+        self.assertFalse(rays.hasRandomRayArrays())
+        self.assertTrue(all(ray.y == 1 for ray in rays))
+        self.assertTrue(RandomUniformRays(maxCount=10).hasRandomRayArrays())
+
+    def testGetGeneratesMissingRaysInBlocks(self):
+        rays = RandomUniformRays(maxCount=2 * RandomRays.randomBlockSize, seed=1)
+        rays[1]
+        self.assertEqual(len(rays._rays), RandomRays.randomBlockSize)
+
+    def testCompactRaysFromRandomRaysSameAsIteration(self):
+        for source in [lambda: RandomUniformRays(maxCount=5000, seed=4),
+                       lambda: RandomLambertianRays(maxCount=5000, seed=4),
+                       lambda: GaussianProfileUniformRays(intensityWidth=2, maxCount=5000, seed=4)]:
+            rays = source()
+            rays[10]  # Some rays are already generated
+            compactRays = CompactRays(rays=rays)
+            expected = CompactRays(rays=list(source()))
+            for field in ["y", "theta", "z", "isBlocked", "apertureDiameter"]:
+                self.assertTrue(np.array_equal(compactRays._rays[field], expected._rays[field]))
+            self.assertTrue(np.all(np.isnan(compactRays._rays['wavelength'])))
+
+    def testSeededRaysTracedWithAnyNumberOfProcesses(self):
+        path = ImagingPath([Space(d=10), Aperture(diameter=1)])
+        rays = RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=200, seed=11)
+        reference = path.traceManyThrough(rays, progress=False)
+        for processes in [1, 2]:
+            outputRays = path.traceManyThroughInParallel(RandomUniformRays(yMax=1, thetaMax=0.1, maxCount=200, seed=11),
+                                                         processes=processes, progress=False)
+            self.assertEqual(len(outputRays), len(reference))
+            self.assertListEqual([ray.y for ray in outputRays], [ray.y for ray in reference])
+
 
 class TestRandomUniformRays(envtest.RaytracingTestCase):
 
@@ -273,6 +441,20 @@ class TestRandomLambertianRays(envtest.RaytracingTestCase):
         for i in range(len(allRays)):
             self.assertEqual(allRays[i], rays[i])
 
+    def testRandomLambertianRaysDistribution(self):
+        rays = CompactRays(rays=RandomLambertianRays(maxCount=100000, seed=2))
+        theta = rays._rays['theta']
+        self.assertTrue(np.all(np.abs(theta) <= np.pi / 2))
+        # The variance of theta for a density cos(theta) is pi^2/4 - 2
+        self.assertAlmostEqual(np.var(theta), np.pi ** 2 / 4 - 2, delta=0.01)
+
+    def testGaussianProfileUniformRaysDistribution(self):
+        rays = CompactRays(rays=GaussianProfileUniformRays(intensityWidth=2, maxCount=100000, seed=2))
+        y = rays._rays['y']
+        self.assertTrue(np.all(np.abs(y) <= 8))
+        # An intensity exp(-y^2/w^2) is a normal distribution of variance w^2/2
+        self.assertAlmostEqual(np.var(y), 2, delta=0.05)
+
     def testRandomLambertianRaysGetOutOfBoundsPositive(self):
         rays = RandomLambertianRays()
         item = int(1e10)
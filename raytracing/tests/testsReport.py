@@ -61,5 +61,57 @@ class TestReport(envtest.RaytracingTestCase):
         self.assertTrue(diameter != float("+inf"))
 
 
+class TestInvariantCoefficients(envtest.RaytracingTestCase):
+
+    def setUp(self):
+        self.path = ImagingPath([Space(d=50), Lens(f=50, diameter=25), Space(d=50), Lens(f=50, diameter=25),
+                                 Space(d=50), Aperture(diameter=10)])
+        super().setUp()
+
+    def testPrincipalAndAxialRays(self):
+        coefficients = self.path.invariantCoefficients([self.path.principalRay(), self.path.axialRay()])
+        self.assertTrue(np.allclose(coefficients.A, [1, 0]))
+        self.assertTrue(np.allclose(coefficients.B, [0, 1]))
+
+    def testSameAsOpticalInvariants(self):
+        rays = list(RandomUniformRays(yMax=8, yMin=-8, thetaMax=0.5, thetaMin=-0.5, maxCount=200, seed=1))
+        principal = self.path.principalRay()
+        axial = self.path.axialRay()
+        Iap = abs(self.path.lagrangeInvariant())
+
+        coefficients = self.path.invariantCoefficients(rays)
+        self.assertEqual(len(coefficients.A), len(rays))
+        for ray, A, B in zip(rays, coefficients.A, coefficients.B):
+            self.assertAlmostEqual(A, self.path.opticalInvariant(axial, ray) / Iap)
+            self.assertAlmostEqual(B, self.path.opticalInvariant(ray, principal) / Iap)
+
+    def testCompactAndColumnarRays(self):
+        rays = list(RandomUniformRays(yMax=5, maxCount=100, seed=2))
+        expected = self.path.invariantCoefficients(rays)
+        for otherRays in [CompactRays(rays=rays, precision="float64"), ColumnarRays(rays=rays, precision="float64")]:
+            coefficients = self.path.invariantCoefficients(otherRays)
+            self.assertTrue(np.allclose(coefficients.A, expected.A))
+            self.assertTrue(np.allclose(coefficients.B, expected.B))
+
+    def testExpectedBlockedRaysAreBlocked(self):
+        rays = CompactRays(rays=RandomUniformRays(yMax=8, yMin=-8, thetaMax=0.5, thetaMin=-0.5, maxCount=5000, seed=3))
+        coefficients = self.path.invariantCoefficients(rays)
+        isOutside = (np.abs(coefficients.A) > 1 + 1e-6) | (np.abs(coefficients.B) > 1 + 1e-6)
+        isBlocked = self.path.traceManyBlockingNumpy(rays).elementIndex >= 0
+        self.assertTrue(np.all(isBlocked[isOutside]))
+
+    def testNoFieldStopRaises(self):
+        path = ImagingPath([Space(d=50), Lens(f=50, diameter=10), Space(d=50)])
+        with self.assertRaises(ValueError):
+            path.invariantCoefficients([Ray()])
+
+    @envtest.patchMatplotLib()
+    def testReportEfficiencyManyRays(self):
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            self.path.reportEfficiency(nRays=100000)
+        self.assertIn("Loss to vignetting", stdout.getvalue())
+
+
 if __name__ == '__main__':
     envtest.main()
@@ -1,5 +1,5 @@
 import envtest # modifies path  # fixme: requires path to raytracing/tests
-from raytracing.utils import checkLatestVersion
+from raytracing.utils import checkLatestVersion, wilsonInterval
 
 import io
 import contextlib
@@ -17,5 +17,25 @@ class TestUtils(envtest.RaytracingTestCase):
             self.assertFalse(checkLatestVersion(currentVersion="1.4.0"))
         self.assertTrue(len(f.getvalue()) == 0)
 
+    def testWilsonInterval(self):
+        lower, upper = wilsonInterval(5, 10)
+        self.assertAlmostEqual(lower, 0.2366, places=4)
+        self.assertAlmostEqual(upper, 0.7634, places=4)
+
+    def testWilsonIntervalExtremes(self):
+        lower, upper = wilsonInterval(0, 10)
+        self.assertAlmostEqual(lower, 0)
+        self.assertAlmostEqual(upper, 0.2775, places=4)
+        self.assertEqual(wilsonInterval(1000, 1000)[1], 1.0)
+        self.assertEqual(wilsonInterval(0, 0), (0.0, 1.0))
+
+    def testWilsonIntervalWiderWithConfidence(self):
+        lower95, upper95 = wilsonInterval(30, 100, confidence=0.95)
+        lower99, upper99 = wilsonInterval(30, 100, confidence=0.99)
+        self.assertLess(lower99, lower95)
+        self.assertGreater(upper99, upper95)
+        with self.assertRaises(ValueError):
+            wilsonInterval(30, 100, confidence=1)
+
 if __name__ == '__main__':
     envtest.main()
@@ -0,0 +1,102 @@
+"""Compiled trace plans: the minimal sequence of steps to trace rays through a group.
+
+Most elements of a real optical path (``Space``, lenses of infinite diameter,
+the identity matrices used for padding) cannot block a ray: for them, tracing
+a ray is a simple matrix multiplication. Only elements with a finite
+``apertureDiameter`` or ``apertureNA`` (the *checkpoints*) need to be traced
+individually. A ``TracePlan`` multiplies each run of non-limiting elements
+into a single ABCD matrix and keeps the checkpoints as they are, so that
+tracing costs O(number of apertures) instead of O(number of elements).
+
+The plan is obtained with ``MatrixGroup.compile()`` and is used automatically
+by ``traceThrough()`` and ``traceManyThrough()``, when only the output rays
+are requested. ``trace()`` still goes through every element to give the
+complete ray trace.
+
+See Also
+--------
+raytracing.MatrixGroup.compile
+"""
+
+
+class TracePlan:
+    """An immutable sequence of steps that gives the same output rays as
+    tracing through all the elements of a group. Each step is a Matrix:
+    either a checkpoint element that can block rays, or the product of a run
+    of consecutive elements that cannot.
+
+    Parameters
+    ----------
+    steps : list of Matrix
+        The matrices to trace through, in order.
+    elementIndices : list of int
+        For each step, the index (in transferMatrices() of the group) of the
+        last element included in the step.
+    isCheckpoint : list of bool
+        For each step, True if it is an element that can block rays.
+
+    See Also
+    --------
+    raytracing.MatrixGroup.compile
+    """
+
+    def __init__(self, steps, elementIndices, isCheckpoint):
+        if not len(steps) == len(elementIndices) == len(isCheckpoint):
+            raise ValueError("There must be one element index and one checkpoint flag for each step.")
+
+        self._steps = tuple(steps)
+        self._elementIndices = tuple(elementIndices)
+        self._isCheckpoint = tuple(isCheckpoint)
+
+    @property
+    def steps(self):
+        """ The matrices to trace through, in order (tuple) """
+        return self._steps
+
+    @property
+    def elementIndices(self):
+        """ For each step, the index of the last element of the group included
+        in the step (tuple) """
+        return self._elementIndices
+
+    @property
+    def isCheckpoint(self):
+        """ For each step, True if it is an element that can block rays (tuple) """
+        return self._isCheckpoint
+
+    @property
+    def checkpoints(self):
+        """ The steps that can block rays (tuple) """
+        return tuple([step for step, isCheckpoint in zip(self._steps, self._isCheckpoint) if isCheckpoint])
+
+    def __len__(self):
+        return len(self._steps)
+
+    def __iter__(self):
+        return iter(self._steps)
+
+    def __str__(self):
+        return "TracePlan: {0} steps, {1} checkpoints".format(len(self._steps), len(self.checkpoints))
+
+    def traceThrough(self, inputRay):
+        """ The last ray after tracing inputRay through all the steps of the plan,
+        with the same blocking logic as Matrix.traceThrough(). A blocked ray
+        is not modified by the following elements: we stop as soon as the
+        ray is blocked.
+
+        Parameters
+        ----------
+        inputRay : Ray
+            The ray to trace.
+
+        Returns
+        -------
+        outputRay : Ray
+            The ray at the back edge of the group, which may be blocked.
+        """
+        ray = inputRay
+        for step in self._steps:
+            if ray.isBlocked:
+                break
+            ray = step.traceThrough(ray)
+        return ray
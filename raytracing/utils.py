@@ -1,4 +1,5 @@
 import math
+import statistics
 import warnings
 import inspect
 import sys
@@ -118,6 +119,41 @@ def isNotZero(value, epsilon=1e-3):
     return abs(value) > epsilon
 
 
+def wilsonInterval(successes, count, confidence=0.95):
+    """
+    The Wilson score interval of a proportion: the range of the probability of
+    success that is compatible with successes out of count trials, at the given
+    confidence. Unlike the normal approximation, it remains valid for
+    proportions close to 0 or 1 and for few trials.
+
+    Parameters
+    ----------
+    successes : int
+        The number of successes.
+    count : int
+        The number of trials.
+    confidence : float
+        The probability that the interval contains the true proportion (default=0.95).
+
+    Returns
+    -------
+    (lower, upper) : tuple of float
+        The limits of the interval, (0, 1) without trials.
+
+    """
+    if not 0 < confidence < 1:
+        raise ValueError("The confidence must be between 0 and 1, not {0}".format(confidence))
+    if count == 0:
+        return (0.0, 1.0)
+
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    p = successes / count
+    denominator = 1 + z * z / count
+    center = (p + z * z / (2 * count)) / denominator
+    halfWidth = z / denominator * math.sqrt(p * (1 - p) / count + z * z / (4 * count * count))
+    return (max(0.0, center - halfWidth), min(1.0, center + halfWidth))
+
+
 def areAbsolutelyAlmostEqual(left, right, epsilon=1e-3):
     """
     Convenience function for readability: checks if a two numbers are almost equal by comparing their difference to epsilon.